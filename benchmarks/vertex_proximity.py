@@ -0,0 +1,79 @@
+"""
+Compares the vertex-proximity fallback of the assembly contact test: the old
+pure-Python double loop against the KD-tree query in utils.proximity.
+
+Runs without OCC on synthetic vertex clouds shaped like two neighbouring
+parts that do not touch, which is the worst case for both (no early exit).
+
+    python benchmarks/vertex_proximity.py --sizes 1000 5000 20000 50000
+"""
+import os
+import sys
+import math
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+from utils.proximity import any_pair_within, build_tree
+
+
+def double_loop(vertices1, vertices2, tolerance):
+    for v1 in vertices1:
+        for v2 in vertices2:
+            dist = math.sqrt(
+                (v1[0] - v2[0]) ** 2 +
+                (v1[1] - v2[1]) ** 2 +
+                (v1[2] - v2[2]) ** 2
+            )
+            if dist <= tolerance:
+                return True
+    return False
+
+
+def make_part(rng, n, offset):
+    points = rng.uniform(0.0, 100.0, size=(n, 3))
+    points[:, 0] = points[:, 0] * 0.5 + offset
+    return points
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vertex-proximity fallback.")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[1000, 5000, 20000, 50000],
+                        help="Number of vertices per part")
+    parser.add_argument("--loop-limit", type=int, default=5000,
+                        help="Largest size timed with the double loop; larger sizes are extrapolated")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tolerance = 0.01
+    loop_reference = None
+
+    print(f"{'vertices':>10} {'double loop (s)':>18} {'kd-tree (s)':>12} {'speed-up':>10}")
+    for n in args.sizes:
+        vertices1 = make_part(rng, n, 0.0)
+        vertices2 = make_part(rng, n, 60.0)  # 10 units apart along x
+
+        start = time.perf_counter()
+        tree = build_tree(vertices2)
+        found = any_pair_within(vertices1, vertices2, tolerance, tree2=tree)
+        tree_seconds = time.perf_counter() - start
+
+        if n <= args.loop_limit:
+            pairs1, pairs2 = vertices1.tolist(), vertices2.tolist()
+            start = time.perf_counter()
+            assert double_loop(pairs1, pairs2, tolerance) == found
+            loop_seconds = time.perf_counter() - start
+            loop_reference = (n, loop_seconds)
+            loop_label = f"{loop_seconds:.3f}"
+        elif loop_reference is not None:
+            ref_n, ref_seconds = loop_reference
+            loop_seconds = ref_seconds * (n / ref_n) ** 2
+            loop_label = f"~{loop_seconds:.1f} (est.)"
+        else:
+            loop_seconds = None
+            loop_label = "-"
+
+        speed_up = f"{loop_seconds / tree_seconds:.0f}x" if loop_seconds else "-"
+        print(f"{n:>10} {loop_label:>18} {tree_seconds:>12.4f} {speed_up:>10}")
@@ -1,85 +1,173 @@
+import time
+import numpy as np
 import networkx as nx
-from rtree import index
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 from pyvis.network import Network
 import os
+import re
+import json
+
+from utils.part_geometry import PartGeometry, GeometryCacheStats
+from graphs.contact_pipeline import ContactPipeline
+from graphs.parallel_contacts import ParallelContactChecker, CHUNK_SIZE
+from graphs.broad_phase import candidate_pairs, pair_tolerances
+from graphs.contact_memo import ContactMemo
+from rendering.atlas import ImageAtlas
+from rendering.image_map import load_image_map
+
+# Image of an atlas thumbnail node until the HTML export fills in the data URI
+ATLAS_IMAGE_PREFIX = 'atlas-image:'
+# Statement of the pyvis template before which the thumbnails are filled in
+VIS_NETWORK_MARKER = 'network = new vis.Network('
+
+def unique_node_ids(names):
+    """
+    One id per part: its name, with _1, _2, ... appended to repeated names.
+    Unnamed parts become unnamed_part_<n>, as for the part images.
+    """
+    ids = []
+    taken = set()
+    for i, name in enumerate(names):
+        base = name if name else f"unnamed_part_{i+1}"
+        node_id = base
+        counter = 1
+        while node_id in taken:
+            node_id = f"{base}_{counter}"
+            counter += 1
+        taken.add(node_id)
+        ids.append(node_id)
+    return ids
 
-from utils.shape_utils import ShapeUtils
 
 class AssemblyGraph:
-    def __init__(self, parts, filename, no_self_connections=False, images_folder=None):
+    """
+    Contact graph of the parts of one assembly.
+
+    Parts are identified by their index in parts, so parts sharing a name stay
+    separate nodes. Edges are kept as an (m, 2) array of part indices with
+    i < j; to_networkx() builds an nx.Graph only for exporters that need one.
+    """
+    def __init__(self, parts, filename, no_self_connections=False, images_folder=None, contact_workers=1,
+                 broad_phase='sweep', part_prototypes=None, part_locations=None):
         self.parts = parts
         self.filename = filename
-        self.graph = nx.Graph()
+        self.names = [name for name, _ in parts]
+        self.node_ids = unique_node_ids(self.names)
+        self.edges = np.empty((0, 2), dtype=np.int64)
+        self._adjacency = None
         self.no_self_connections = no_self_connections
         self.images_folder = images_folder
-        
-        p = index.Property()
-        p.dimension = 3
-        self.idx = index.Index(properties=p)
-
-        # Precompute bounding boxes and insert into R-tree
-        self.bounding_boxes = {}
-        for i, (name, shape) in enumerate(self.parts):
-            bbox = ShapeUtils.get_bounding_box(shape)
-            bbox_coords = (
-                bbox.CornerMin().X(),
-                bbox.CornerMin().Y(),
-                bbox.CornerMin().Z(),
-                bbox.CornerMax().X(),
-                bbox.CornerMax().Y(),
-                bbox.CornerMax().Z()
-            )
-            self.bounding_boxes[name] = bbox_coords
-            self.idx.insert(i, bbox_coords)
+        self.contact_workers = contact_workers
+        self.broad_phase = broad_phase
+        self.broad_phase_stats = None
+        self.diagonals = None
+
+        # Build each part's geometry record once
+        self.cache_stats = GeometryCacheStats()
+        self.geometry = [PartGeometry(shape, self.cache_stats) for _, shape in self.parts]
+        self.contacts = ContactPipeline()
+        # Repeated prototype pairs in the same relative placement are tested once
+        self.memo = ContactMemo(part_prototypes, part_locations)
 
     def create(self, pbar):
-        # Add all nodes first
-        for name, _ in self.parts:
-            self.graph.add_node(name)
-
-        # Iterate through each part and find potential connections
-        for i, (name1, shape1) in enumerate(self.parts):
-            bbox1 = self.bounding_boxes[name1]
-            tolerance = ShapeUtils.get_tolerance(shape1)
-
-            # Expand the bounding box by tolerance for searching
-            expanded_bbox = (
-                bbox1[0] - tolerance,
-                bbox1[1] - tolerance,
-                bbox1[2] - tolerance,
-                bbox1[3] + tolerance,
-                bbox1[4] + tolerance,
-                bbox1[5] + tolerance
-            )
+        first, second = self.candidate_pairs()
+        pbar.reset(total=len(first))
+
+        representatives, group_of = self.memo.group(first, second, pair_tolerances(self.diagonals, first, second))
+        group_sizes = np.bincount(group_of, minlength=len(representatives)).tolist()
+        pairs = list(zip(first[representatives].tolist(), second[representatives].tolist()))
+
+        if self.contact_workers > 1 and len(pairs) > CHUNK_SIZE:
+            checker = ParallelContactChecker(self.contact_workers)
+            connected = set(checker.run([shape for _, shape in self.parts], pairs, self.contacts, pbar,
+                                        weights=group_sizes, cache_stats=self.cache_stats))
+        else:
+            connected = set()
+            for (i, j), size in zip(pairs, group_sizes):
+                if self.contacts.are_connected(self.geometry[i], self.geometry[j]):
+                    connected.add((i, j))
+                pbar.update(size)
+
+        # Every pair takes the result of its group's tested pair. Pairs stay in
+        # (i, j) order, so the graph does not depend on the worker count.
+        group_connected = np.array([pair in connected for pair in pairs], dtype=bool)
+        keep = group_connected[group_of]
+        self.edges = np.column_stack((first[keep], second[keep])).astype(np.int64)
+        self._adjacency = None
+
+    def number_of_nodes(self):
+        return len(self.names)
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    def adjacency(self):
+        """
+        Returns the CSR adjacency (indptr, indices): the neighbours of part i
+        are indices[indptr[i]:indptr[i + 1]], sorted.
+        """
+        if self._adjacency is None:
+            sources = np.concatenate((self.edges[:, 0], self.edges[:, 1]))
+            targets = np.concatenate((self.edges[:, 1], self.edges[:, 0]))
+            order = np.lexsort((targets, sources))
+            indptr = np.zeros(self.number_of_nodes() + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sources, minlength=self.number_of_nodes()), out=indptr[1:])
+            self._adjacency = (indptr, targets[order])
+        return self._adjacency
+
+    def degrees(self):
+        indptr, _ = self.adjacency()
+        return np.diff(indptr)
+
+    def to_networkx(self):
+        """
+        Builds an nx.Graph with the node ids as nodes and the part name as
+        the 'name' attribute.
+        """
+        graph = nx.Graph()
+        graph.add_nodes_from((node_id, {'name': name or ''}) for node_id, name in zip(self.node_ids, self.names))
+        graph.add_edges_from((self.node_ids[i], self.node_ids[j]) for i, j in self.edges.tolist())
+        return graph
 
-            # Query the R-tree for possible overlapping shapes
-            possible_matches = list(self.idx.intersection(expanded_bbox, objects=False))
+    def candidate_pairs(self):
+        """
+        Returns the pairs with i < j whose bounding boxes are within the pair
+        tolerance as two index arrays, sorted.
+        """
+        start = time.perf_counter()
+        boxes = np.array([part.bounding_box() for part in self.geometry], dtype=np.float64).reshape(-1, 6)
+        self.diagonals = np.array([part.size() for part in self.geometry], dtype=np.float64)
+        first, second = candidate_pairs(boxes, self.diagonals, self.broad_phase)
 
-            for j in possible_matches:
-                if j <= i:
-                    continue  # Avoid duplicate checks and self-comparison
+        if self.no_self_connections and len(first):
+            _, name_ids = np.unique([name for name, _ in self.parts], return_inverse=True)
+            keep = name_ids[first] != name_ids[second]
+            first, second = first[keep], second[keep]
 
-                name2, shape2 = self.parts[j]
-                
-                if self.no_self_connections and name1 == name2:
-                    continue
-                
-                if ShapeUtils.are_connected(shape1, shape2):
-                    self.graph.add_edge(name1, name2)
-                pbar.update(1)
+        self.broad_phase_stats = {
+            'method': self.broad_phase,
+            'candidates': int(len(first)),
+            'seconds': round(time.perf_counter() - start, 3)
+        }
+        return first, second
+
+    def columns(self):
+        """
+        Node columns, categories, edges and directedness for graphs.writers.
+        """
+        return {'id': self.node_ids, 'name': [name or '' for name in self.names]}, {}, self.edges, False
 
     def save_graphml(self, output_file):
-        nx.write_graphml(self.graph, output_file)
+        nx.write_graphml(self.to_networkx(), output_file)
 
     def save_pdf(self, output_file):
+        graph = self.to_networkx()
         plt.figure(figsize=(20, 20))
-        pos = nx.kamada_kawai_layout(self.graph)
-        nx.draw(self.graph, pos, with_labels=False, node_color='lightblue',
+        pos = nx.kamada_kawai_layout(graph)
+        nx.draw(graph, pos, with_labels=False, node_color='lightblue',
                 node_size=3000, font_size=8, font_weight='bold')
 
-        nx.draw_networkx_labels(self.graph, pos, font_size=6, font_weight='bold')
+        nx.draw_networkx_labels(graph, pos, font_size=6, font_weight='bold')
 
         plt.title("Assembly Graph", fontsize=16)
         plt.axis('off')
@@ -89,18 +177,53 @@ class AssemblyGraph:
                     dpi=300, bbox_inches='tight')
         plt.close()
     
-    def save_html(self, output_file):
+    def save_html(self, output_file, pending_images=None):
         """
         Saves the assembly graph as an interactive HTML file with movable nodes and images.
+
+        pending_images is (image map, atlas) for images that are still being
+        rendered: the nodes show them as they will be saved, and atlas
+        thumbnails are left for embed_atlas_images() to fill in. Returns the
+        names of the atlas images in the order embed_atlas_images() takes
+        their data URIs.
         """
         net = Network(height='750px', width='100%', notebook=False)
         net.show_buttons(filter_=['physics'])
 
+        # Thumbnails are embedded from the image atlas when the images have one
+        atlas = None
+        atlas_names = set()
+        pending_pngs = set()
+        if pending_images is not None:
+            image_map, pending_atlas = pending_images
+            if pending_atlas:
+                atlas_names = set(image_map.values())
+            else:
+                pending_pngs = set(image_map.values())
+        else:
+            atlas = ImageAtlas.find(self.images_folder)
+            if atlas is not None:
+                atlas_names = set(atlas.names())
+            # Instances of one prototype share the image named in the image map
+            image_map = load_image_map(self.images_folder) or {}
+        # Each thumbnail is embedded once, however many instances show it;
+        # the nodes refer to it by its index in atlas_images
+        atlas_images = {}
         if self.images_folder:
-            for node_name in self.graph.nodes:
-                image_filename = f"{node_name}.png"
+            for node_name in self.node_ids:
+                safe_node_name = image_map.get(node_name) or re.sub(r'[^\w\-_\. ]', '_', node_name)
+                image_filename = f"{safe_node_name}.png"
                 image_path = os.path.join(self.images_folder, image_filename)
-                if os.path.exists(image_path):
+                if safe_node_name in atlas_names:
+                    image_index = atlas_images.setdefault(safe_node_name, len(atlas_images))
+                    net.add_node(
+                        node_name,
+                        label=node_name,
+                        shape='image',
+                        image=f"{ATLAS_IMAGE_PREFIX}{image_index}",
+                        size=30
+                    )
+                elif safe_node_name in pending_pngs or os.path.exists(image_path):
                     net.add_node(
                         node_name,
                         label=node_name,
@@ -116,7 +239,7 @@ class AssemblyGraph:
                         size=30
                     )
         else:
-            for node_name in self.graph.nodes:
+            for node_name in self.node_ids:
                 net.add_node(
                     node_name,
                     label=node_name,
@@ -124,7 +247,35 @@ class AssemblyGraph:
                     size=30
                 )
 
-        for source, target in self.graph.edges:
-            net.add_edge(source, target)
+        for i, j in self.edges.tolist():
+            net.add_edge(self.node_ids[i], self.node_ids[j])
 
         net.save_graph(output_file)
+        if atlas_images and pending_images is None:
+            self.embed_atlas_images(output_file, [atlas.data_uri(name) for name in atlas_images])
+        return list(atlas_images)
+
+    @staticmethod
+    def embed_atlas_images(output_file, data_uris):
+        """
+        Puts the thumbnails into the saved HTML once, with a script that sets
+        them on their nodes before the network is drawn. Falls back to
+        inlining them in the nodes if the template has no known place for it.
+        """
+        with open(output_file, encoding='utf-8') as f:
+            html = f.read()
+        if VIS_NETWORK_MARKER in html:
+            script = (
+                f"var atlasImages = {json.dumps(data_uris)};\n"
+                "nodes.update(nodes.get().filter(function (node) {\n"
+                f"    return typeof node.image === 'string' && node.image.indexOf({json.dumps(ATLAS_IMAGE_PREFIX)}) === 0;\n"
+                "}).map(function (node) {\n"
+                f"    return {{id: node.id, image: atlasImages[parseInt(node.image.slice({len(ATLAS_IMAGE_PREFIX)}))]}};\n"
+                "}));\n"
+            )
+            html = html.replace(VIS_NETWORK_MARKER, script + VIS_NETWORK_MARKER, 1)
+        else:
+            for index, data_uri in enumerate(data_uris):
+                html = html.replace(json.dumps(f"{ATLAS_IMAGE_PREFIX}{index}"), json.dumps(data_uri))
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(html)
@@ -0,0 +1,119 @@
+import numpy as np
+
+try:
+    from rtree import index
+except ImportError:
+    index = None
+
+METHODS = ('sweep', 'rtree')
+
+# Upper bound on the x-overlapping pairs expanded into arrays at once
+SWEEP_BLOCK = 1 << 22
+
+
+def pair_tolerances(diagonals, i, j):
+    """
+    Contact tolerance of each pair, the vectorized form of ShapeUtils.get_pair_tolerance.
+    """
+    return np.minimum((diagonals[i] + diagonals[j]) / 2 * 0.0001, 0.1)
+
+
+def _within_tolerance(boxes, diagonals, i, j):
+    # Keeps the pairs whose boxes are no further apart than the pair tolerance on every axis
+    tolerance = pair_tolerances(diagonals, i, j)
+    keep = np.ones(len(i), dtype=bool)
+    for axis in range(3):
+        gap = np.maximum(boxes[i, axis] - boxes[j, axis + 3], boxes[j, axis] - boxes[i, axis + 3])
+        keep &= gap <= tolerance
+    return i[keep], j[keep]
+
+
+def _expanded(boxes, diagonals):
+    # Each box grown by its part's own tolerance; two boxes within their pair
+    # tolerance always overlap once both are grown this way
+    margin = np.minimum(diagonals * 0.0001, 0.1)[:, None]
+    return np.hstack((boxes[:, :3] - margin, boxes[:, 3:] + margin))
+
+
+def sweep_and_prune(boxes, diagonals):
+    """
+    Returns the candidate pairs as two index arrays (i < j), sorted by i then j.
+
+    boxes is an (n, 6) array of (xmin, ymin, zmin, xmax, ymax, zmax) and
+    diagonals the matching box diagonals. Boxes are sorted by xmin once; every
+    box then overlaps on x exactly the boxes that follow it up to the first
+    xmin past its xmax, which one searchsorted call finds for all boxes. The
+    y and z intervals and the exact pair tolerance are checked on the
+    resulting arrays.
+    """
+    n = len(boxes)
+    if n < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    expanded = _expanded(boxes, diagonals)
+    order = np.argsort(expanded[:, 0], kind='stable')
+    xmin = expanded[order, 0]
+    xmax = expanded[order, 3]
+    ends = np.searchsorted(xmin, xmax, side='right')
+    counts = np.maximum(ends - np.arange(1, n + 1), 0)
+
+    found_i, found_j = [], []
+    start = 0
+    while start < n:
+        # Take as many sorted boxes as fit into one block of pairs
+        stop = start + max(1, int(np.searchsorted(np.cumsum(counts[start:]), SWEEP_BLOCK, side='right')))
+        block_counts = counts[start:stop]
+        total = int(block_counts.sum())
+        start_block = start
+        start = stop
+        if total == 0:
+            continue
+        first = np.repeat(np.arange(start_block, stop), block_counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+        second = first + 1 + offsets
+        i = order[first]
+        j = order[second]
+        keep = np.ones(total, dtype=bool)
+        for axis in (1, 2):
+            keep &= (expanded[i, axis] <= expanded[j, axis + 3]) & (expanded[j, axis] <= expanded[i, axis + 3])
+        i, j = _within_tolerance(boxes, diagonals, i[keep], j[keep])
+        found_i.append(np.minimum(i, j))
+        found_j.append(np.maximum(i, j))
+
+    if not found_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+def rtree_pairs(boxes, diagonals):
+    """
+    Same result as sweep_and_prune, from one R-tree query per box.
+    """
+    if index is None:
+        raise ImportError("rtree is required for the rtree broad phase.")
+    expanded = _expanded(boxes, diagonals)
+    p = index.Property()
+    p.dimension = 3
+    idx = index.Index(properties=p)
+    for k, box in enumerate(expanded):
+        idx.insert(k, tuple(box))
+
+    found_i, found_j = [], []
+    for k, box in enumerate(expanded):
+        for other in sorted(idx.intersection(tuple(box), objects=False)):
+            if other > k:
+                found_i.append(k)
+                found_j.append(other)
+    i = np.asarray(found_i, dtype=np.int64)
+    j = np.asarray(found_j, dtype=np.int64)
+    return _within_tolerance(boxes, diagonals, i, j)
+
+
+def candidate_pairs(boxes, diagonals, method='sweep'):
+    if method == 'rtree':
+        return rtree_pairs(boxes, diagonals)
+    return sweep_and_prune(boxes, diagonals)
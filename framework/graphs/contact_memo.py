@@ -0,0 +1,78 @@
+import numpy as np
+
+# Rotation entries are compared after rounding to this step
+ROTATION_STEP = 1e-6
+# Pair tolerances within about 1% of each other share a bucket
+TOLERANCE_BUCKET = 0.01
+# Relative translations are compared in steps of this fraction of the tolerance
+TRANSLATION_STEP = 0.01
+# Rounded translations at or beyond this do not fit an int64 key
+KEY_LIMIT = 2.0 ** 62
+
+
+class ContactMemo:
+    """
+    Groups candidate pairs whose contact test must give the same answer.
+
+    Two pairs are the same configuration when they are instances of the same
+    two prototypes, placed rigidly with the same relative transform
+    inv(L_i) * L_j, and tested with (nearly) the same pair tolerance. Only
+    one pair of each group needs the narrow phase; the others reuse its
+    result. Parts with a scaling placement are never grouped.
+
+    Relative translations are bucketed at TRANSLATION_STEP of the tolerance,
+    so reuse is approximate: a pair within that distance of the contact
+    threshold can take a result that differs from its own exact test.
+    """
+    def __init__(self, part_prototypes, part_locations):
+        self.enabled = bool(part_prototypes) and bool(part_locations)
+        if self.enabled:
+            self.prototypes = np.asarray(part_prototypes, dtype=np.int64)
+            self.locations = np.asarray(part_locations, dtype=np.float64).reshape(-1, 3, 4)
+            rotations = self.locations[:, :, :3]
+            deviation = np.abs(np.einsum('nij,nkj->nik', rotations, rotations) - np.eye(3)).max(axis=(1, 2))
+            self.rigid = deviation < 1e-9
+        self.groups = 0
+        self.reused = 0
+
+    def group(self, first, second, tolerances):
+        """
+        Takes the candidate pairs as index arrays with their pair tolerances.
+        Returns (representatives, group_of): the pair index that is tested
+        for each group, and the group of every pair.
+        """
+        count = len(first)
+        if not self.enabled or count == 0:
+            self.groups = count
+            return np.arange(count), np.arange(count)
+
+        rotation_i = self.locations[first, :, :3]
+        rotation_j = self.locations[second, :, :3]
+        offset = self.locations[second, :, 3] - self.locations[first, :, 3]
+        relative_rotation = np.einsum('nki,nkj->nij', rotation_i, rotation_j).reshape(count, 9)
+        relative_translation = np.einsum('nki,nk->ni', rotation_i, offset)
+
+        bucket = np.round(np.log(np.maximum(tolerances, 1e-12)) / TOLERANCE_BUCKET)
+        step = np.exp(bucket * TOLERANCE_BUCKET) * TRANSLATION_STEP
+        translation = np.round(relative_translation / step[:, None])
+        # Pairs with a non-rigid placement, or a translation too large in
+        # steps of a tiny tolerance to cast without wrapping, get a key of
+        # their own
+        in_range = (np.abs(translation) < KEY_LIMIT).all(axis=1)
+        unique = np.where(self.rigid[first] & self.rigid[second] & in_range, -1, np.arange(count))
+        translation[~in_range] = 0
+
+        keys = np.column_stack((
+            self.prototypes[first], self.prototypes[second], bucket, unique,
+            np.round(relative_rotation / ROTATION_STEP),
+            translation
+        )).astype(np.int64)
+        _, representatives, group_of = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        group_of = group_of.reshape(-1)
+
+        self.groups = len(representatives)
+        self.reused = count - self.groups
+        return representatives, group_of
+
+    def as_dict(self):
+        return {'enabled': self.enabled, 'groups': int(self.groups), 'reused_pairs': int(self.reused)}
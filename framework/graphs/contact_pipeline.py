@@ -0,0 +1,96 @@
+import time
+import numpy as np
+from OCC.Core.Bnd import Bnd_OBB
+
+from utils.shape_utils import ShapeUtils
+
+# Stages in the order they run; every stage may decide a pair before it
+# reaches the exact BRepExtrema test
+STAGES = ('aabb', 'obb', 'mesh', 'exact')
+
+
+class ContactPipeline:
+    """
+    Narrow phase for candidate pairs from the broad phase.
+
+    Cheap conservative tests run first and only pairs they cannot decide go
+    to ShapeUtils.are_parts_connected:
+
+    1. axis-aligned boxes, separated by more than the pair tolerance: reject
+    2. oriented boxes (Bnd_OBB) enlarged by the tolerance do not meet: reject
+    3. triangulation nodes: the nodes lie on the faces, so a node pair
+       within the tolerance means the shapes are too (accept)
+    4. exact distance with vertex fallback, as before
+
+    Stages 1-3 only decide pairs whose outcome the exact test would agree
+    with, so the resulting graph is the same. The mesh stage never rejects:
+    distant surface meshes do not mean distant shapes, since
+    BRepExtrema_DistShapeShape gives 0 for a solid inside another.
+    """
+    def __init__(self):
+        self.counts = {stage: {'tested': 0, 'rejected': 0, 'accepted': 0} for stage in STAGES}
+        self.seconds = {stage: 0.0 for stage in STAGES}
+
+    def are_connected(self, part1, part2):
+        part1.checked()
+        part2.checked()
+        tolerance = ShapeUtils.get_pair_tolerance(part1, part2)
+        for stage, test in (('aabb', self._aabb), ('obb', self._obb),
+                            ('mesh', self._mesh), ('exact', self._exact)):
+            start = time.perf_counter()
+            result = test(part1, part2, tolerance)
+            self.seconds[stage] += time.perf_counter() - start
+            self.counts[stage]['tested'] += 1
+            if result is not None:
+                self.counts[stage]['accepted' if result else 'rejected'] += 1
+                return result
+        return False
+
+    @staticmethod
+    def _aabb(part1, part2, tolerance):
+        box1 = part1.bounding_box()
+        box2 = part2.bounding_box()
+        for axis in range(3):
+            if box1[axis] - box2[axis + 3] > tolerance or box2[axis] - box1[axis + 3] > tolerance:
+                return False
+        return None
+
+    @staticmethod
+    def _obb(part1, part2, tolerance):
+        enlarged = Bnd_OBB(part1.oriented_bounding_box())
+        enlarged.Enlarge(tolerance)
+        if enlarged.IsOut(part2.oriented_bounding_box()):
+            return False
+        return None
+
+    @staticmethod
+    def _mesh(part1, part2, tolerance):
+        mesh1 = part1.mesh()
+        mesh2 = part2.mesh()
+        if mesh1 is None or mesh2 is None:
+            return None
+        if len(mesh1[0]) > len(mesh2[0]):
+            mesh1, mesh2 = mesh2, mesh1
+        nodes1, _ = mesh1
+        _, tree2 = mesh2
+        distances, _ = tree2.query(nodes1, k=1, distance_upper_bound=np.nextafter(tolerance, np.inf))
+        if np.isfinite(distances).any():
+            return True
+        return None
+
+    @staticmethod
+    def _exact(part1, part2, tolerance):
+        return ShapeUtils.are_parts_connected(part1, part2)
+
+    def merge(self, counts, seconds):
+        """
+        Adds the counts and timings of another pipeline, e.g. from a worker.
+        """
+        for stage in STAGES:
+            for key, value in counts[stage].items():
+                self.counts[stage][key] += value
+            self.seconds[stage] += seconds[stage]
+
+    def as_dict(self):
+        return {stage: dict(self.counts[stage], seconds=round(self.seconds[stage], 3))
+                for stage in STAGES}
@@ -0,0 +1,142 @@
+import numpy as np
+import networkx as nx
+from OCC.Core.TopExp import topexp
+from OCC.Core.TopAbs import TopAbs_FACE, TopAbs_EDGE
+from OCC.Core.TopTools import (TopTools_IndexedMapOfShape, TopTools_IndexedDataMapOfShapeListOfShape,
+                               TopTools_ListIteratorOfListOfShape)
+import logging
+
+from graphs.writers import decoded_columns
+from utils.shape_utils import SURFACE_TYPES, CURVE_TYPES, CONVEXITY
+from utils.shape_features import ShapeFeatures
+
+
+class FaceAdjacencyGraph:
+    """
+    Face adjacency graph of a shape: one node per unique face and one edge
+    per B-rep edge shared by two faces, carrying that edge as its attribute.
+
+    Built in one pass over the edge -> faces ancestor map, so the cost is
+    linear in the number of edges. Faces and edges are numbered as in
+    HierarchicalGraph (Face_k, Edge_k). Two faces meeting along several
+    edges are joined by several graph edges; a non-manifold edge joins every
+    pair of its faces, and seam edges, which have one face, add nothing.
+
+    With features=True, faces get area and surface type and edges get the
+    length, curve type and convexity of the shared edge, from ShapeFeatures
+    as in HierarchicalGraph.
+    """
+    def __init__(self, shape, features=False):
+        self.shape = shape
+        self.with_features = features
+        self.face_count = 0
+        self.edges = np.empty((0, 2), dtype=np.int64)
+        self.shared_edges = np.empty(0, dtype=np.int64)
+        self.face_features = {}
+        self.edge_features = {}
+
+    def create(self):
+        face_map = TopTools_IndexedMapOfShape()
+        topexp.MapShapes(self.shape, TopAbs_FACE, face_map)
+        edge_map = TopTools_IndexedMapOfShape()
+        topexp.MapShapes(self.shape, TopAbs_EDGE, edge_map)
+        ancestors = TopTools_IndexedDataMapOfShapeListOfShape()
+        topexp.MapShapesAndAncestors(self.shape, TopAbs_EDGE, TopAbs_FACE, ancestors)
+        self.face_count = face_map.Size()
+        logging.debug(f"Found {face_map.Size()} unique faces and {edge_map.Size()} unique edges")
+
+        shape_features = ShapeFeatures(face_map, edge_map)
+        if self.with_features:
+            self.face_features = {'area': np.full(self.face_count, np.nan),
+                                  'surface_type': np.full(self.face_count, -1, dtype=np.int8)}
+            for k in range(1, face_map.Size() + 1):
+                area, surface_type = shape_features.face(k)
+                self.face_features['area'][k - 1] = area
+                self.face_features['surface_type'][k - 1] = surface_type
+
+        sources = []
+        targets = []
+        shared = []
+        lengths = []
+        curve_types = []
+        convexities = []
+        for k in range(1, ancestors.Size() + 1):
+            edge_index = edge_map.FindIndex(ancestors.FindKey(k))
+            if edge_index == 0:
+                continue
+            faces = {}
+            iterator = TopTools_ListIteratorOfListOfShape(ancestors.FindFromIndex(k))
+            while iterator.More():
+                face_index = face_map.FindIndex(iterator.Value())
+                if face_index and face_index not in faces:
+                    faces[face_index] = iterator.Value()
+                iterator.Next()
+            if len(faces) < 2:
+                continue
+
+            if self.with_features:
+                length, curve_type = shape_features.edge(edge_index)
+                convexity = shape_features.convexity(ancestors.FindKey(k), faces)
+
+            indices = sorted(faces)
+            for a in range(len(indices)):
+                for b in range(a + 1, len(indices)):
+                    sources.append(indices[a] - 1)
+                    targets.append(indices[b] - 1)
+                    shared.append(edge_index - 1)
+                    if self.with_features:
+                        lengths.append(length)
+                        curve_types.append(curve_type)
+                        convexities.append(convexity)
+
+        self.edges = np.column_stack((np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)))
+        self.shared_edges = np.asarray(shared, dtype=np.int64)
+        if self.with_features:
+            self.edge_features = {'length': np.asarray(lengths, dtype=np.float64),
+                                  'curve_type': np.asarray(curve_types, dtype=np.int8),
+                                  'convexity': np.asarray(convexities, dtype=np.int8)}
+
+    def number_of_nodes(self):
+        return self.face_count
+
+    def number_of_edges(self):
+        return len(self.edges)
+
+    def isolated_faces(self):
+        degrees = np.bincount(self.edges.ravel(), minlength=self.face_count)
+        return int(np.count_nonzero(degrees == 0))
+
+    def labels(self):
+        return [f"Face_{k}" for k in range(self.face_count)]
+
+    def columns(self):
+        """
+        Node columns, categories, edges and directedness for graphs.writers.
+        """
+        labels = self.labels()
+        node_columns = {'id': labels, 'label': labels}
+        node_columns.update(self.face_features)
+        categories = {'surface_type': SURFACE_TYPES} if self.with_features else {}
+        return node_columns, categories, self.edges, False
+
+    def edge_columns(self):
+        """
+        Edge columns and their categories for graphs.writers.
+        """
+        columns = {'edge': [f"Edge_{k}" for k in self.shared_edges.tolist()]}
+        columns.update(self.edge_features)
+        categories = {'curve_type': CURVE_TYPES, 'convexity': CONVEXITY} if self.with_features else {}
+        return columns, categories
+
+    def to_networkx(self):
+        graph = nx.MultiGraph()
+        node_columns, categories, _, _ = self.columns()
+        names = [name for name in node_columns if name != 'id']
+        for row in zip(*decoded_columns(node_columns, categories)):
+            graph.add_node(row[0], **{name: value for name, value in zip(names, row[1:]) if value is not None})
+        edge_data, edge_categories = self.edge_columns()
+        labels = node_columns['id']
+        for (source, target), row in zip(self.edges.tolist(), zip(*decoded_columns(edge_data, edge_categories))):
+            graph.add_edge(labels[source], labels[target],
+                           **{name: value for name, value in zip(edge_data, row) if value is not None})
+        return graph
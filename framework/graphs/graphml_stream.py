@@ -0,0 +1,89 @@
+import io
+import gzip
+from xml.sax.saxutils import escape, quoteattr
+
+HEADER = ("<?xml version='1.0' encoding='utf-8'?>\n"
+          '<graphml xmlns="http://graphml.graphdrawing.org/xmlns" '
+          'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+          'xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns '
+          'http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">\n')
+
+
+def _format(value):
+    # repr keeps every digit of a float, and of NumPy floats without the type name
+    if isinstance(value, float):
+        return repr(float(value))
+    return escape(str(value))
+
+
+class StreamingGraphMLWriter:
+    """
+    Writes GraphML one node or edge at a time, so a graph of any size can be
+    written without holding it in memory.
+
+    Node attributes are declared up front, each as a name (a string
+    attribute) or a (name, type) pair with a GraphML type such as 'double'.
+    Edge attributes are declared the same way. A value of None leaves the
+    attribute out for that node or edge. The output reads
+    back with nx.read_graphml into the same graph nx.write_graphml
+    would have written; with compress=True it is gzipped, which
+    nx.read_graphml also accepts for paths ending in .gz.
+    """
+    def __init__(self, path, directed, node_attributes, compress=False, edge_attributes=()):
+        self.path = path
+        self.directed = directed
+        self.node_attributes = [(a, 'string') if isinstance(a, str) else tuple(a) for a in node_attributes]
+        self.edge_attributes = [(a, 'string') if isinstance(a, str) else tuple(a) for a in edge_attributes]
+        self.compress = compress
+        self.nodes = 0
+        self.edges = 0
+        self._file = None
+
+    def __enter__(self):
+        raw = gzip.open(self.path, 'wb', compresslevel=6) if self.compress else open(self.path, 'wb')
+        self._file = io.TextIOWrapper(io.BufferedWriter(raw, buffer_size=1 << 20), encoding='utf-8')
+        self._file.write(HEADER)
+        for k, (name, attr_type) in enumerate(self.node_attributes):
+            self._file.write(f'  <key id="d{k}" for="node" attr.name={quoteattr(name)} attr.type="{attr_type}" />\n')
+        # Edge keys are numbered after the node keys
+        for k, (name, attr_type) in enumerate(self.edge_attributes, start=len(self.node_attributes)):
+            self._file.write(f'  <key id="d{k}" for="edge" attr.name={quoteattr(name)} attr.type="{attr_type}" />\n')
+        edgedefault = 'directed' if self.directed else 'undirected'
+        self._file.write(f'  <graph edgedefault="{edgedefault}">\n')
+        return self
+
+    def add_node(self, node_id, values=()):
+        """
+        Writes a node; values are given in the order of node_attributes.
+        """
+        data = ''.join(f'      <data key="d{k}">{_format(value)}</data>\n'
+                       for k, value in enumerate(values) if value is not None)
+        if data:
+            self._file.write(f'    <node id={quoteattr(str(node_id))}>\n{data}    </node>\n')
+        else:
+            self._file.write(f'    <node id={quoteattr(str(node_id))} />\n')
+        self.nodes += 1
+
+    def add_edge(self, source, target, values=()):
+        """
+        Writes an edge; values are given in the order of edge_attributes.
+        """
+        start = len(self.node_attributes)
+        data = ''.join(f'      <data key="d{start + k}">{_format(value)}</data>\n'
+                       for k, value in enumerate(values) if value is not None)
+        endpoints = f'source={quoteattr(str(source))} target={quoteattr(str(target))}'
+        if data:
+            self._file.write(f'    <edge {endpoints}>\n{data}    </edge>\n')
+        else:
+            self._file.write(f'    <edge {endpoints} />\n')
+        self.edges += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.write('  </graph>\n</graphml>\n')
+            self._file.close()
+            self._file = None
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
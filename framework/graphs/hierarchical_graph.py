@@ -1,45 +1,263 @@
+from array import array
+import numpy as np
 import networkx as nx
-from OCC.Core.TopExp import TopExp_Explorer
-from OCC.Core.TopAbs import TopAbs_SHELL, TopAbs_FACE, TopAbs_EDGE
+from OCC.Core.TopExp import topexp
+from OCC.Core.TopAbs import TopAbs_SOLID, TopAbs_SHELL, TopAbs_FACE, TopAbs_EDGE, TopAbs_VERTEX
+from OCC.Core.TopTools import (TopTools_IndexedMapOfShape, TopTools_IndexedDataMapOfShapeListOfShape,
+                               TopTools_ListIteratorOfListOfShape)
 import logging
+
+from graphs.graphml_stream import StreamingGraphMLWriter
+from graphs.writers import decoded_columns
+from utils.shape_utils import SURFACE_TYPES, CURVE_TYPES, CONVEXITY
+from utils.shape_features import ShapeFeatures
+
+# (shape type, node prefix, shape_type attribute) from the top of the hierarchy down.
+# A node's type code is the index of its level in this list.
+LEVELS = [
+    (TopAbs_SOLID, "Solid", "SOLID"),
+    (TopAbs_SHELL, "Shell", "SHELL"),
+    (TopAbs_FACE, "Face", "FACE"),
+    (TopAbs_EDGE, "Edge", "EDGE"),
+    (TopAbs_VERTEX, "Vertex", "VERTEX"),
+]
+TYPE_CODES = {type_name: code for code, (_, _, type_name) in enumerate(LEVELS)}
+# Optional per-node features: (column, 'double' or the category names of an int8 code column)
+FEATURES = [
+    ('area', 'double'),
+    ('surface_type', SURFACE_TYPES),
+    ('length', 'double'),
+    ('curve_type', CURVE_TYPES),
+    ('convexity', CONVEXITY),
+]
+
+
 class HierarchicalGraph:
-    def __init__(self, shape):
+    """
+    Topology DAG of a shape: one node per unique sub-shape and an edge from
+    every shape to each of its sub-shapes on the next level down.
+
+    Sub-shapes are collected with indexed shape maps, so a face shared by two
+    shells or an edge shared by two faces is a single node with several
+    parents. The default levels are shells, faces and edges; solids and
+    vertices can be added, and max_depth limits how many levels are kept
+    below the top one.
+
+    The graph is held in arrays: node_types has the type code of every node
+    and edges is an (m, 2) array of (parent, child) node indices. Nodes of
+    one level are numbered consecutively from offsets[level]. Labels such as
+    Face_12 and the networkx graph are only built by to_networkx().
+
+    create() can also write the graph to a StreamingGraphMLWriter while it
+    walks the topology; with keep_edges=False the edge array is not kept.
+
+    With features=True, faces and edges also get the FEATURES columns,
+    computed once per unique entity in the same pass.
+    """
+    def __init__(self, shape, include_solids=False, include_vertices=False, max_depth=None, features=False):
         self.shape = shape
-        self.graph = nx.DiGraph()
-
-    def create(self):
-        shell_explorer = TopExp_Explorer(self.shape, TopAbs_SHELL)
-
-        shell_nodes = []
-        face_nodes = []
-        edge_nodes = []
-
-        while shell_explorer.More():
-            shell = shell_explorer.Current()
-            shell_id = f"Shell_{len(shell_nodes)}"
-            self.graph.add_node(shell_id, label=shell_id, shape_type="SHELL")
-            shell_nodes.append((shell_id, shell))
-            shell_explorer.Next()
-
-        for shell_id, shell in shell_nodes:
-            face_explorer = TopExp_Explorer(shell, TopAbs_FACE)
-            while face_explorer.More():
-                face = face_explorer.Current()
-                face_id = f"Face_{len(face_nodes)}"
-                self.graph.add_node(face_id, label=face_id, shape_type="FACE")
-                face_nodes.append((face_id, face))
-                self.graph.add_edge(shell_id, face_id)
-                face_explorer.Next()
-
-        for face_id, face in face_nodes:
-            edge_explorer = TopExp_Explorer(face, TopAbs_EDGE)
-            while edge_explorer.More():
-                edge = edge_explorer.Current()
-                edge_id = f"Edge_{len(edge_nodes)}"
-                self.graph.add_node(edge_id, label=edge_id, shape_type="EDGE")
-                edge_nodes.append((edge_id, edge))
-                self.graph.add_edge(face_id, edge_id)
-                edge_explorer.Next()
-
-    def save_graphml(self, output_file):
-        nx.write_graphml(self.graph, output_file)
+        self.levels = [level for level in LEVELS
+                       if (level[0] != TopAbs_SOLID or include_solids)
+                       and (level[0] != TopAbs_VERTEX or include_vertices)]
+        if max_depth is not None:
+            self.levels = self.levels[:max_depth + 1]
+        self.with_features = features
+        self.features = {}
+        self.offsets = []
+        self.node_types = np.empty(0, dtype=np.int8)
+        self.edges = np.empty((0, 2), dtype=np.int64)
+        self.edge_count = 0
+        self._ancestor_maps = {}
+
+    def create(self, stream=None, keep_edges=True):
+        maps = []
+        sizes = []
+        for shape_type, _, type_name in self.levels:
+            shape_map = TopTools_IndexedMapOfShape()
+            topexp.MapShapes(self.shape, shape_type, shape_map)
+            maps.append(shape_map)
+            sizes.append(shape_map.Size())
+            logging.debug(f"Found {shape_map.Size()} unique {type_name} shapes")
+
+        self.offsets = np.concatenate(([0], np.cumsum(sizes, dtype=np.int64))).tolist()
+        self.node_types = np.repeat(np.array([TYPE_CODES[level[2]] for level in self.levels], dtype=np.int8),
+                                    sizes)
+        if self.with_features:
+            self._compute_features(maps)
+
+        if stream is not None:
+            node_columns, categories, _, _ = self.columns(with_edges=False, lazy=True)
+            for row in zip(*decoded_columns(node_columns, categories)):
+                stream.add_node(row[0], row[1:])
+
+        # Node indices go straight into int64 buffers, 8 bytes per index
+        # rather than a Python int each, and become the edge array without
+        # another pass
+        parents = array('q')
+        children = array('q')
+        for level in range(1, len(self.levels)):
+            parent_prefix = self.levels[level - 1][1]
+            child_prefix = self.levels[level][1]
+            parent_offset = self.offsets[level - 1]
+            child_offset = self.offsets[level]
+            for parent_index, child_index in self._link(level, maps[level - 1], maps[level]):
+                self.edge_count += 1
+                if stream is not None:
+                    stream.add_edge(f"{parent_prefix}_{parent_index}", f"{child_prefix}_{child_index}")
+                if keep_edges:
+                    parents.append(parent_offset + parent_index)
+                    children.append(child_offset + child_index)
+        if keep_edges:
+            self.edges = np.column_stack((np.frombuffer(parents, dtype=np.int64),
+                                          np.frombuffer(children, dtype=np.int64)))
+
+    def _level(self, type_name):
+        for level, (_, _, name) in enumerate(self.levels):
+            if name == type_name:
+                return level
+        return None
+
+    def _ancestors(self, level):
+        """
+        Returns the map from every shape of the level to its ancestors on the
+        level above. Built once; _link() hands it over when it is done.
+        """
+        if level not in self._ancestor_maps:
+            ancestors = TopTools_IndexedDataMapOfShapeListOfShape()
+            topexp.MapShapesAndAncestors(self.shape, self.levels[level][0], self.levels[level - 1][0], ancestors)
+            self._ancestor_maps[level] = ancestors
+        return self._ancestor_maps[level]
+
+    def _link(self, level, parent_map, child_map):
+        """
+        Yields the unique (parent, child) pairs between level - 1 and level,
+        as 0-based indices within their levels.
+        """
+        # Every child shape with the list of its ancestors of the parent type
+        ancestors = self._ancestors(level)
+        for k in range(1, ancestors.Size() + 1):
+            child_index = child_map.FindIndex(ancestors.FindKey(k))
+            if child_index == 0:
+                continue
+            # Seam edges are listed twice for their face
+            seen = set()
+            iterator = TopTools_ListIteratorOfListOfShape(ancestors.FindFromIndex(k))
+            while iterator.More():
+                parent_index = parent_map.FindIndex(iterator.Value())
+                if parent_index and parent_index not in seen:
+                    seen.add(parent_index)
+                    yield parent_index - 1, child_index - 1
+                iterator.Next()
+        del self._ancestor_maps[level]
+
+    def _compute_features(self, maps):
+        """
+        Fills the feature columns: area and surface type of every unique face,
+        length, curve type and convexity of every unique edge, from
+        ShapeFeatures.
+        """
+        n = self.number_of_nodes()
+        for name, kind in FEATURES:
+            self.features[name] = np.full(n, np.nan) if kind == 'double' else np.full(n, -1, dtype=np.int8)
+
+        face_level = self._level('FACE')
+        if face_level is None:
+            return
+        face_map = maps[face_level]
+        face_offset = self.offsets[face_level]
+        edge_level = self._level('EDGE')
+        shape_features = ShapeFeatures(face_map, maps[edge_level] if edge_level is not None else None)
+        for k in range(1, face_map.Size() + 1):
+            area, surface_type = shape_features.face(k)
+            self.features['area'][face_offset + k - 1] = area
+            self.features['surface_type'][face_offset + k - 1] = surface_type
+
+        if edge_level is None:
+            return
+        edge_map = maps[edge_level]
+        edge_offset = self.offsets[edge_level]
+        for k in range(1, edge_map.Size() + 1):
+            length, curve_type = shape_features.edge(k)
+            self.features['length'][edge_offset + k - 1] = length
+            self.features['curve_type'][edge_offset + k - 1] = curve_type
+
+        # Convexity of every edge shared by exactly two faces
+        ancestors = self._ancestors(edge_level)
+        for k in range(1, ancestors.Size() + 1):
+            edge = ancestors.FindKey(k)
+            edge_index = edge_map.FindIndex(edge)
+            if edge_index == 0:
+                continue
+            faces = {}
+            iterator = TopTools_ListIteratorOfListOfShape(ancestors.FindFromIndex(k))
+            while iterator.More():
+                face_index = face_map.FindIndex(iterator.Value())
+                if face_index and face_index not in faces:
+                    faces[face_index] = iterator.Value()
+                iterator.Next()
+            self.features['convexity'][edge_offset + edge_index - 1] = shape_features.convexity(edge, faces)
+
+    def number_of_nodes(self):
+        return len(self.node_types)
+
+    def number_of_edges(self):
+        return self.edge_count
+
+    def count(self, type_name):
+        return int(np.count_nonzero(self.node_types == TYPE_CODES[type_name]))
+
+    def iter_labels(self):
+        """
+        Yields the node labels (Shell_0, Face_12, ...) in node order.
+        """
+        for level, (_, prefix, _) in enumerate(self.levels):
+            for k in range(self.offsets[level + 1] - self.offsets[level]):
+                yield f"{prefix}_{k}"
+
+    def labels(self):
+        return list(self.iter_labels())
+
+    def node_attributes(self):
+        """
+        GraphML (name, type) of every node attribute, in column order.
+        """
+        attributes = [('label', 'string'), ('shape_type', 'string')]
+        if self.with_features:
+            attributes.extend((name, 'double' if kind == 'double' else 'string') for name, kind in FEATURES)
+        return attributes
+
+    def to_networkx(self):
+        graph = nx.DiGraph()
+        node_columns, categories, _, _ = self.columns(with_edges=False)
+        names = [name for name, _ in self.node_attributes()]
+        labels = node_columns['id']
+        for row in zip(*decoded_columns(node_columns, categories)):
+            graph.add_node(row[0], **{name: value for name, value in zip(names, row[1:]) if value is not None})
+        graph.add_edges_from((labels[parent], labels[child]) for parent, child in self.edges.tolist())
+        return graph
+
+    def columns(self, with_edges=True, lazy=False):
+        """
+        Node columns, categories, edges and directedness for graphs.writers.
+        With lazy=True the label columns are generators.
+        """
+        categories = {'shape_type': [type_name for _, _, type_name in LEVELS]}
+        if lazy:
+            node_columns = {'id': self.iter_labels(), 'label': self.iter_labels()}
+        else:
+            labels = self.labels()
+            node_columns = {'id': labels, 'label': labels}
+        node_columns['shape_type'] = self.node_types
+        for name, kind in FEATURES if self.with_features else ():
+            node_columns[name] = self.features[name]
+            if kind != 'double':
+                categories[name] = kind
+        return node_columns, categories, self.edges if with_edges else None, True
+
+    def save_graphml(self, output_file, compress=False):
+        """
+        Runs the traversal and writes its result straight to GraphML.
+        """
+        with StreamingGraphMLWriter(output_file, True, self.node_attributes(), compress=compress) as stream:
+            self.create(stream=stream, keep_edges=False)
+
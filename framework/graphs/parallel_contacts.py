@@ -0,0 +1,87 @@
+import os
+import time
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.part_geometry import PartGeometry, GeometryCacheStats
+from utils.shape_utils import ShapeUtils
+from graphs.contact_pipeline import ContactPipeline
+
+# Candidate pairs per task; small enough to balance uneven pairs across workers
+CHUNK_SIZE = 256
+
+# Geometry of the file being processed, loaded once per pool worker
+_geometry = None
+_cache_stats = None
+
+
+def _exit_with_parent(parent_pid):
+    # A pool worker must not outlive a file worker that was killed on a timeout
+    while True:
+        time.sleep(1.0)
+        if os.getppid() != parent_pid:
+            os._exit(1)
+
+
+def _init_worker(brep_path, parent_pid):
+    global _geometry, _cache_stats
+    threading.Thread(target=_exit_with_parent, args=(parent_pid,), daemon=True).start()
+    _cache_stats = GeometryCacheStats()
+    _geometry = [PartGeometry(shape, _cache_stats) for shape in ShapeUtils.read_parts(brep_path)]
+
+
+def _check_chunk(pairs):
+    contacts = ContactPipeline()
+    connected = [(i, j) for i, j in pairs if contacts.are_connected(_geometry[i], _geometry[j])]
+    # The first chunk of a worker also reports building its geometry records
+    return connected, contacts.counts, contacts.seconds, _cache_stats.take()
+
+
+class ParallelContactChecker:
+    """
+    Runs the narrow phase for the candidate pairs of one file on a process pool.
+
+    The parts are written once to a temporary BRep file that every worker
+    loads in its initializer, so shapes are never pickled. Pairs are sent in
+    chunks of CHUNK_SIZE and the connected pairs come back sorted, so the
+    result does not depend on the number of workers or on completion order.
+    """
+    def __init__(self, num_workers, chunk_size=CHUNK_SIZE):
+        self.num_workers = num_workers
+        self.chunk_size = chunk_size
+
+    def run(self, shapes, pairs, contacts, pbar, weights=None, cache_stats=None):
+        """
+        Returns the connected (i, j) pairs. Stage counts are added to contacts,
+        the workers' geometry cache counts to cache_stats if given, and pbar is
+        advanced as chunks complete, by the sum of the pairs' weights if given.
+        """
+        if weights is None:
+            weights = [1] * len(pairs)
+        chunks = [pairs[k:k + self.chunk_size] for k in range(0, len(pairs), self.chunk_size)]
+        chunk_weights = [sum(weights[k:k + self.chunk_size]) for k in range(0, len(pairs), self.chunk_size)]
+        fd, brep_path = tempfile.mkstemp(suffix='.brep', prefix='parts-')
+        os.close(fd)
+        try:
+            ShapeUtils.write_parts(shapes, brep_path)
+            # Spawned rather than forked: workers only need the BRep file, not
+            # a copy of the parent's document and its sampling threads.
+            with ProcessPoolExecutor(max_workers=min(self.num_workers, len(chunks)),
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker,
+                                     initargs=(brep_path, os.getpid())) as executor:
+                futures = {executor.submit(_check_chunk, chunk): weight
+                           for chunk, weight in zip(chunks, chunk_weights)}
+                connected = []
+                for future in as_completed(futures):
+                    chunk_connected, counts, seconds, cache_counts = future.result()
+                    connected.extend(chunk_connected)
+                    contacts.merge(counts, seconds)
+                    if cache_stats is not None:
+                        cache_stats.merge(cache_counts)
+                    pbar.update(futures[future])
+        finally:
+            os.remove(brep_path)
+        return sorted(connected)
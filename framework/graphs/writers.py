@@ -0,0 +1,186 @@
+import os
+import time
+from itertools import repeat
+import numpy as np
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from graphs.graphml_stream import StreamingGraphMLWriter
+
+# Output format name -> writer(graph, base_path, compress) returning the files written
+WRITERS = {}
+
+
+def register_writer(name):
+    def decorator(func):
+        WRITERS[name] = func
+        return func
+    return decorator
+
+
+def available_formats():
+    return [name for name in WRITERS if name != 'parquet' or pa is not None]
+
+
+def decoded_columns(node_columns, categories):
+    """
+    Returns one iterator per node column, with category codes replaced by
+    their names and missing values (NaN, negative codes) by None.
+    """
+    decoded = []
+    for column, values in node_columns.items():
+        if column in categories:
+            decoded.append(_decode_codes(values, categories[column]))
+        elif isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+            decoded.append(_decode_floats(values))
+        else:
+            decoded.append(iter(values))
+    return decoded
+
+
+def edge_columns(graph):
+    if hasattr(graph, 'edge_columns'):
+        return graph.edge_columns()
+    return {}, {}
+
+
+def _attribute_types(columns, categories):
+    return [(column, 'double' if column not in categories and isinstance(values, np.ndarray)
+             and values.dtype.kind == 'f' else 'string')
+            for column, values in columns.items()]
+
+
+def _decode_codes(codes, names):
+    for code in codes:
+        yield names[code] if code >= 0 else None
+
+
+def _decode_floats(values):
+    for value in values:
+        yield None if value != value else float(value)
+
+
+def graphml_path(base_path, compress=False):
+    return f"{base_path}.graphml.gz" if compress else f"{base_path}.graphml"
+
+
+def write_graph(graph, base_path, formats, compress=False):
+    """
+    Writes graph in every requested format next to base_path (the output
+    path without extension). Returns (files, stats) with the write time and
+    size of each format. compress gzips the GraphML output.
+
+    graph provides columns() -> (node_columns, categories, edges, directed):
+    node_columns maps a column name to one value per node, 'id' first;
+    categories maps a column stored as integer codes to its category names;
+    edges is an (m, 2) array of node indices. Graphs with edge attributes
+    also provide edge_columns() -> (edge_columns, categories), one value per
+    edge.
+    """
+    files = []
+    stats = {}
+    for name in formats:
+        start = time.perf_counter()
+        written = WRITERS[name](graph, base_path, compress=compress)
+        stats[name] = {
+            'seconds': round(time.perf_counter() - start, 3),
+            'bytes': sum(os.path.getsize(path) for path in written)
+        }
+        files.extend(written)
+    return files, stats
+
+
+@register_writer('graphml')
+def write_graphml(graph, base_path, compress=False):
+    node_columns, categories, edges, directed = graph.columns()
+    edge_data, edge_categories = edge_columns(graph)
+    ids = list(node_columns['id'])
+    attributes = _attribute_types(node_columns, categories)[1:]
+    path = graphml_path(base_path, compress)
+    with StreamingGraphMLWriter(path, directed, attributes, compress=compress,
+                                edge_attributes=_attribute_types(edge_data, edge_categories)) as writer:
+        for row in zip(*decoded_columns(node_columns, categories)):
+            writer.add_node(row[0], row[1:])
+        edge_rows = zip(*decoded_columns(edge_data, edge_categories)) if edge_data else repeat(())
+        for (source, target), values in zip(np.asarray(edges).tolist(), edge_rows):
+            writer.add_edge(ids[source], ids[target], values)
+    return [path]
+
+
+@register_writer('npz')
+def write_npz(graph, base_path, compress=False):
+    """
+    Compressed NumPy archive: 'edges' (m, 2) node indices, 'directed', one
+    array per node column, 'edge_<column>' per edge column and
+    '<column>_categories' for coded columns.
+    """
+    node_columns, categories, edges, directed = graph.columns()
+    edge_data, edge_categories = edge_columns(graph)
+    arrays = {'edges': np.asarray(edges, dtype=np.int64), 'directed': np.array(directed)}
+    for prefix, columns, column_categories in (('', node_columns, categories),
+                                               ('edge_', edge_data, edge_categories)):
+        for column, values in columns.items():
+            if column in column_categories or (isinstance(values, np.ndarray) and values.dtype.kind == 'f'):
+                arrays[f"{prefix}{column}"] = np.asarray(values)
+            else:
+                arrays[f"{prefix}{column}"] = np.array(values, dtype=str)
+        for column, names in column_categories.items():
+            arrays[f"{prefix}{column}_categories"] = np.array(names, dtype=str)
+    path = f"{base_path}.npz"
+    np.savez_compressed(path, **arrays)
+    return [path]
+
+
+@register_writer('parquet')
+def write_parquet(graph, base_path, compress=False):
+    """
+    Two Parquet tables: nodes (one row per node, coded columns as
+    dictionaries) and edges (source and target node indices, then the edge
+    columns).
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for the parquet output format.")
+    node_columns, categories, edges, directed = graph.columns()
+    edge_data, edge_categories = edge_columns(graph)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    edge_table = {'source': edges[:, 0], 'target': edges[:, 1]}
+    edge_table.update(_arrow_columns(edge_data, edge_categories))
+    edge_table = pa.table(edge_table, metadata={'directed': str(bool(directed))})
+    node_table = _arrow_columns(node_columns, categories)
+    nodes_path = f"{base_path}_nodes.parquet"
+    edges_path = f"{base_path}_edges.parquet"
+    pq.write_table(pa.table(node_table), nodes_path, compression='zstd')
+    pq.write_table(edge_table, edges_path, compression='zstd')
+    return [nodes_path, edges_path]
+
+
+def _arrow_columns(columns, categories):
+    arrays = {}
+    for column, values in columns.items():
+        if column in categories:
+            codes = np.asarray(values, dtype=np.int32)
+            arrays[column] = pa.DictionaryArray.from_arrays(
+                pa.array(codes, mask=codes < 0), pa.array(categories[column]))
+        elif isinstance(values, np.ndarray) and values.dtype.kind == 'f':
+            arrays[column] = pa.array(values, from_pandas=True)
+        else:
+            arrays[column] = pa.array(list(values), type=pa.string())
+    return arrays
+
+
+@register_writer('edgelist')
+def write_edgelist(graph, base_path, compress=False):
+    """
+    One tab-separated 'source target' line per edge, using node ids.
+    """
+    node_columns, _, edges, _ = graph.columns()
+    ids = list(node_columns['id'])
+    path = f"{base_path}.edgelist"
+    with open(path, 'w', encoding='utf-8') as f:
+        for source, target in np.asarray(edges).tolist():
+            f.write(f"{ids[source]}\t{ids[target]}\n")
+    return [path]
@@ -1,11 +1,65 @@
 import os
 import argparse
 import logging
+import multiprocessing
 from colorama import init, Fore, Style
 
 from workers import process_step_files
+from graphs.broad_phase import METHODS as BROAD_PHASE_METHODS
+from graphs.writers import WRITERS, available_formats
+from rendering.atlas import THUMBNAIL_FORMATS, DEFAULT_THUMBNAIL_SIZE
 from utils.logging_utils import setup_logging
 
+STAGES = ('read', 'images', 'assembly', 'hierarchical', 'face_adjacency')
+
+
+def parse_formats(value):
+    """
+    Parses a comma-separated list of graph output formats, e.g. 'graphml,npz'.
+    """
+    formats = []
+    for name in value.split(','):
+        name = name.strip()
+        if name not in WRITERS:
+            raise argparse.ArgumentTypeError(f"Unknown format '{name}', expected one of {', '.join(WRITERS)}")
+        if name not in available_formats():
+            raise argparse.ArgumentTypeError(f"Format '{name}' needs a package that is not installed")
+        if name not in formats:
+            formats.append(name)
+    return formats
+
+
+def parse_image_size(value):
+    """
+    Parses an image resolution given as 'WIDTHxHEIGHT', e.g. '800x600'.
+    """
+    width, _, height = value.lower().partition('x')
+    try:
+        size = (int(width), int(height))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid image size '{value}', expected WIDTHxHEIGHT")
+    if min(size) < 1:
+        raise argparse.ArgumentTypeError(f"Invalid image size '{value}', expected WIDTHxHEIGHT")
+    return size
+
+
+def parse_stage_timeouts(value):
+    """
+    Parses 'stage=seconds,...' into a dict, e.g. 'read=600,assembly=3600'.
+    """
+    timeouts = {}
+    for item in value.split(','):
+        stage, _, seconds = item.partition('=')
+        stage = stage.strip()
+        if stage not in STAGES:
+            raise argparse.ArgumentTypeError(f"Unknown stage '{stage}', expected one of {', '.join(STAGES)}")
+        try:
+            timeouts[stage] = float(seconds)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid timeout '{seconds}' for stage '{stage}'")
+    return timeouts
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Process STEP files and create assembly graphs.")
@@ -19,6 +73,20 @@ if __name__ == "__main__":
                         help="Generate metadata using OpenAI GPT")
     parser.add_argument("--images-metadata", action="store_true",
                         help="Generate metadata from images if it is not possible to generate using part names")
+    parser.add_argument("--metadata-concurrency", type=int, default=8,
+                        help="Metadata requests in flight at once (default: 8)")
+    parser.add_argument("--metadata-retries", type=int, default=5,
+                        help="Retries of a metadata request after a rate limit, server or connection error "
+                             "(default: 5)")
+    parser.add_argument("--openai-base-url", default=os.getenv("OPENAI_BASE_URL"),
+                        help="Base URL of the OpenAI-compatible API used for metadata "
+                             "(default: OPENAI_BASE_URL or OpenAI's API)")
+    parser.add_argument("--metadata-cache", default=None,
+                        help="Folder for caching metadata generated from product names between runs")
+    parser.add_argument("--metadata-cache-size", type=int, default=100,
+                        help="Maximum size of the metadata cache in MB (default: 100)")
+    parser.add_argument("--metadata-cache-ttl", type=float, default=30,
+                        help="Days a cached metadata answer stays valid (default: 30)")
     parser.add_argument("--log", action="store_true", help="Enable logging")
     parser.add_argument("--assembly", action="store_true",
                         help="Generate assembly graph")
@@ -28,21 +96,123 @@ if __name__ == "__main__":
                         help="Save assembly graph as interactive HTML (only works with --assembly)")
     parser.add_argument("--hierarchical", action="store_true",
                         help="Generate hierarchical graph")
+    parser.add_argument("--format", type=parse_formats, default=['graphml'],
+                        help="Comma-separated graph output formats "
+                             f"({', '.join(WRITERS)}; default: graphml, parquet needs pyarrow)")
+    parser.add_argument("--graphml-gzip", action="store_true",
+                        help="Write GraphML output gzipped (.graphml.gz)")
+    parser.add_argument("--face-adjacency", action="store_true",
+                        help="Generate face adjacency graph (faces joined by their shared edges)")
+    parser.add_argument("--face-adjacency-features", action="store_true",
+                        help="Add face area and surface type, edge length, curve type and convexity "
+                             "to the face adjacency graph")
+    parser.add_argument("--hierarchical-features", action="store_true",
+                        help="Add face area and surface type, edge length, curve type and convexity "
+                             "to the hierarchical graph")
+    parser.add_argument("--hierarchical-solids", action="store_true",
+                        help="Add a solid level above the shells in the hierarchical graph")
+    parser.add_argument("--hierarchical-vertices", action="store_true",
+                        help="Add a vertex level below the edges in the hierarchical graph")
+    parser.add_argument("--hierarchical-max-depth", type=int, default=None,
+                        help="Number of levels kept below the top level of the hierarchical graph")
     parser.add_argument("--no-self-connections", action="store_true",
                         help="Disable self-connections in the assembly graph")
     parser.add_argument("--stats", action="store_true",
                         help="Generate statistics for STEP files")
     parser.add_argument("--images", action="store_true",
                         help="Save images of parts in the assembly graph")
+    parser.add_argument("--image-size", type=parse_image_size, default=(800, 600),
+                        help="Resolution of the rendered images as WIDTHxHEIGHT (default: 800x600)")
+    parser.add_argument("--image-dedupe", choices=['none', 'prototype', 'geometry'], default='prototype',
+                        help="Which parts share a rendered image: none (one image per part), prototype "
+                             "(instances of one part) or geometry (also parts with equal volume, area and "
+                             "topology) (default: prototype)")
+    parser.add_argument("--image-atlas", action="store_true",
+                        help="Pack thumbnails of the images into one sprite atlas per file with a JSON index, "
+                             "instead of one PNG per part")
+    parser.add_argument("--full-images", action="store_true",
+                        help="Also keep the full-resolution PNGs when writing an image atlas")
+    parser.add_argument("--thumbnail-size", type=int, default=DEFAULT_THUMBNAIL_SIZE,
+                        help=f"Largest side of the atlas thumbnails in pixels (default: {DEFAULT_THUMBNAIL_SIZE})")
+    parser.add_argument("--thumbnail-format", choices=list(THUMBNAIL_FORMATS), default='jpeg',
+                        help="Encoding of the atlas thumbnails (default: jpeg)")
+    parser.add_argument("--render-workers", type=int, default=0,
+                        help="Processes that render images while the file workers build the graphs "
+                             "(default: 0, images are rendered by the file workers)")
     parser.add_argument("--headless", action="store_true",
                         help="Run in headless mode")
+    parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() // 2),
+                        help="Number of worker processes (default: number of CPUs / 2, minimum 1)")
+    parser.add_argument("--max-performance", action="store_true",
+                        help="Use all available CPU cores for maximum performance")
+    parser.add_argument("--max-tasks-per-child", type=int, default=None,
+                        help="Recycle each worker process after it has processed this many files")
+    parser.add_argument("--parse-cache", default=None,
+                        help="Folder for caching parsed STEP geometry between runs")
+    parser.add_argument("--parse-cache-size", type=int, default=10240,
+                        help="Maximum size of the parse cache in MB (default: 10240)")
+    parser.add_argument("--share-geometry", action="store_true",
+                        help="Place repeated parts by location instead of copying their geometry")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="Release geometry as soon as each stage no longer needs it")
+    parser.add_argument("--max-worker-memory", type=int, default=None,
+                        help="Recycle a worker process once its resident memory exceeds this many MB")
+    parser.add_argument("--file-timeout", type=float, default=None,
+                        help="Kill a worker that spends more than this many seconds on one file")
+    parser.add_argument("--stage-timeout", type=parse_stage_timeouts, default=None,
+                        help="Per-stage time budgets in seconds, e.g. read=600,assembly=3600 "
+                             f"(stages: {', '.join(STAGES)})")
+    parser.add_argument("--contact-workers", type=int, default=1,
+                        help="Processes used to check part contacts within one assembly "
+                             "(per file worker, default: 1)")
+    parser.add_argument("--broad-phase", choices=BROAD_PHASE_METHODS, default='sweep',
+                        help="How candidate part pairs are found: vectorized sweep-and-prune "
+                             "or one R-tree query per part (default: sweep)")
     args = parser.parse_args()
 
     step_files_folder = args.input
     output_folder = args.output
     skip_existing = not args.process_all
+    if args.max_performance:
+        num_workers = multiprocessing.cpu_count()
+        print(f"{Fore.YELLOW}Warning: Using all {num_workers} CPU cores. This may affect system responsiveness.{Style.RESET_ALL}")
+    else:
+        num_workers = args.workers
+
+    if num_workers < 1:
+        parser.error("Number of workers must be at least 1")
 
-    if args.generate_metadata:
+    if args.thumbnail_size < 1:
+        parser.error("Thumbnail size must be at least 1")
+
+    if (args.image_atlas or args.full_images) and not args.images:
+        parser.error("Image atlas options require images extraction")
+
+    if args.full_images and not args.image_atlas:
+        parser.error("Full images option requires --image-atlas")
+
+    if args.render_workers < 0:
+        parser.error("Number of render workers must not be negative")
+
+    if args.contact_workers < 1:
+        parser.error("Number of contact workers must be at least 1")
+
+    if args.max_tasks_per_child is not None and args.max_tasks_per_child < 1:
+        parser.error("Max tasks per child must be at least 1")
+
+    if args.metadata_concurrency < 1:
+        parser.error("Metadata concurrency must be at least 1")
+
+    if args.metadata_retries < 0:
+        parser.error("Metadata retries must not be negative")
+
+    if args.metadata_cache_size < 1:
+        parser.error("Metadata cache size must be at least 1 MB")
+
+    if args.metadata_cache_ttl <= 0:
+        parser.error("Metadata cache TTL must be positive")
+
+    if args.generate_metadata and not args.openai_base_url:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError(
@@ -60,6 +230,9 @@ if __name__ == "__main__":
     if args.save_html and not args.assembly:
         parser.error("Save HTML option requires assembly graph generation")
         
+    if args.hierarchical_max_depth is not None and args.hierarchical_max_depth < 0:
+        parser.error("Hierarchical max depth must not be negative")
+
     if args.images_metadata and not args.images:
         parser.error("Images metadata option requires images extraction")
 
@@ -77,7 +250,39 @@ if __name__ == "__main__":
             generate_stats=args.stats,
             images=args.images,
             images_metadata=args.images_metadata,
-            headless=args.headless
+            headless=args.headless,
+            num_workers=num_workers,
+            max_tasks_per_child=args.max_tasks_per_child,
+            parse_cache_dir=args.parse_cache,
+            parse_cache_size=args.parse_cache_size * 1024 * 1024,
+            share_geometry=args.share_geometry,
+            low_memory=args.low_memory,
+            max_worker_memory=args.max_worker_memory * 1024 * 1024 if args.max_worker_memory else None,
+            file_timeout=args.file_timeout,
+            stage_timeouts=args.stage_timeout,
+            contact_workers=args.contact_workers,
+            broad_phase=args.broad_phase,
+            hierarchical_solids=args.hierarchical_solids,
+            hierarchical_vertices=args.hierarchical_vertices,
+            hierarchical_max_depth=args.hierarchical_max_depth,
+            formats=args.format,
+            graphml_gzip=args.graphml_gzip,
+            hierarchical_features=args.hierarchical_features,
+            face_adjacency=args.face_adjacency,
+            face_adjacency_features=args.face_adjacency_features,
+            image_size=args.image_size,
+            render_workers=args.render_workers,
+            image_atlas=args.image_atlas,
+            full_images=args.full_images,
+            thumbnail_size=args.thumbnail_size,
+            thumbnail_format=args.thumbnail_format,
+            image_dedupe=args.image_dedupe,
+            metadata_concurrency=args.metadata_concurrency,
+            metadata_retries=args.metadata_retries,
+            openai_base_url=args.openai_base_url,
+            metadata_cache_dir=args.metadata_cache,
+            metadata_cache_size=args.metadata_cache_size * 1024 * 1024,
+            metadata_cache_ttl=args.metadata_cache_ttl * 24 * 3600
         )
     except KeyboardInterrupt:
         logging.info("Process interrupted by user. Exiting gracefully...")
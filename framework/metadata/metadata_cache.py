@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+DATABASE_FILE = 'metadata.sqlite'
+# Entries older than this many seconds are not used (default: 30 days)
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+def normalize_product_names(product_names):
+    """
+    Returns the product names in a form that does not depend on their order,
+    repetition, case or spacing, so variants of one assembly share a key.
+    """
+    names = {re.sub(r'\s+', ' ', name).strip().lower() for name in product_names if name}
+    return sorted(name for name in names if name)
+
+
+class MetadataCache:
+    """
+    On-disk cache of metadata generated from product names, in one SQLite
+    database. Keyed by the normalized product names, the prompt version and
+    the model, so a changed prompt or model never reuses an old answer.
+
+    Entries expire ttl seconds after they were stored (DEFAULT_TTL when None).
+    Once the stored metadata grows past max_size_bytes, the least recently
+    used entries are evicted; None leaves the size unlimited. The methods may
+    be called from several threads.
+    """
+    def __init__(self, cache_dir, max_size_bytes=None, ttl=DEFAULT_TTL):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.cache_dir, DATABASE_FILE), timeout=30,
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed)")
+
+    @staticmethod
+    def key(product_names, prompt_version, model):
+        payload = json.dumps({'names': normalize_product_names(product_names),
+                              'prompt_version': prompt_version, 'model': model}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached metadata for key, or None on a miss.
+        """
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        now = time.time()
+        row = self.connection.execute("SELECT value, created FROM metadata WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row[1] > self.ttl:
+            with self.connection:
+                self.connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            self.expired += 1
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        try:
+            metadata = json.loads(row[0])
+        except ValueError as e:
+            logging.warning(f"Discarding unreadable metadata cache entry {key}: {e}")
+            with self.connection:
+                self.connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+        with self.connection:
+            self.connection.execute("UPDATE metadata SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return metadata
+
+    def put(self, key, metadata):
+        value = json.dumps(metadata)
+        now = time.time()
+        with self._lock:
+            try:
+                with self.connection:
+                    self.connection.execute("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)",
+                                            (key, value, len(value), now, now))
+            except sqlite3.Error as e:
+                logging.warning(f"Could not store metadata cache entry {key}: {e}")
+                return
+            self._evict()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        with self.connection:
+            cursor = self.connection.execute("DELETE FROM metadata WHERE created < ?", (time.time() - self.ttl,))
+            self.evicted += cursor.rowcount
+            if self.max_size_bytes is None:
+                return
+            total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM metadata").fetchone()[0]
+            if total_size <= self.max_size_bytes:
+                return
+            for key, size in self.connection.execute(
+                    "SELECT key, size FROM metadata ORDER BY accessed").fetchall():
+                if total_size <= self.max_size_bytes:
+                    break
+                logging.info(f"Evicting metadata cache entry {key}")
+                self.connection.execute("DELETE FROM metadata WHERE key = ?", (key,))
+                total_size -= size
+                self.evicted += 1
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses, 'expired': self.expired, 'evicted': self.evicted}
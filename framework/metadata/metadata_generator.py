@@ -1,22 +1,184 @@
 import os
 import re
 import json
+import time
+import random
+import asyncio
 import openai
+import httpx
 import logging
 from typing import List, Optional
 import base64
 from PIL import Image
 import io
 
+from rendering.atlas import ImageAtlas
+
+MODEL = "gpt-4o-mini"
+# Bump when the product names prompt changes, so cached answers to the old prompt are not reused
+PROMPT_VERSION = 1
+# Retry delays grow as BACKOFF_BASE * 2 ** attempt, with jitter, up to BACKOFF_MAX seconds
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# Upper bounds of the request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        index = next((k for k, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        self.counts[index] += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def as_dict(self):
+        count = sum(self.counts)
+        labels = [f"<={bound}s" for bound in self.buckets] + [f">{self.buckets[-1]}s"]
+        return {
+            'count': count,
+            'mean_seconds': round(self.total / count, 3) if count else None,
+            'max_seconds': round(self.maximum, 3),
+            'buckets': dict(zip(labels, self.counts))
+        }
+
+
 class MetadataGenerator:
-    def __init__(self, api_key=None, images_metadata=False):
+    """
+    Generates metadata with the chat completions API, asynchronously.
+
+    One AsyncOpenAI client with a pooled HTTP connection is shared by all
+    requests, and at most concurrency requests are in flight. Rate limits
+    (429), server errors (5xx) and connection errors are retried with
+    exponential backoff, honouring Retry-After. base_url points the client
+    at another OpenAI-compatible server, e.g. a local stub for testing.
+
+    With a MetadataCache, answers to the product names prompt are looked up
+    before any request is sent and stored after.
+    """
+    def __init__(self, api_key=None, images_metadata=False, base_url=None, concurrency=8, max_retries=5,
+                 model=MODEL, cache=None):
         if api_key is None:
             api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
-            raise ValueError("OpenAI API key not found in environment variables")
-        self.client = openai.OpenAI(api_key=api_key)
+            if base_url is None:
+                raise ValueError("OpenAI API key not found in environment variables")
+            # Servers other than OpenAI's may not check the key
+            api_key = 'unused'
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                                         http_client=httpx.AsyncClient(limits=limits, timeout=600.0))
         self.images_metadata = images_metadata
-    def generate(self, product_names: List[str], filename: str, images_folder: Optional[str] = None):
+        self.model = model
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self.cache = cache
+        # Cache keys being requested, so files with the same names share one request
+        self._in_flight = {}
+        self.coalesced = 0
+        self._semaphore = None
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.status_codes = {}
+
+    async def close(self):
+        await self.client.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    async def _complete(self, messages):
+        """
+        Sends one chat completion request, retrying on 429, 5xx and
+        connection errors, and returns the content of the reply.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            async with self._semaphore:
+                self.requests += 1
+                start_time = time.perf_counter()
+                try:
+                    response = await self.client.chat.completions.create(model=self.model, messages=messages)
+                    self.latency.add(time.perf_counter() - start_time)
+                    self._count_status(200)
+                    return response.choices[0].message.content.strip()
+                except openai.APIStatusError as e:
+                    self.latency.add(time.perf_counter() - start_time)
+                    self._count_status(e.status_code)
+                    retryable = e.status_code == 429 or e.status_code >= 500
+                    retry_after = e.response.headers.get('retry-after')
+                    error = e
+                except openai.APIConnectionError as e:
+                    self._count_status('connection_error')
+                    retryable = True
+                    error = e
+            if not retryable or attempt == self.max_retries:
+                self.failures += 1
+                raise error
+            self.retries += 1
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (0.5 + random.random() / 2)
+            try:
+                delay = max(delay, min(BACKOFF_MAX, float(retry_after)))
+            except (TypeError, ValueError):
+                pass
+            logging.warning(f"Metadata request failed ({error}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _count_status(self, status):
+        status = str(status)
+        self.status_codes[status] = self.status_codes.get(status, 0) + 1
+
+    def as_dict(self):
+        stats = {
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'status_codes': self.status_codes,
+            'latency': self.latency.as_dict()
+        }
+        if self.cache is not None:
+            stats['cache'] = dict(self.cache.as_dict(), coalesced=self.coalesced)
+        return stats
+
+    async def _complete_names(self, product_names, messages):
+        """
+        Returns the metadata for the product names prompt, from the cache if
+        it has an answer, otherwise from the API.
+        """
+        key = self.cache.key(product_names, PROMPT_VERSION, self.model) if self.cache is not None else None
+        if key is None:
+            return await self._request_names(messages)
+        if key in self._in_flight:
+            self.coalesced += 1
+            return await asyncio.shield(self._in_flight[key])
+        self._in_flight[key] = asyncio.ensure_future(self._cached_request_names(key, messages))
+        try:
+            return await self._in_flight[key]
+        finally:
+            del self._in_flight[key]
+
+    async def _cached_request_names(self, key, messages):
+        # SQLite access runs in a thread, so it does not hold up the other requests
+        metadata = await asyncio.to_thread(self.cache.get, key)
+        if metadata is None:
+            metadata = await self._request_names(messages)
+            await asyncio.to_thread(self.cache.put, key, metadata)
+        return metadata
+
+    async def _request_names(self, messages):
+        content = await self._complete(messages)
+        content = re.sub(r'^```json\n|\n```$', '', content, flags=re.MULTILINE)
+        return json.loads(content)
+
+    async def generate(self, product_names: List[str], filename: str, images_folder: Optional[str] = None):
         if product_names:
             prompt = (
                 f"Based on the following list of product names from a STEP file named '{filename}', generate a JSON metadata that includes:\n"
@@ -32,56 +194,67 @@ class MetadataGenerator:
             )
 
             try:
-                response = self.client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that generates metadata for CAD assemblies."},
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-
-                content = response.choices[0].message.content.strip()
-                content = re.sub(r'^```json\n|\n```$', '', content, flags=re.MULTILINE)
-
-                metadata = json.loads(content)
+                metadata = await self._complete_names(product_names, [
+                    {"role": "system", "content": "You are a helpful assistant that generates metadata for CAD assemblies."},
+                    {"role": "user", "content": prompt}
+                ])
 
                 if metadata == {} and images_folder and self.images_metadata:
                     logging.warning(f"No metadata generated using part names for {filename}, trying with images")
-                    return self.generate_from_images(images_folder, filename)
+                    return await self.generate_from_images(images_folder, filename)
                 logging.info(f"Metadata generated for {filename}")
                 return metadata
 
             except Exception as e:
                 logging.error(f"Error generating metadata with product names: {str(e)}")
                 if images_folder and self.images_metadata:
-                    return self.generate_from_images(images_folder, filename)
+                    return await self.generate_from_images(images_folder, filename)
                 return None
         elif images_folder and self.images_metadata:
-            return self.generate_from_images(images_folder, filename)
+            return await self.generate_from_images(images_folder, filename)
         else:
             logging.warning("No product names or images provided for metadata generation.")
             return None
 
-    def generate_from_images(self, images_folder: str, filename: str):
+    def encode_atlas_images(self, atlas):
+        """
+        Encodes the thumbnails of an image atlas as the API expects them,
+        without opening the full-resolution images.
+        """
+        encoded_images = []
+        for name in atlas.names():
+            img = atlas.thumbnail(name).convert('L')
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", optimize=True, quality=75)
+            encoded_images.append(base64.b64encode(buffer.getvalue()).decode('utf-8'))
+        return encoded_images
+
+    def encode_images(self, images_folder: str):
+        atlas = ImageAtlas.find(images_folder)
+        if atlas is not None:
+            return self.encode_atlas_images(atlas)
+
+        encoded_images = []
+        image_files = [f for f in os.listdir(images_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        for image_file in image_files:
+            image_path = os.path.join(images_folder, image_file)
+            with Image.open(image_path) as img:
+                # Convert to grayscale
+                img = img.convert('L')
+                # Resize image (adjust dimensions as needed)
+                img.thumbnail((300, 300))
+                # Compress image
+                buffer = io.BytesIO()
+                img.save(buffer, format="JPEG", optimize=True, quality=75)
+                compressed_image = buffer.getvalue()
+                encoded_string = base64.b64encode(compressed_image).decode('utf-8')
+                encoded_images.append(encoded_string)
+        return encoded_images
+
+    async def generate_from_images(self, images_folder: str, filename: str):
         try:
-            encoded_images = []
-            image_files = [f for f in os.listdir(images_folder) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-            
-            for image_file in image_files:
-                image_path = os.path.join(images_folder, image_file)
-                with Image.open(image_path) as img:
-                    # Convert to grayscale
-                    img = img.convert('L')
-                    # Resize image (adjust dimensions as needed)
-                    img.thumbnail((300, 300))
-                    # Compress image
-                    buffer = io.BytesIO()
-                    img.save(buffer, format="JPEG", optimize=True, quality=75)
-                    #also save to local
-                    #img.save(os.path.join(images_folder, image_file), format="JPEG", optimize=True, quality=75)
-                    compressed_image = buffer.getvalue()
-                    encoded_string = base64.b64encode(compressed_image).decode('utf-8')
-                    encoded_images.append(encoded_string)
+            # Image encoding is CPU work; it must not hold up the other requests
+            encoded_images = await asyncio.to_thread(self.encode_images, images_folder)
 
             prompt = (
                 f"Based on the following images of a STEP file named '{filename}', generate a JSON metadata that includes:\n"
@@ -102,12 +275,7 @@ class MetadataGenerator:
             for img in encoded_images:
                 messages.append({"role": "user", "content": f"![image](data:image/png;base64,{img})"})
 
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages
-            )
-
-            content = response.choices[0].message.content.strip()
+            content = await self._complete(messages)
             content = re.sub(r'^```json\n|\n```$', '', content, flags=re.MULTILINE)
 
             metadata = json.loads(content)
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+from metadata.metadata_cache import MetadataCache, DEFAULT_TTL
+from metadata.metadata_generator import MetadataGenerator
+from processing.build_manifest import BuildManifest
+from utils.file_utils import write_json_atomic
+
+
+class MetadataService:
+    """
+    Generates the metadata of a run on an asyncio event loop in a background
+    thread of the main process, so file workers never wait on HTTP.
+
+    Workers put one job per file on the jobs queue once their own outputs
+    are saved. Each job is handled concurrently with the others through one
+    shared MetadataGenerator; its result is written to the file's metadata
+    JSON and recorded in the file's manifest and statistics. With cache_dir,
+    answers are kept in a MetadataCache there between runs.
+    """
+    def __init__(self, images_metadata=False, base_url=None, concurrency=8, max_retries=5,
+                 cache_dir=None, cache_size=None, cache_ttl=DEFAULT_TTL):
+        self.images_metadata = images_metadata
+        self.base_url = base_url
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # Handed to the spawned file workers, so from the same context
+        self.jobs = multiprocessing.get_context('spawn').Queue()
+        self.files = 0
+        self.generated = 0
+        self.seconds = 0.0
+        self._pending = []
+        self._loop = None
+        self._thread = None
+        self._reader = None
+        self.generator = None
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self.generator = self._call(self._create_generator())
+        self._reader = threading.Thread(target=self._read_jobs, daemon=True)
+        self._reader.start()
+        return self
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _create_generator(self):
+        # Created on the loop that will use its connection pool
+        cache = MetadataCache(self.cache_dir, self.cache_size, self.cache_ttl) if self.cache_dir else None
+        return MetadataGenerator(images_metadata=self.images_metadata, base_url=self.base_url,
+                                 concurrency=self.concurrency, max_retries=self.max_retries, cache=cache)
+
+    def submit(self, job):
+        self.jobs.put(job)
+
+    def _read_jobs(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            self._pending.append(asyncio.run_coroutine_threadsafe(self._handle(job), self._loop))
+
+    async def _handle(self, job):
+        start_time = time.perf_counter()
+        metadata = await self.generator.generate(job['product_names'], job['filename'], job['images_folder'])
+        seconds = time.perf_counter() - start_time
+        # File I/O runs in a thread, so it does not hold up the other requests
+        await asyncio.to_thread(self._save, job, metadata, seconds)
+        if metadata:
+            self.generated += 1
+        self.files += 1
+        self.seconds += seconds
+        logging.info(f"Metadata {'generated' if metadata else 'not generated'} for {job['filename']}")
+
+    @staticmethod
+    def _save(job, metadata, seconds):
+        """
+        Writes the metadata JSON and records it in the file's manifest and
+        statistics. Without metadata only the statistics are written, so the
+        next run tries again.
+        """
+        stats = {'generated': bool(metadata), 'seconds': round(seconds, 3)}
+        if metadata:
+            with open(job['metadata_path'], 'w') as f:
+                json.dump(metadata, f, indent=2)
+            stats['metadata_file'] = job['metadata_path']
+            manifest = BuildManifest(job['subfolder'], job['name']).load()
+            manifest.record('metadata', job['input_hash'], job['options'], [job['metadata_path']], stats=stats)
+            manifest.save()
+        stats_path = job.get('stats_path')
+        if stats_path and os.path.exists(stats_path):
+            with open(stats_path) as f:
+                statistics = json.load(f)
+            statistics['metadata'] = stats
+            write_json_atomic(stats_path, statistics)
+
+    def close(self):
+        """
+        Waits for every submitted job, then stops the event loop.
+        """
+        self.jobs.put(None)
+        self._reader.join()
+        for future in self._pending:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Error generating metadata: {str(e)}")
+        self._call(self.generator.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def as_dict(self):
+        stats = {'files': self.files, 'generated': self.generated, 'seconds': round(self.seconds, 3),
+                 'concurrency': self.concurrency}
+        stats.update(self.generator.as_dict())
+        return stats
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
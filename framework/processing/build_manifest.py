@@ -0,0 +1,76 @@
+import os
+import json
+import logging
+import time
+
+from utils.file_utils import write_json_atomic
+
+
+class BuildManifest:
+    """
+    Per-file record of the artifacts written to an output subfolder.
+
+    Each artifact entry stores the content hash of the STEP file it was built
+    from, the options that affect its output, the files it produced and the
+    statistics gathered while building it. This lets a resumed run decide what
+    to rebuild without parsing the STEP file. An artifact whose statistics
+    say it was not generated, such as metadata after a failed request, is
+    built again on the next run.
+    """
+    VERSION = 1
+
+    def __init__(self, subfolder, name_without_extension):
+        self.subfolder = subfolder
+        self.path = os.path.join(subfolder, f"{name_without_extension}_manifest.json")
+        self.data = {'version': self.VERSION, 'input_hash': None, 'artifacts': {}}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return self
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.data = data
+            else:
+                logging.info(f"Ignoring manifest with unsupported version: {self.path}")
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read manifest {self.path}: {e}")
+        return self
+
+    def save(self):
+        write_json_atomic(self.path, self.data)
+
+    def get(self, artifact):
+        return self.data['artifacts'].get(artifact)
+
+    def is_up_to_date(self, artifact, input_hash, options):
+        entry = self.get(artifact)
+        if entry is None:
+            return False
+        if entry.get('input_hash') != input_hash or entry.get('options') != options:
+            return False
+        if (entry.get('stats') or {}).get('generated') is False:
+            return False
+        return all(os.path.exists(os.path.join(self.subfolder, p)) for p in entry.get('files', []))
+
+    def record(self, artifact, input_hash, options, files, stats=None):
+        self.data['input_hash'] = input_hash
+        self.data['artifacts'][artifact] = {
+            'input_hash': input_hash,
+            'options': options,
+            'files': [os.path.relpath(p, self.subfolder) for p in files],
+            'stats': stats,
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+
+    def statistics(self, artifacts):
+        """
+        Collects the statistics recorded for the given artifacts.
+        """
+        statistics = {}
+        for artifact in artifacts:
+            entry = self.get(artifact)
+            if entry and entry.get('stats') is not None:
+                statistics[artifact] = entry['stats']
+        return statistics
@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import uuid
+from OCC.Core.BinTools import bintools
+from OCC.Core.BRep import BRep_Builder
+from OCC.Core.TopoDS import TopoDS_Compound, TopoDS_Iterator, TopoDS_Shape
+
+# Running size of each cache folder used by this process, so a store does
+# not have to scan the whole cache
+_cache_sizes = {}
+# Eviction frees space down to this fraction of the size limit, so a full
+# cache is not scanned again on the very next store
+EVICT_TO = 0.9
+
+
+class ParseCache:
+    """
+    On-disk cache of StepFile.read results keyed by STEP content hash.
+
+    Each entry stores the main shape and every part in one compound written in
+    OCC's binary BRep format, plus a JSON index with the part names. Entries
+    are evicted least recently used first once the cache grows past its size
+    limit.
+
+    The cache size is scanned once per process and then kept as a running
+    total; the full scan only runs again once that total passes the limit.
+    Entries stored by other processes are counted at that next scan.
+    """
+    FORMAT_VERSION = 3
+    SHAPES_FILE = 'shapes.bin'
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, cache_dir, max_size_bytes):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, file_hash, settings):
+        payload = json.dumps({'file_hash': file_hash, 'settings': settings,
+                              'version': self.FORMAT_VERSION}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def load(self, key):
+        """
+        Returns (parts, main_shape, extra) for a cached entry, or None on a miss.
+        """
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            return None
+        try:
+            with open(os.path.join(entry_dir, self.INDEX_FILE)) as f:
+                index = json.load(f)
+            compound = TopoDS_Shape()
+            if not bintools.Read(compound, os.path.join(entry_dir, self.SHAPES_FILE)):
+                raise ValueError("BRep read failed")
+            shapes = []
+            iterator = TopoDS_Iterator(compound)
+            while iterator.More():
+                shapes.append(iterator.Value())
+                iterator.Next()
+            if len(shapes) != len(index['names']) + 1:
+                raise ValueError("Shape count does not match the cache index")
+            # Mark the entry as recently used for LRU eviction
+            os.utime(entry_dir)
+        except Exception as e:
+            logging.warning(f"Discarding unreadable parse cache entry {key}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        parts = list(zip(index['names'], shapes[1:]))
+        return parts, shapes[0], index.get('extra')
+
+    def store(self, key, parts, main_shape, extra=None):
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+        # Build the entry in a private directory and move it into place in one
+        # step, so concurrent workers never see a half-written entry.
+        tmp_dir = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            builder = BRep_Builder()
+            compound = TopoDS_Compound()
+            builder.MakeCompound(compound)
+            builder.Add(compound, main_shape)
+            for _, shape in parts:
+                builder.Add(compound, shape)
+            if not bintools.Write(compound, os.path.join(tmp_dir, self.SHAPES_FILE)):
+                raise ValueError("BRep write failed")
+            with open(os.path.join(tmp_dir, self.INDEX_FILE), 'w') as f:
+                json.dump({'names': [name for name, _ in parts], 'extra': extra}, f)
+        except Exception as e:
+            logging.warning(f"Could not store parse cache entry {key}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        size = sum(f.stat().st_size for f in os.scandir(tmp_dir))
+        try:
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another worker stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        if self._size_key() not in _cache_sizes:
+            self._scan()
+        else:
+            _cache_sizes[self._size_key()] += size
+        if _cache_sizes[self._size_key()] > self.max_size_bytes:
+            self.evict()
+
+    def _size_key(self):
+        return os.path.realpath(self.cache_dir)
+
+    def _scan(self):
+        """
+        Returns (mtime, size, path) of every entry, oldest first, and resets
+        the running size of the cache.
+        """
+        entries = []
+        total_size = 0
+        for bucket in os.scandir(self.cache_dir):
+            if not bucket.is_dir() or bucket.name.startswith('.'):
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                    total_size += size
+                except OSError:
+                    continue
+        entries.sort()
+        _cache_sizes[self._size_key()] = total_size
+        return entries
+
+    def evict(self):
+        entries = self._scan()
+        total_size = _cache_sizes[self._size_key()]
+        for _, size, path in entries:
+            if total_size <= self.max_size_bytes * EVICT_TO:
+                break
+            logging.info(f"Evicting parse cache entry {os.path.basename(path)}")
+            shutil.rmtree(path, ignore_errors=True)
+            total_size -= size
+        _cache_sizes[self._size_key()] = total_size
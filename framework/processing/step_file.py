@@ -6,23 +6,96 @@ from OCC.Core.TopoDS import TopoDS_Iterator, TopoDS_Shape
 from OCC.Core.TDocStd import TDocStd_Document
 from OCC.Core.XCAFDoc import XCAFDoc_DocumentTool
 from OCC.Core.STEPCAFControl import STEPCAFControl_Reader
-from OCC.Core.TDF import TDF_LabelSequence, TDF_Label
+from OCC.Core.TDF import TDF_LabelSequence, TDF_Label, TDF_Tool
+from OCC.Core.TCollection import TCollection_AsciiString
 from OCC.Core.TopLoc import TopLoc_Location
 from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_Transform
 
 class StepFile:
-    def __init__(self, filename):
+    def __init__(self, filename, parse_cache=None, file_hash=None, share_geometry=False):
         self.filename = filename
+        self.parse_cache = parse_cache
+        self.file_hash = file_hash
+        self.share_geometry = share_geometry
         self.parts = []
         self.main_shape = None
+        self.from_cache = False
+        # Every part is an instance of a prototype, i.e. the label it was
+        # read from. part_prototypes[i] indexes prototypes for self.parts[i].
+        self.prototypes = []
+        self.part_prototypes = []
+        # Placement of each part as a row-major 3x4 matrix, from the root of
+        # the assembly to the prototype's own shape
+        self.part_locations = []
+
+    def reader_settings(self):
+        """
+        Settings that change what read() returns; part of the parse cache key.
+        """
+        return {'name_mode': True, 'share_geometry': self.share_geometry}
 
     def read(self):
         if not os.path.isfile(self.filename):
             raise FileNotFoundError(f"{self.filename} not found.")
 
-        doc = TDocStd_Document("pythonocc-doc-step-import")
+        cache_key = None
+        if self.parse_cache is not None and self.file_hash is not None:
+            cache_key = self.parse_cache.key(self.file_hash, self.reader_settings())
+            cached = self.parse_cache.load(cache_key)
+            if cached is not None:
+                self.parts, self.main_shape, extra = cached
+                self.prototypes = [tuple(p) for p in extra['prototypes']]
+                self.part_prototypes = extra['part_prototypes']
+                self.part_locations = [tuple(m) for m in extra['part_locations']]
+                self.from_cache = True
+                return self.parts, self.main_shape
+
+        self._read_step()
+
+        if cache_key is not None:
+            extra = {'prototypes': self.prototypes, 'part_prototypes': self.part_prototypes,
+                     'part_locations': self.part_locations}
+            self.parse_cache.store(cache_key, self.parts, self.main_shape, extra)
+
+        return self.parts, self.main_shape
+
+    def _read_step(self):
+        doc = self._transfer()
         shape_tool = XCAFDoc_DocumentTool.ShapeTool(doc.Main())
 
+        labels = TDF_LabelSequence()
+        shape_tool.GetFreeShapes(labels)
+        if labels.Length() > 0:
+            self.main_shape = shape_tool.GetShape(labels.Value(1))
+        else:
+            raise ValueError("No shapes found in the transferred document")
+
+        # Each instance goes straight into the part lists as the walk yields
+        # it; only the final order is applied afterwards.
+        parts = []
+        part_prototypes = []
+        part_locations = []
+        for name, shape, prototype_id, location in self.iter_instances(shape_tool):
+            parts.append((name, shape))
+            part_prototypes.append(prototype_id)
+            part_locations.append(location)
+        order = sorted(range(len(parts)), key=lambda k: parts[k][0])
+        self.parts = [parts[k] for k in order]
+        self.part_prototypes = [part_prototypes[k] for k in order]
+        self.part_locations = [part_locations[k] for k in order]
+        del parts
+
+        # The extracted shapes hold their own references to the geometry, so
+        # the document's attributes can be released right away.
+        doc.Main().Root().ForgetAllAttributes(True)
+
+    def _transfer(self):
+        """
+        Reads the STEP file into a new XCAF document. The STEP model held by
+        the reader is released when this returns.
+        """
+        doc = TDocStd_Document("pythonocc-doc-step-import")
+
         step_reader = STEPCAFControl_Reader()
         step_reader.SetNameMode(True)
 
@@ -34,66 +107,62 @@ class StepFile:
         if not ok:
             raise ValueError("Transfer failed")
 
-        output_shapes = {}
-        locs = []
-
-        def _get_sub_shapes(lab, loc):
-            l_subss = TDF_LabelSequence()
-            shape_tool.GetSubShapes(lab, l_subss)
-            l_comps = TDF_LabelSequence()
-            shape_tool.GetComponents(lab, l_comps)
-            name = lab.GetLabelName()
+        return doc
+
+    def iter_instances(self, shape_tool):
+        """
+        Yields (name, shape, prototype_id, location) for every distinct placed
+        part, in traversal order, and fills self.prototypes along the way.
+        """
+        seen = set()
+        prototype_ids = {}
+
+        def _place(shape, loc):
+            if self.share_geometry:
+                # Same TShape, new location: no geometry is copied
+                return shape.Moved(loc)
+            return BRepBuilderAPI_Transform(shape, loc.Transformation()).Shape()
+
+        def _instance(lab, loc):
+            entry = TCollection_AsciiString()
+            TDF_Tool.Entry(lab, entry)
+            entry = entry.ToCString()
+            if entry not in prototype_ids:
+                prototype_ids[entry] = len(self.prototypes)
+                self.prototypes.append((entry, lab.GetLabelName()))
+            shape = _place(shape_tool.GetShape(lab), loc)
+            if shape in seen:
+                return None
+            seen.add(shape)
+            trsf = loc.Transformation()
+            location = tuple(trsf.Value(row, col) for row in range(1, 4) for col in range(1, 5))
+            return lab.GetLabelName(), shape, prototype_ids[entry], location
+
+        # Depth-first walk with an explicit stack. Each entry carries the
+        # location accumulated from the root, so a leaf never has to rebuild it.
+        labels = TDF_LabelSequence()
+        shape_tool.GetFreeShapes(labels)
+        stack = [(labels.Value(i), TopLoc_Location()) for i in range(labels.Length(), 0, -1)]
+        while stack:
+            lab, loc = stack.pop()
 
             if shape_tool.IsAssembly(lab):
                 l_c = TDF_LabelSequence()
                 shape_tool.GetComponents(lab, l_c)
+                children = []
                 for i in range(l_c.Length()):
                     label = l_c.Value(i + 1)
                     if shape_tool.IsReference(label):
                         label_reference = TDF_Label()
                         shape_tool.GetReferredShape(label, label_reference)
-                        loc = shape_tool.GetLocation(label)
-                        locs.append(loc)
-                        _get_sub_shapes(label_reference, loc)
-                        locs.pop()
+                        children.append((label_reference, loc.Multiplied(shape_tool.GetLocation(label))))
+                stack.extend(reversed(children))
 
             elif shape_tool.IsSimpleShape(lab):
-                shape = shape_tool.GetShape(lab)
-                loc_accumulated = TopLoc_Location()
-                for l in locs:
-                    loc_accumulated = loc_accumulated.Multiplied(l)
-                shape_disp = BRepBuilderAPI_Transform(
-                    shape, loc_accumulated.Transformation()).Shape()
-                if shape_disp not in output_shapes:
-                    output_shapes[shape_disp] = lab.GetLabelName()
-                for i in range(l_subss.Length()):
-                    lab_subs = l_subss.Value(i + 1)
-                    shape_sub = shape_tool.GetShape(lab_subs)
-                    shape_to_disp = BRepBuilderAPI_Transform(
-                        shape_sub, loc_accumulated.Transformation()
-                    ).Shape()
-                    if shape_to_disp not in output_shapes:
-                        output_shapes[shape_to_disp] = lab_subs.GetLabelName()
-
-        def _get_shapes():
-            labels = TDF_LabelSequence()
-            shape_tool.GetFreeShapes(labels)
-            for i in range(labels.Length()):
-                root_item = labels.Value(i + 1)
-                _get_sub_shapes(root_item, None)
-
-        _get_shapes()
-
-        self.parts = [(name, shape) for shape, name in output_shapes.items()]
-        self.parts.sort(key=lambda x: x[0])
-
-        shape_tool = XCAFDoc_DocumentTool.ShapeTool(doc.Main())
-        labels = TDF_LabelSequence()
-        shape_tool.GetFreeShapes(labels)
-
-        if labels.Length() > 0:
-            self.main_shape = shape_tool.GetShape(labels.Value(1))
-        else:
-            raise ValueError("No shapes found in the transferred document")
-
-        return self.parts, self.main_shape
+                l_subss = TDF_LabelSequence()
+                shape_tool.GetSubShapes(lab, l_subss)
+                sub_labels = [l_subss.Value(i + 1) for i in range(l_subss.Length())]
+                for sub_lab in [lab] + sub_labels:
+                    instance = _instance(sub_lab, loc)
+                    if instance is not None:
+                        yield instance
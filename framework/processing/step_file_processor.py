@@ -1,34 +1,53 @@
 import os
 import logging
-import multiprocessing
 import json
 import re
 import platform
 from colorama import Fore, Style
 from tqdm import tqdm
-from OCC.Core.AIS import AIS_Shape
-from OCC.Display.SimpleGui import init_display
 from OCC.Extend.DataExchange import read_step_file
 from OCC.Core.TopExp import TopExp_Explorer
 from OCC.Core.TopAbs import TopAbs_SOLID, TopAbs_COMPOUND
 import time
 import gc
+from contextlib import contextmanager
 
 from processing.step_file import StepFile
-from graphs.assembly_graph import AssemblyGraph
+from graphs.assembly_graph import AssemblyGraph, unique_node_ids
 from graphs.hierarchical_graph import HierarchicalGraph
-from metadata.metadata_generator import MetadataGenerator
+from graphs.face_adjacency_graph import FaceAdjacencyGraph
+from graphs.writers import write_graph, graphml_path
+from graphs.graphml_stream import StreamingGraphMLWriter
+from metadata.metadata_service import MetadataService
+from rendering.offscreen_renderer import get_renderer, render_stats, DEFAULT_IMAGE_SIZE
+from rendering.atlas import AtlasWriter, ImageAtlas, DEFAULT_THUMBNAIL_SIZE
+from rendering.image_map import write_image_map
+from utils.shape_utils import ShapeUtils
 from utils.output_utils import suppress_output
-try:
-    from pyvirtualdisplay import Display
-except ImportError:
-    Display = None
+from utils.file_utils import compute_file_hash, write_json_atomic
+from processing.build_manifest import BuildManifest
+from processing.parse_cache import ParseCache
+from utils.memory_utils import PeakRSSMonitor, to_mb
+from supervisor import report_stage
 
 
 class StepFileProcessor:
+    # tqdm line of the per-file progress bar, set per worker process
+    progress_position = 0
+    # RenderClient of a RenderService, set per worker process when rendering runs on its own workers
+    render_client = None
+    # Job queue of the run's MetadataService, set per worker process
+    metadata_jobs = None
+
     def __init__(self, file_path, output_folder, skip_existing, generate_metadata_flag,
                  generate_assembly, generate_hierarchical, save_pdf, save_html,
-                 no_self_connections, generate_stats, images, images_metadata, headless=None):
+                 no_self_connections, generate_stats, images, images_metadata, headless=None,
+                 parse_cache_dir=None, parse_cache_size=None, share_geometry=False, low_memory=False,
+                 contact_workers=1, broad_phase='sweep', hierarchical_solids=False,
+                 hierarchical_vertices=False, hierarchical_max_depth=None, formats=None,
+                 graphml_gzip=False, hierarchical_features=False, face_adjacency=False,
+                 face_adjacency_features=False, image_size=None, image_atlas=False, full_images=False,
+                 thumbnail_size=DEFAULT_THUMBNAIL_SIZE, thumbnail_format='jpeg', image_dedupe='prototype'):
         self.file_path = file_path
         self.output_folder = output_folder
         self.skip_existing = skip_existing
@@ -47,8 +66,33 @@ class StepFileProcessor:
         if not os.path.exists(self.subfolder):
             os.makedirs(self.subfolder)
         self.parts = []
+        self.part_prototypes = []
+        self.part_locations = []
         self.shape = None
+        self.share_geometry = share_geometry
+        self.low_memory = low_memory
+        self.contact_workers = contact_workers
+        self.broad_phase = broad_phase
+        self.hierarchical_solids = hierarchical_solids
+        self.hierarchical_vertices = hierarchical_vertices
+        self.hierarchical_max_depth = hierarchical_max_depth
+        self.formats = formats or ['graphml']
+        self.graphml_gzip = graphml_gzip
+        self.hierarchical_features = hierarchical_features
+        self.face_adjacency = face_adjacency
+        self.face_adjacency_features = face_adjacency_features
+        self.image_size = tuple(image_size or DEFAULT_IMAGE_SIZE)
+        self.image_atlas = image_atlas
+        # Without an atlas the full-resolution images are the only output
+        self.full_images = full_images or not image_atlas
+        self.thumbnail_size = thumbnail_size
+        self.thumbnail_format = thumbnail_format
+        self.image_dedupe = image_dedupe
+        self.part_count = 0
+        self.product_names = []
+        self.stage_stats = {}
         self.headless = self.determine_headless_mode(headless)
+        self.parse_cache = ParseCache(parse_cache_dir, parse_cache_size) if parse_cache_dir else None
 
     def determine_headless_mode(self, headless_arg):
         """
@@ -70,97 +114,115 @@ class StepFileProcessor:
         return False
 
     def process(self):
+        render_batch = None
         try:
-            logging.info(f"Reading STEP file: {self.filename}")
-            step_file = StepFile(self.file_path)
-            self.parts, self.shape = step_file.read()
-            logging.info(f"STEP file read complete for {self.filename}")
+            input_hash = compute_file_hash(self.file_path)
+            manifest = BuildManifest(self.subfolder, self.name_without_extension).load()
+            requested = self._requested_artifacts()
+            pending = [a for a in requested if self._needs_build(manifest, a, input_hash)]
+            # The statistics file summarizes the other artifacts, so it follows them
+            if pending and 'stats' in requested and 'stats' not in pending:
+                pending.append('stats')
+
+            if not pending:
+                manifest.save()
+                logging.info(f"Skipped {self.filename} (all outputs up to date)")
+                return f"{Fore.YELLOW} {self.filename} outputs already up to date, skipping{Style.RESET_ALL}"
+
+            # Everything except the statistics file needs the parsed geometry
+            if any(a != 'stats' for a in pending):
+                logging.info(f"Reading STEP file: {self.filename}")
+                with self._stage('read'):
+                    step_file = StepFile(self.file_path, parse_cache=self.parse_cache, file_hash=input_hash,
+                                         share_geometry=self.share_geometry)
+                    self.parts, self.shape = step_file.read()
+                self.part_prototypes = step_file.part_prototypes
+                self.part_locations = step_file.part_locations
+                self.part_count = len(self.parts)
+                self.product_names = [part[0] for part in self.parts if part[0]]
+                source = "parse cache" if step_file.from_cache else "STEP file"
+                del step_file
+                logging.info(f"STEP file read complete for {self.filename} (from {source})")
 
-            statistics = {}
             images_folder = os.path.join(self.subfolder, "images")
-            if self.images:
-                if not os.path.exists(images_folder):
-                    os.makedirs(images_folder)
-                self.extract_images(self.shape, images_folder)
-
-            if self.generate_assembly:
-                assembly_graph_path = os.path.join(self.subfolder, f"{self.name_without_extension}_assembly.graphml")
-                if self.skip_existing and os.path.exists(assembly_graph_path):
-                    logging.info(f"Skipped assembly graph for {self.filename} (already exists)")
-                    skip_msg = f"{Fore.YELLOW} {self.filename} assembly graph already exists, skipping{Style.RESET_ALL}"
-                    if self.generate_stats:
-                        statistics['assembly'] = {'status': 'skipped'}
-                    return skip_msg
-
-                logging.info(f"Creating assembly graph for {self.filename}")
-                total_comparisons = len(self.parts) * (len(self.parts) - 1) // 2
-                with tqdm(total=total_comparisons, desc=f"{Fore.CYAN}{self.filename}{Style.RESET_ALL}",
-                          unit="comp", leave=False, position=multiprocessing.current_process()._identity[0] - 1) as pbar:
-                    assembly_graph = AssemblyGraph(self.parts, self.filename, no_self_connections=self.no_self_connections, images_folder=images_folder)
-                    assembly_graph.create(pbar)
-                    logging.info(f"Saving assembly graph for {self.filename}")
-                    assembly_graph.save_graphml(assembly_graph_path)
-
-                    if self.save_pdf:
-                        logging.info(f"Saving assembly graph as PDF for {self.filename}")
-                        assembly_graph.save_pdf(os.path.join(self.subfolder, f"{self.name_without_extension}_assembly"))
-
-                    if self.save_html:
-                        logging.info(f"Saving assembly graph as HTML for {self.filename}")
-                        assembly_graph.save_html(os.path.join(self.subfolder, f"{self.name_without_extension}_assembly.html"))
-
-                if self.generate_stats:
-                    statistics['assembly'] = {
-                        'nodes': assembly_graph.graph.number_of_nodes(),
-                        'edges': assembly_graph.graph.number_of_edges(),
-                        'named_parts': len([p for p in self.parts if p[0]]),
-                        'unnamed_parts': len([p for p in self.parts if not p[0]])
-                    }
+            instances = None
+            if 'images' in pending:
+                with self._stage('images'):
+                    if not os.path.exists(images_folder):
+                        os.makedirs(images_folder)
+                    self._remove_recorded_files(manifest, 'images')
+                    image_jobs, instances = self._image_jobs(self.shape, images_folder)
+                    if self.render_client is not None:
+                        # Rendered by the render service while the graphs are built
+                        render_batch = self.render_client.submit(image_jobs, self._thumbnail(), self.full_images)
+                    else:
+                        rendered, stats = self.extract_images(image_jobs)
+                        image_files = self._save_images(rendered, images_folder, instances, stats)
+                if render_batch is None:
+                    self._record(manifest, 'images', input_hash, image_files, stats)
 
-            if self.generate_hierarchical:
-                hierarchical_graph_path = os.path.join(self.subfolder, f"{self.name_without_extension}_hierarchical.graphml")
-                if self.skip_existing and os.path.exists(hierarchical_graph_path):
-                    logging.info(f"Skipped hierarchical graph for {self.filename} (already exists)")
-                    skip_msg = f"{Fore.YELLOW} {self.filename} hierarchical graph already exists, skipping{Style.RESET_ALL}"
-                    if self.generate_stats:
-                        statistics['hierarchical'] = {'status': 'skipped'}
-                    return skip_msg
-
-                logging.info(f"Creating hierarchical graph for {self.filename}")
-                hierarchical_graph = HierarchicalGraph(self.shape)
-                hierarchical_graph.create()
-                logging.info(f"Saving hierarchical graph for {self.filename}")
-                hierarchical_graph.save_graphml(hierarchical_graph_path)
-
-                if self.generate_stats:
-                    statistics['hierarchical'] = {
-                        'nodes': hierarchical_graph.graph.number_of_nodes(),
-                        'edges': hierarchical_graph.graph.number_of_edges(),
-                        'shells': self._count_graph_nodes_by_type(hierarchical_graph.graph, 'SHELL'),
-                        'faces': self._count_graph_nodes_by_type(hierarchical_graph.graph, 'FACE'),
-                        'edges_graph': self._count_graph_nodes_by_type(hierarchical_graph.graph, 'EDGE')
+            deferred_assembly = None
+            if 'assembly' in pending:
+                # The HTML export shows the part images. While the render
+                # service renders them, it shows them as they will be saved,
+                # and the assembly is recorded once they are.
+                pending_images = None
+                if render_batch is not None and self.save_html:
+                    pending_images = ({instance['part']: instance['image'] for instance in instances},
+                                      self.image_atlas)
+                with self._stage('assembly'):
+                    files, stats, html_images = self._build_assembly_graph(images_folder, pending_images)
+                if render_batch is not None:
+                    deferred_assembly = {
+                        'options': self._artifact_options('assembly'),
+                        'files': files,
+                        'stats': dict(stats, stage=self.stage_stats['assembly']),
+                        'html': files[-1] if pending_images is not None else None,
+                        'html_images': html_images
                     }
+                else:
+                    self._record(manifest, 'assembly', input_hash, files, stats)
+            # Later stages only need the main shape and the product names
+            self._release('parts')
+
+            if 'hierarchical' in pending:
+                with self._stage('hierarchical'):
+                    files, stats = self._build_hierarchical_graph()
+                self._record(manifest, 'hierarchical', input_hash, files, stats)
 
-            if self.generate_metadata_flag and len(self.parts) > 3:
-                logging.info(f"Generating metadata for {self.filename}")
-                product_names = [part[0] for part in self.parts if part[0]]
-                metadata_generator = MetadataGenerator(images_metadata=self.images_metadata)
-                metadata = metadata_generator.generate(product_names, self.filename, images_folder)
-                if metadata:
-                    metadata_path = os.path.join(self.subfolder, f"{self.name_without_extension}_metadata.json")
-                    with open(metadata_path, 'w') as f:
-                        json.dump(metadata, f, indent=2)
-
-                    if self.generate_stats:
-                        statistics['metadata'] = {
-                            'generated': True,
-                            'metadata_file': metadata_path
-                        }
-
-            if self.generate_stats:
-                stats_path = os.path.join(self.subfolder, f"{self.name_without_extension}_statistics.json")
-                with open(stats_path, 'w') as f:
-                    json.dump(statistics, f, indent=2)
+            if 'face_adjacency' in pending:
+                with self._stage('face_adjacency'):
+                    files, stats = self._build_face_adjacency_graph()
+                self._record(manifest, 'face_adjacency', input_hash, files, stats)
+            self._release('shape')
+
+            metadata_job = None
+            if 'metadata' in pending:
+                if self.part_count > 3:
+                    metadata_job = self._metadata_job(images_folder, input_hash, requested)
+                else:
+                    # Not worth a request, and the same next run
+                    self._record(manifest, 'metadata', input_hash, [], {'skipped': 'fewer than 4 parts'})
+
+            if 'stats' in pending:
+                stats_path = self._artifact_path('stats')
+                statistics = manifest.statistics([a for a in requested if a != 'stats'])
+                if 'read' in self.stage_stats:
+                    statistics['read'] = self.stage_stats['read']
+                write_json_atomic(stats_path, statistics)
+                manifest.record('stats', input_hash, self._artifact_options('stats'), [stats_path])
+
+            manifest.save()
+            # Handed over once the manifest is saved, as the services record into it
+            if render_batch is not None:
+                # The render service saves and records the images once they
+                # are rendered, and queues the metadata after them, so this
+                # worker can go on with its next file
+                render_batch.finish(self._render_spec(input_hash, images_folder, instances, deferred_assembly,
+                                                      metadata_job, requested))
+                render_batch = None
+            elif metadata_job is not None:
+                self._submit_metadata(metadata_job)
 
             logging.info(f"Finished processing {self.filename}")
             success_msg = f"{Fore.GREEN} {self.filename} processed successfully{Style.RESET_ALL}"
@@ -168,83 +230,451 @@ class StepFileProcessor:
 
         except Exception as e:
             logging.error(f"Error processing {self.filename}: {str(e)}")
+            if render_batch is not None:
+                render_batch.cancel()
             error_msg = f"{Fore.RED} Error processing {self.filename}: {str(e)}{Style.RESET_ALL}"
             return error_msg
 
-    def _count_graph_nodes_by_type(self, graph, node_type):
-        return len([n for n, attr in graph.nodes(data=True) if attr.get('shape_type') == node_type])
+    def _requested_artifacts(self):
+        artifacts = []
+        if self.images:
+            artifacts.append('images')
+        if self.generate_assembly:
+            artifacts.append('assembly')
+        if self.generate_hierarchical:
+            artifacts.append('hierarchical')
+        if self.face_adjacency:
+            artifacts.append('face_adjacency')
+        if self.generate_metadata_flag:
+            artifacts.append('metadata')
+        if self.generate_stats:
+            artifacts.append('stats')
+        return artifacts
+
+    def _artifact_path(self, artifact):
+        suffixes = {
+            'assembly': '_assembly.graphml',
+            'hierarchical': '_hierarchical.graphml',
+            'face_adjacency': '_face_adjacency.graphml',
+            'metadata': '_metadata.json',
+            'stats': '_statistics.json'
+        }
+        return os.path.join(self.subfolder, f"{self.name_without_extension}{suffixes[artifact]}")
 
-    def extract_images(self, shape, output_folder):
+    def _graph_base(self, artifact):
+        # Graph writers add their own extension to this path
+        return os.path.join(self.subfolder, f"{self.name_without_extension}_{artifact}")
+
+    def _artifact_options(self, artifact):
         """
-        Extracts images of the assembly and individual parts.
-        Supports headless operation on Linux servers.
+        Returns the options that change the content of an artifact. A change in
+        any of them makes the recorded artifact stale.
         """
-        display_manager = None
-        display = None
-        logging.info(f"Extracting images started for {self.filename}")
-        
+        if artifact == 'assembly':
+            return {'no_self_connections': self.no_self_connections,
+                    'save_pdf': self.save_pdf, 'save_html': self.save_html, 'formats': self.formats,
+                    'graphml_gzip': self.graphml_gzip}
+        if artifact == 'hierarchical':
+            return {'traversal': 'unique', 'solids': self.hierarchical_solids,
+                    'vertices': self.hierarchical_vertices, 'max_depth': self.hierarchical_max_depth,
+                    'formats': self.formats, 'graphml_gzip': self.graphml_gzip,
+                    'features': self.hierarchical_features}
+        if artifact == 'face_adjacency':
+            return {'formats': self.formats, 'graphml_gzip': self.graphml_gzip,
+                    'features': self.face_adjacency_features}
+        if artifact == 'images':
+            return {'image_size': list(self.image_size), 'atlas': self.image_atlas, 'full_images': self.full_images,
+                    'thumbnail': list(self._thumbnail() or []), 'dedupe': self.image_dedupe}
+        if artifact == 'metadata':
+            return {'images_metadata': self.images_metadata}
+        if artifact == 'stats':
+            return {'artifacts': [a for a in self._requested_artifacts() if a != 'stats']}
+        return {}
+
+    def _needs_build(self, manifest, artifact, input_hash):
+        if not self.skip_existing:
+            return True
+        options = self._artifact_options(artifact)
+        if manifest.is_up_to_date(artifact, input_hash, options):
+            return False
+        # Graphs written before manifests existed are kept, as they were before
+        if (manifest.get(artifact) is None and artifact in ('assembly', 'hierarchical')
+                and self.formats == ['graphml'] and not self.graphml_gzip):
+            path = self._artifact_path(artifact)
+            if os.path.exists(path):
+                logging.info(f"Adopting existing {artifact} graph for {self.filename}")
+                manifest.record(artifact, input_hash, options, [path], stats={'status': 'skipped'})
+                return False
+        return True
+
+    @contextmanager
+    def _stage(self, name):
+        """
+        Times a processing stage and records the peak RSS reached during it.
+        """
+        start_time = time.time()
+        report_stage(name)
         try:
-            if self.headless:
-                if Display is None:
-                    logging.error("pyvirtualdisplay is not installed. Unable to run in headless mode.")
-                    raise ImportError("pyvirtualdisplay is required for headless mode.")
-                try:
-                    display_manager = Display(visible=0, size=(800, 600))
-                    display_manager.start()
-                    logging.info("Initialized virtual display for headless operation.")
-                except Exception as e:
-                    logging.error(f"Failed to initialize virtual display: {e}")
-                    raise
-
-            
-            display, start_display, add_menu, add_function_to_menu = init_display()
-            
-            logging.debug(f"Initialized display for {self.filename}")
-            
-            # Save full assembly image
-            display.Context.RemoveAll(True)
-            ais_shape = AIS_Shape(shape)
-            display.Context.Display(ais_shape, True)
-            display.FitAll()
-            
-            full_assembly_path = os.path.join(output_folder, f"{self.name_without_extension}_full_assembly.png")
-            display.View.Dump(full_assembly_path)
-            logging.info(f"Saved full assembly image: {full_assembly_path}")
-            
-            # Extract individual part images
-            for i, (part_name, part_shape) in enumerate(self.parts):
-                if part_shape.ShapeType() in [TopAbs_SOLID, TopAbs_COMPOUND]:
-                    display.Context.RemoveAll(True)
-                    ais_part = AIS_Shape(part_shape)
-                    display.Context.Display(ais_part, True)
-                    display.FitAll()
-                    
+            with PeakRSSMonitor() as monitor:
+                yield
+        finally:
+            report_stage(None)
+        self.stage_stats[name] = {
+            'seconds': round(time.time() - start_time, 3),
+            'start_rss_mb': to_mb(monitor.start_rss),
+            'peak_rss_mb': to_mb(monitor.peak_rss),
+            'end_rss_mb': to_mb(monitor.end_rss)
+        }
+
+    def _release(self, attribute):
+        """
+        In low-memory mode, drops a reference as soon as no later stage needs it.
+        """
+        if not self.low_memory:
+            return
+        if attribute == 'parts':
+            self.parts = []
+            self.part_prototypes = []
+            self.part_locations = []
+        else:
+            setattr(self, attribute, None)
+        gc.collect()
+
+    def _record(self, manifest, artifact, input_hash, files, stats):
+        stats = dict(stats)
+        if artifact in self.stage_stats:
+            stats['stage'] = self.stage_stats[artifact]
+        manifest.record(artifact, input_hash, self._artifact_options(artifact), files, stats=stats)
+
+    def _remove_recorded_files(self, manifest, artifact):
+        """
+        Removes the files of a stale artifact so renamed outputs do not pile up.
+        """
+        entry = manifest.get(artifact)
+        for rel_path in (entry or {}).get('files', []):
+            path = os.path.join(self.subfolder, rel_path)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _render_spec(self, input_hash, images_folder, instances, deferred_assembly, metadata_job, requested):
+        """
+        What the render service needs to finish the images of this file, see
+        finish_render().
+        """
+        return {
+            'filename': self.filename,
+            'name': self.name_without_extension,
+            'subfolder': self.subfolder,
+            'images_folder': images_folder,
+            'instances': instances,
+            'input_hash': input_hash,
+            'options': self._artifact_options('images'),
+            'stage': self.stage_stats['images'],
+            'image_size': list(self.image_size),
+            'thumbnail': self._thumbnail(),
+            'full_images': self.full_images,
+            'dedupe': self.image_dedupe,
+            'assembly': deferred_assembly,
+            'metadata_job': metadata_job,
+            'stats_path': self._artifact_path('stats') if 'stats' in requested else None
+        }
+
+    @classmethod
+    def finish_render(cls, spec, rendered, stats):
+        """
+        Saves the images of a file once the render service rendered them all.
+        Called in the process running the service with the _render_spec() of
+        the file. Records the images, and the assembly whose HTML shows them,
+        in the manifest and statistics, then queues the file's metadata.
+        Images with failed renders are not recorded, and neither is the
+        assembly, so the next run builds them again.
+        """
+        stats['image_size'] = spec['image_size']
+        statistics = {'images': stats}
+        if stats['failed']:
+            logging.error(f"{stats['failed']} images of {spec['filename']} could not be rendered")
+        else:
+            image_files = cls._write_images(rendered, spec['images_folder'], spec['name'], spec['instances'],
+                                            stats, spec['thumbnail'], spec['full_images'], spec['dedupe'])
+            stats['stage'] = spec['stage']
+            manifest = BuildManifest(spec['subfolder'], spec['name']).load()
+            manifest.record('images', spec['input_hash'], spec['options'], image_files, stats=stats)
+            assembly = spec['assembly']
+            if assembly is not None:
+                if assembly['html_images']:
+                    atlas = ImageAtlas.find(spec['images_folder'])
+                    AssemblyGraph.embed_atlas_images(assembly['html'],
+                                                     [atlas.data_uri(name) for name in assembly['html_images']])
+                manifest.record('assembly', spec['input_hash'], assembly['options'], assembly['files'],
+                                stats=assembly['stats'])
+                statistics['assembly'] = assembly['stats']
+            manifest.save()
+        stats_path = spec['stats_path']
+        if stats_path and os.path.exists(stats_path):
+            with open(stats_path) as f:
+                file_statistics = json.load(f)
+            file_statistics.update(statistics)
+            write_json_atomic(stats_path, file_statistics)
+        if spec['metadata_job'] is not None:
+            cls._submit_metadata(spec['metadata_job'])
+
+    def _thumbnail(self):
+        return (self.thumbnail_size, self.thumbnail_format) if self.image_atlas else None
+
+    def _save_images(self, rendered, images_folder, instances, stats):
+        return self._write_images(rendered, images_folder, self.name_without_extension, instances, stats,
+                                  self._thumbnail(), self.full_images, self.image_dedupe)
+
+    @staticmethod
+    def _write_images(rendered, images_folder, name, instances, stats, thumbnail, full_images, dedupe):
+        """
+        Packs the thumbnails of the rendered images into the atlas, if one is
+        requested through thumbnail, and writes the instance to image map.
+        Returns the image files of the file.
+        """
+        stats['part_instances'] = len(instances)
+        stats['dedupe'] = dedupe
+        image_paths = [image_path for image_path, _ in rendered] if full_images else []
+        image_paths.append(write_image_map(images_folder, name, instances))
+        if thumbnail is None:
+            return image_paths
+        atlas = AtlasWriter(*thumbnail)
+        for image_path, encoded in rendered:
+            image_name = os.path.splitext(os.path.basename(image_path))[0]
+            atlas.add(image_name, encoded, os.path.basename(image_path) if full_images else None)
+        return atlas.save(images_folder, name) + image_paths
+
+    def _build_assembly_graph(self, images_folder, pending_images=None):
+        logging.info(f"Creating assembly graph for {self.filename}")
+        # The total is set to the number of candidate pairs once the broad phase has run
+        with tqdm(total=None, desc=f"{Fore.CYAN}{self.filename}{Style.RESET_ALL}",
+                  unit="comp", leave=False, position=self.progress_position) as pbar:
+            assembly_graph = AssemblyGraph(self.parts, self.filename, no_self_connections=self.no_self_connections, images_folder=images_folder,
+                                           contact_workers=self.contact_workers, broad_phase=self.broad_phase,
+                                           part_prototypes=self.part_prototypes, part_locations=self.part_locations)
+            assembly_graph.create(pbar)
+            logging.info(f"Saving assembly graph for {self.filename}")
+            files, write_stats = write_graph(assembly_graph, self._graph_base('assembly'), self.formats,
+                                             compress=self.graphml_gzip)
+
+            if self.save_pdf:
+                logging.info(f"Saving assembly graph as PDF for {self.filename}")
+                pdf_base = os.path.join(self.subfolder, f"{self.name_without_extension}_assembly")
+                assembly_graph.save_pdf(pdf_base)
+                files.append(f"{pdf_base}.pdf")
+
+            html_images = []
+            if self.save_html:
+                html_path, html_images = self._save_assembly_html(assembly_graph, pending_images)
+                files.append(html_path)
+
+        stats = {
+            'nodes': assembly_graph.number_of_nodes(),
+            'edges': assembly_graph.number_of_edges(),
+            'isolated_parts': int((assembly_graph.degrees() == 0).sum()),
+            'named_parts': len([p for p in self.parts if p[0]]),
+            'unnamed_parts': len([p for p in self.parts if not p[0]]),
+            'prototypes': len(set(self.part_prototypes)),
+            'geometry_cache': assembly_graph.cache_stats.as_dict(),
+            'contact_stages': assembly_graph.contacts.as_dict(),
+            'reused_pairs': assembly_graph.memo.reused,
+            'contact_memo': assembly_graph.memo.as_dict(),
+            'contact_workers': self.contact_workers,
+            'broad_phase': assembly_graph.broad_phase_stats,
+            'writers': write_stats
+        }
+        return files, stats, html_images
+
+    def _save_assembly_html(self, assembly_graph, pending_images=None):
+        """
+        Returns the HTML path and the atlas images still to be embedded, see
+        AssemblyGraph.save_html().
+        """
+        logging.info(f"Saving assembly graph as HTML for {self.filename}")
+        html_path = os.path.join(self.subfolder, f"{self.name_without_extension}_assembly.html")
+        html_images = assembly_graph.save_html(html_path, pending_images)
+        return html_path, html_images if pending_images is not None else []
+
+    def _build_hierarchical_graph(self):
+        logging.info(f"Creating hierarchical graph for {self.filename}")
+        hierarchical_graph = HierarchicalGraph(self.shape, include_solids=self.hierarchical_solids,
+                                               include_vertices=self.hierarchical_vertices,
+                                               max_depth=self.hierarchical_max_depth,
+                                               features=self.hierarchical_features)
+        base_path = self._graph_base('hierarchical')
+        other_formats = [name for name in self.formats if name != 'graphml']
+        files = []
+        write_stats = {}
+        if 'graphml' in self.formats:
+            # GraphML is written while the topology is walked; the edge array
+            # is only kept if another format still needs it
+            path = graphml_path(base_path, self.graphml_gzip)
+            start = time.perf_counter()
+            with StreamingGraphMLWriter(path, True, hierarchical_graph.node_attributes(),
+                                        compress=self.graphml_gzip) as stream:
+                hierarchical_graph.create(stream=stream, keep_edges=bool(other_formats))
+            files.append(path)
+            write_stats['graphml'] = {'seconds': round(time.perf_counter() - start, 3),
+                                      'bytes': os.path.getsize(path), 'streamed': True}
+        else:
+            hierarchical_graph.create()
+        logging.info(f"Saving hierarchical graph for {self.filename}")
+        other_files, other_stats = write_graph(hierarchical_graph, base_path, other_formats,
+                                               compress=self.graphml_gzip)
+        files.extend(other_files)
+        write_stats.update(other_stats)
+
+        stats = {
+            'nodes': hierarchical_graph.number_of_nodes(),
+            'edges': hierarchical_graph.number_of_edges(),
+            'solids': hierarchical_graph.count('SOLID'),
+            'shells': hierarchical_graph.count('SHELL'),
+            'faces': hierarchical_graph.count('FACE'),
+            'edges_graph': hierarchical_graph.count('EDGE'),
+            'vertices': hierarchical_graph.count('VERTEX'),
+            'features': sorted(hierarchical_graph.features),
+            'writers': write_stats
+        }
+        return files, stats
+
+    def _build_face_adjacency_graph(self):
+        logging.info(f"Creating face adjacency graph for {self.filename}")
+        face_adjacency_graph = FaceAdjacencyGraph(self.shape, features=self.face_adjacency_features)
+        face_adjacency_graph.create()
+        logging.info(f"Saving face adjacency graph for {self.filename}")
+        files, write_stats = write_graph(face_adjacency_graph, self._graph_base('face_adjacency'), self.formats,
+                                         compress=self.graphml_gzip)
+
+        stats = {
+            'nodes': face_adjacency_graph.number_of_nodes(),
+            'edges': face_adjacency_graph.number_of_edges(),
+            'isolated_faces': face_adjacency_graph.isolated_faces(),
+            'features': sorted(face_adjacency_graph.face_features) + sorted(face_adjacency_graph.edge_features),
+            'writers': write_stats
+        }
+        return files, stats
+
+    def _metadata_job(self, images_folder, input_hash, requested):
+        return {
+            'filename': self.filename,
+            'name': self.name_without_extension,
+            'subfolder': self.subfolder,
+            'product_names': self.product_names,
+            'images_folder': images_folder,
+            'metadata_path': self._artifact_path('metadata'),
+            'input_hash': input_hash,
+            'options': self._artifact_options('metadata'),
+            'stats_path': self._artifact_path('stats') if 'stats' in requested else None
+        }
+
+    @classmethod
+    def _submit_metadata(cls, job):
+        """
+        Hands the metadata job to the run's MetadataService. Outside a run,
+        the metadata is generated here by a service of its own.
+        """
+        logging.info(f"Queueing metadata generation for {job['filename']}")
+        if cls.metadata_jobs is not None:
+            cls.metadata_jobs.put(job)
+        else:
+            with MetadataService(images_metadata=job['options']['images_metadata']) as service:
+                service.submit(job)
+
+    @staticmethod
+    def record_timeout(file_path, output_folder, info):
+        """
+        Adds a timeout entry to a file's statistics. Called by the supervising
+        process after it killed the worker that was processing the file.
+        """
+        name_without_extension = os.path.splitext(os.path.basename(file_path))[0]
+        subfolder = os.path.join(output_folder, name_without_extension)
+        if not os.path.exists(subfolder):
+            os.makedirs(subfolder)
+        stats_path = os.path.join(subfolder, f"{name_without_extension}_statistics.json")
+        statistics = {}
+        if os.path.exists(stats_path):
+            try:
+                with open(stats_path) as f:
+                    statistics = json.load(f)
+            except ValueError:
+                pass
+        statistics['timeout'] = info
+        write_json_atomic(stats_path, statistics)
+
+    def _image_groups(self):
+        """
+        Returns for every part the index of the part whose image it shares.
+        With 'prototype' dedupe, instances of one prototype share an image;
+        'geometry' also merges prototypes with the same shape fingerprint.
+        """
+        if self.image_dedupe == 'none' or len(self.part_prototypes) != len(self.parts):
+            return list(range(len(self.parts)))
+        keys = list(self.part_prototypes)
+        if self.image_dedupe == 'geometry':
+            fingerprints = {}
+            for i, key in enumerate(keys):
+                if key not in fingerprints:
+                    fingerprints[key] = ShapeUtils.get_shape_fingerprint(self.parts[i][1])
+            keys = [fingerprints[key] for key in keys]
+        first_part = {}
+        return [first_part.setdefault(key, i) for i, key in enumerate(keys)]
+
+    def _image_jobs(self, shape, output_folder):
+        """
+        Returns the (shape, image path) of the full assembly and of every
+        solid or compound part that needs its own image, with unique file
+        names, and the instance to image map entries of the parts.
+        """
+        jobs = [(shape, os.path.join(output_folder, f"{self.name_without_extension}_full_assembly.png"))]
+        instances = []
+        node_ids = unique_node_ids([name for name, _ in self.parts])
+        groups = self._image_groups()
+        image_of = {}
+        taken = set()
+        for i, (part_name, part_shape) in enumerate(self.parts):
+            if part_shape.ShapeType() in [TopAbs_SOLID, TopAbs_COMPOUND]:
+                if groups[i] not in image_of:
                     safe_part_name = re.sub(r'[^\w\-_\. ]', '_', part_name) if part_name else f"unnamed_part_{i+1}"
                     image_path = os.path.join(output_folder, f"{safe_part_name}.png")
-                    
+
                     counter = 1
-                    while os.path.exists(image_path):
+                    while image_path in taken or os.path.exists(image_path):
                         image_path = os.path.join(output_folder, f"{safe_part_name}_{counter}.png")
                         counter += 1
-                    
-                    display.View.Dump(image_path)
-                    logging.info(f"Saved part image: {image_path}")
-                    display.Context.Remove(ais_part, True)
-                    del ais_part
+                    taken.add(image_path)
+                    jobs.append((part_shape, image_path))
+                    image_of[groups[i]] = os.path.splitext(os.path.basename(image_path))[0]
+                instances.append({'part': node_ids[i], 'name': part_name or '', 'image': image_of[groups[i]]})
+        return jobs, instances
+
+    def extract_images(self, jobs):
+        """
+        Renders the (shape, image path) jobs from _image_jobs() with the
+        offscreen renderer of this worker. Returns the (image path, thumbnail)
+        of every image and the render statistics.
+        """
+        rendered = []
+        render_times = []
+        logging.info(f"Extracting images started for {self.filename}")
+        renderer = get_renderer(self.image_size, self.headless)
+        first_use = not renderer.started
+
+        try:
+            for image_shape, image_path in jobs:
+                seconds, thumbnail = renderer.render_image(image_shape, image_path, self._thumbnail(),
+                                                           self.full_images)
+                render_times.append(seconds)
+                rendered.append((image_path, thumbnail))
+                logging.info(f"Rendered image: {image_path}")
 
         except Exception as e:
             logging.error(f"Error during image extraction for {self.filename}: {str(e)}")
             raise
-        
-        finally:
-            try:
 
-                if display_manager:
-                    display_manager.stop()
-                    del display_manager
-                
-                
-            except Exception as e:
-                logging.error(f"Error during display cleanup: {str(e)}")
-            
-            logging.info(f"Finished extracting images for {self.filename}")
\ No newline at end of file
+        logging.info(f"Finished extracting images for {self.filename}")
+        stats = {
+            'images': len(rendered),
+            'image_size': list(self.image_size),
+            'render': render_stats(render_times, renderer.startup_seconds if first_use else 0.0)
+        }
+        return rendered, stats
@@ -0,0 +1,129 @@
+import io
+import os
+import glob
+import json
+import base64
+from PIL import Image
+
+from utils.file_utils import write_json_atomic
+
+THUMBNAIL_FORMATS = {'jpeg': ('JPEG', '.jpg'), 'webp': ('WEBP', '.webp')}
+DEFAULT_THUMBNAIL_SIZE = 300
+# Largest atlas page side in pixels; WebP images cannot exceed 16383
+MAX_ATLAS_SIDE = 8192
+THUMBNAIL_QUALITY = 85
+
+
+def encode_thumbnail(image_path, size, image_format='jpeg'):
+    """
+    Shrinks a rendered image to fit in size x size and returns it encoded in
+    image_format.
+    """
+    with Image.open(image_path) as img:
+        img = img.convert('RGB')
+        img.thumbnail((size, size))
+        buffer = io.BytesIO()
+        img.save(buffer, format=THUMBNAIL_FORMATS[image_format][0], quality=THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def atlas_index_path(images_folder, name):
+    return os.path.join(images_folder, f"{name}_atlas.json")
+
+
+class AtlasWriter:
+    """
+    Packs the thumbnails of one file into sprite atlas pages, written next to
+    a JSON index with the page and pixel box of every image.
+    """
+    def __init__(self, size, image_format='jpeg'):
+        self.size = size
+        self.image_format = image_format
+        self.thumbnails = []
+
+    def add(self, name, thumbnail, image_file=None):
+        """
+        Adds an encoded thumbnail. image_file is the full-resolution image
+        written next to the atlas, if any.
+        """
+        self.thumbnails.append((name, thumbnail, image_file))
+
+    def save(self, images_folder, name):
+        """
+        Writes the pages and the index. Returns the paths written.
+        """
+        pil_format, extension = THUMBNAIL_FORMATS[self.image_format]
+        per_row = max(1, MAX_ATLAS_SIDE // self.size)
+        per_page = per_row * per_row
+        entries = []
+        paths = []
+        for start in range(0, len(self.thumbnails), per_page):
+            page_thumbnails = self.thumbnails[start:start + per_page]
+            columns = min(per_row, len(page_thumbnails))
+            rows = -(-len(page_thumbnails) // columns)
+            page = Image.new('RGB', (columns * self.size, rows * self.size), 'white')
+            page_file = f"{name}_atlas_{len(paths)}{extension}"
+            for k, (image_name, thumbnail, image_file) in enumerate(page_thumbnails):
+                with Image.open(io.BytesIO(thumbnail)) as tile:
+                    x, y = (k % columns) * self.size, (k // columns) * self.size
+                    page.paste(tile, (x, y))
+                    entries.append({'name': image_name, 'page': len(paths), 'x': x, 'y': y,
+                                    'width': tile.width, 'height': tile.height, 'file': image_file})
+            page_path = os.path.join(images_folder, page_file)
+            page.save(page_path, format=pil_format, quality=THUMBNAIL_QUALITY)
+            paths.append(page_path)
+
+        index = {
+            'format': self.image_format,
+            'thumbnail_size': self.size,
+            'pages': [os.path.basename(path) for path in paths],
+            'images': entries
+        }
+        index_path = atlas_index_path(images_folder, name)
+        write_json_atomic(index_path, index)
+        return paths + [index_path]
+
+
+class ImageAtlas:
+    """
+    Reads the thumbnails of one file back from its atlas pages.
+    """
+    def __init__(self, index_path):
+        self.folder = os.path.dirname(index_path)
+        with open(index_path) as f:
+            self.index = json.load(f)
+        self.entries = {entry['name']: entry for entry in self.index['images']}
+        self._pages = {}
+
+    @classmethod
+    def find(cls, images_folder):
+        """
+        Returns the atlas in images_folder, or None if it has none.
+        """
+        if not images_folder:
+            return None
+        index_paths = glob.glob(os.path.join(glob.escape(images_folder), '*_atlas.json'))
+        return cls(index_paths[0]) if index_paths else None
+
+    def names(self):
+        return list(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def thumbnail(self, name):
+        entry = self.entries[name]
+        if entry['page'] not in self._pages:
+            page_path = os.path.join(self.folder, self.index['pages'][entry['page']])
+            with Image.open(page_path) as page:
+                page.load()
+                self._pages[entry['page']] = page
+        x, y = entry['x'], entry['y']
+        return self._pages[entry['page']].crop((x, y, x + entry['width'], y + entry['height']))
+
+    def data_uri(self, name):
+        buffer = io.BytesIO()
+        pil_format, _ = THUMBNAIL_FORMATS[self.index['format']]
+        self.thumbnail(name).save(buffer, format=pil_format, quality=THUMBNAIL_QUALITY)
+        mime = 'image/jpeg' if pil_format == 'JPEG' else 'image/webp'
+        return f"data:{mime};base64,{base64.b64encode(buffer.getvalue()).decode('utf-8')}"
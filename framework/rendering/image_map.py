@@ -0,0 +1,35 @@
+import os
+import glob
+import json
+
+from utils.file_utils import write_json_atomic
+
+
+def image_map_path(images_folder, name):
+    return os.path.join(images_folder, f"{name}_image_map.json")
+
+
+def write_image_map(images_folder, name, instances):
+    """
+    Writes which image shows each part instance. instances holds one
+    {'part', 'name', 'image'} dict per rendered part, where part is the
+    assembly graph node id and image the image name (without extension), a
+    PNG in images_folder or an entry of its atlas.
+    """
+    path = image_map_path(images_folder, name)
+    write_json_atomic(path, {'instances': instances})
+    return path
+
+
+def load_image_map(images_folder):
+    """
+    Returns {part node id: image name} from the image map in images_folder,
+    or None if it has none.
+    """
+    if not images_folder:
+        return None
+    paths = glob.glob(os.path.join(glob.escape(images_folder), '*_image_map.json'))
+    if not paths:
+        return None
+    with open(paths[0]) as f:
+        return {instance['part']: instance['image'] for instance in json.load(f)['instances']}
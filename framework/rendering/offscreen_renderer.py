@@ -0,0 +1,144 @@
+import os
+import time
+import logging
+import tempfile
+from multiprocessing.util import Finalize
+from OCC.Core.AIS import AIS_Shape
+from OCC.Display.OCCViewer import OffscreenRenderer as OCCOffscreenRenderer
+from rendering.atlas import encode_thumbnail
+try:
+    from pyvirtualdisplay import Display
+except ImportError:
+    Display = None
+
+DEFAULT_IMAGE_SIZE = (800, 600)
+
+# Renderer of the current process, reused by every file it processes
+_renderer = None
+
+
+class OffscreenRenderer:
+    """
+    Renders shapes to image files with an OCC offscreen view that is created
+    once and kept for the life of the process.
+
+    The view has no window and needs no GUI backend. Where the OpenGL driver
+    still needs an X server (GLX builds on Linux without DISPLAY), a virtual
+    display is started on first use when running headless, and also kept.
+    """
+    def __init__(self, size=DEFAULT_IMAGE_SIZE, headless=False):
+        self.size = tuple(size)
+        self.headless = headless
+        self.startup_seconds = 0.0
+        self._viewer = None
+        self._display_manager = None
+
+    def _start(self):
+        start_time = time.perf_counter()
+        try:
+            self._viewer = OCCOffscreenRenderer(screen_size=self.size)
+        except Exception as e:
+            if not self.headless or os.getenv('DISPLAY'):
+                raise
+            logging.info(f"Offscreen view needs an X server ({e}), starting a virtual display")
+            self._start_virtual_display()
+            self._viewer = OCCOffscreenRenderer(screen_size=self.size)
+        self.startup_seconds = time.perf_counter() - start_time
+        logging.info(f"Initialized offscreen renderer ({self.size[0]}x{self.size[1]}) "
+                     f"in {self.startup_seconds:.2f}s")
+
+    def _start_virtual_display(self):
+        if Display is None:
+            logging.error("pyvirtualdisplay is not installed. Unable to run in headless mode.")
+            raise ImportError("pyvirtualdisplay is required for headless mode.")
+        self._display_manager = Display(visible=0, size=self.size)
+        self._display_manager.start()
+
+    @property
+    def started(self):
+        return self._viewer is not None
+
+    def render(self, shape, image_path):
+        """
+        Renders one shape, fitted to the view, to image_path. Returns the
+        seconds it took, not counting the one-time startup.
+        """
+        if not self.started:
+            self._start()
+        start_time = time.perf_counter()
+        context = self._viewer.Context
+        context.RemoveAll(False)
+        ais_shape = AIS_Shape(shape)
+        context.Display(ais_shape, False)
+        self._viewer.FitAll()
+        self._viewer.View.Dump(image_path)
+        context.Remove(ais_shape, False)
+        return time.perf_counter() - start_time
+
+    def render_image(self, shape, image_path, thumbnail=None, keep_image=True):
+        """
+        Renders one shape to image_path and, if thumbnail is a (size, format)
+        pair, also encodes a thumbnail of it. With keep_image=False the
+        full-resolution image only lives in a local temporary file. Returns
+        (seconds, thumbnail bytes or None).
+        """
+        if thumbnail is None:
+            return self.render(shape, image_path), None
+        if not self.started:
+            self._start()
+        if not keep_image:
+            fd, image_path = tempfile.mkstemp(suffix='.png', prefix='render-')
+            os.close(fd)
+        try:
+            start_time = time.perf_counter()
+            self.render(shape, image_path)
+            encoded = encode_thumbnail(image_path, *thumbnail)
+            return time.perf_counter() - start_time, encoded
+        finally:
+            if not keep_image:
+                os.remove(image_path)
+
+    def close(self):
+        if self._viewer is not None:
+            try:
+                self._viewer.Context.RemoveAll(False)
+            except Exception as e:
+                logging.error(f"Error closing offscreen renderer: {str(e)}")
+            self._viewer = None
+        if self._display_manager is not None:
+            try:
+                self._display_manager.stop()
+            except Exception as e:
+                logging.error(f"Error during display cleanup: {str(e)}")
+            self._display_manager = None
+
+
+def get_renderer(size=DEFAULT_IMAGE_SIZE, headless=False):
+    """
+    Returns the renderer of the current process, creating it on first use.
+    It is closed when the process exits, worker processes included.
+    """
+    global _renderer
+    if _renderer is not None and _renderer.size != tuple(size):
+        _renderer.close()
+        _renderer = None
+    if _renderer is None:
+        _renderer = OffscreenRenderer(size, headless)
+        Finalize(_renderer, _renderer.close, exitpriority=10)
+    return _renderer
+
+
+def render_stats(render_times, startup_seconds=0.0):
+    """
+    Summarizes per-image render times for the statistics file.
+    """
+    stats = {'count': len(render_times), 'startup_seconds': round(startup_seconds, 3)}
+    if render_times:
+        ordered = sorted(render_times)
+        stats.update({
+            'total_seconds': round(sum(ordered), 3),
+            'mean_seconds': round(sum(ordered) / len(ordered), 4),
+            'median_seconds': round(ordered[len(ordered) // 2], 4),
+            'max_seconds': round(ordered[-1], 4)
+        })
+    return stats
@@ -0,0 +1,421 @@
+import os
+import time
+import uuid
+import shutil
+import queue
+import logging
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing.connection import wait
+
+from rendering.offscreen_renderer import get_renderer, render_stats
+from utils.shape_utils import ShapeUtils
+
+# Part files a render worker keeps loaded; jobs of a few files are interleaved
+LOADED_FILES = 4
+# Once its first job has started, a batch gives up when no render result
+# arrived for this many seconds
+IDLE_TIMEOUT = 600
+# Seconds close() waits for idle render processes to exit before stopping them
+CLOSE_GRACE = 10
+
+
+def _render_loop(jobs, results, status, image_size, headless, parent_pid):
+    renderer = get_renderer(image_size, headless)
+    loaded = OrderedDict()
+    while True:
+        try:
+            job = jobs.get(timeout=1.0)
+        except queue.Empty:
+            # A render worker must not outlive the run that started it
+            if os.getppid() != parent_pid:
+                break
+            continue
+        if job is None:
+            break
+        batch_id, brep_path, index, image_path, thumbnail, keep_image = job
+        # Sent without a feeder thread, so it arrives even if rendering crashes the process
+        status.send(job)
+        first_use = not renderer.started
+        seconds = None
+        encoded = None
+        error = None
+        try:
+            # The service removes the parts file of a cancelled batch, so its
+            # jobs still in the queue are dropped here
+            if not os.path.exists(brep_path):
+                loaded.pop(brep_path, None)
+                raise FileNotFoundError("batch was cancelled")
+            if brep_path not in loaded:
+                loaded[brep_path] = ShapeUtils.read_parts(brep_path)
+                if len(loaded) > LOADED_FILES:
+                    loaded.popitem(last=False)
+            loaded.move_to_end(brep_path)
+            seconds, encoded = renderer.render_image(loaded[brep_path][index], image_path, thumbnail, keep_image)
+        except Exception as e:
+            error = str(e)
+        startup = renderer.startup_seconds if first_use and renderer.started else 0.0
+        results.put((batch_id, index, image_path, seconds, startup, error, encoded))
+        status.send(None)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class RenderService:
+    """
+    A pool of render processes, each with its own offscreen renderer, that
+    takes (file, part) render jobs from one queue.
+
+    File workers hand their geometry over through a RenderClient and carry
+    on: once a worker is done with a file it passes the batch a description
+    of what to do with the images, and moves on to its next file. The
+    service keeps track of every batch: it queues the jobs, gathers their
+    results and removes the batch's parts file once all its jobs are done.
+    When a batch has every result and its description, on_batch_done(spec,
+    rendered, stats) is called in this process to save and record the
+    images. A render process that dies is replaced, and the job it was
+    rendering is reported as failed. A batch with no result for
+    IDLE_TIMEOUT seconds after its first job started is given up.
+    cancel_slot() drops the batches of a file worker that was killed before
+    it handed them over.
+    """
+    def __init__(self, num_workers, image_size, headless, on_batch_done):
+        self.num_workers = num_workers
+        self.image_size = tuple(image_size)
+        self.headless = headless
+        self.on_batch_done = on_batch_done
+        # Render processes are spawned, as they are started next to the
+        # service's own threads. File workers are spawned as well, and take
+        # the requests queue from the same context.
+        self._context = multiprocessing.get_context('spawn')
+        self.requests = self._context.Queue()
+        self.jobs = self._context.Queue()
+        self.rendered = self._context.Queue()
+        # Parts files of all batches, removed with the folder at close
+        self.temp_dir = tempfile.mkdtemp(prefix='render-')
+        self.workers = [None] * num_workers
+        self.status = [None] * num_workers
+        self.current = [None] * num_workers
+        # batch_id -> {'slot', 'brep_path', 'image_paths', 'pending': indices of the jobs
+        # without a result, 'results', 'started', 'last_result', 'spec'}
+        self.batches = {}
+        self.restarted = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._threads = []
+        self._dispatcher = None
+
+    def start(self):
+        for worker in range(self.num_workers):
+            self._start_worker(worker)
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._threads = [threading.Thread(target=self._watch, daemon=True), self._dispatcher,
+                         threading.Thread(target=self._collect, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def channels(self):
+        """
+        What a file worker process needs to build its RenderClient.
+        """
+        return self.requests, self.temp_dir
+
+    def client(self, slot):
+        return RenderClient(self.requests, slot, self.temp_dir)
+
+    def _start_worker(self, worker):
+        status_reader, status_writer = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_render_loop,
+            args=(self.jobs, self.rendered, status_writer, self.image_size, self.headless, os.getpid()),
+            daemon=True)
+        process.start()
+        status_writer.close()
+        self.workers[worker] = process
+        self.status[worker] = status_reader
+        self.current[worker] = None
+
+    def _dispatch(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                break
+            if request[0] == 'cancel':
+                with self._lock:
+                    self._cancel(request[1])
+                continue
+            if request[0] == 'finish':
+                _, batch_id, spec = request
+                with self._lock:
+                    batch = self.batches.get(batch_id)
+                    if batch is None:
+                        continue
+                    # Handed over, so losing the worker no longer cancels it
+                    batch['slot'] = None
+                    batch['spec'] = spec
+                    done = self._pop_if_done(batch_id)
+                self._complete(done)
+                continue
+            _, slot, batch_id, brep_path, image_jobs, thumbnail, keep_images = request
+            with self._lock:
+                self.batches[batch_id] = {'slot': slot, 'brep_path': brep_path,
+                                          'image_paths': [path for _, path in image_jobs],
+                                          'pending': {index for index, _ in image_jobs}, 'results': {},
+                                          'started': False, 'last_result': None, 'spec': None}
+            for index, image_path in image_jobs:
+                self.jobs.put((batch_id, brep_path, index, image_path, thumbnail, keep_images))
+
+    def _collect(self):
+        while True:
+            result = self.rendered.get()
+            if result is None:
+                break
+            with self._lock:
+                done = self._finish(result)
+            self._complete(done)
+
+    def _finish(self, result):
+        """
+        Stores a job result. Returns the batch once it is done, see
+        _pop_if_done(). Called with the lock held.
+        """
+        batch_id, index = result[:2]
+        batch = self.batches.get(batch_id)
+        # Cancelled, or already reported failed by the monitor
+        if batch is None or index not in batch['pending']:
+            return None
+        batch['pending'].discard(index)
+        batch['results'][index] = result
+        batch['last_result'] = time.monotonic()
+        if not batch['pending']:
+            _remove(batch['brep_path'])
+        return self._pop_if_done(batch_id)
+
+    def _pop_if_done(self, batch_id):
+        """
+        Removes and returns the batch if it has every result and the spec of
+        its file, otherwise returns None. Called with the lock held.
+        """
+        batch = self.batches[batch_id]
+        if batch['pending'] or batch['spec'] is None:
+            return None
+        return self.batches.pop(batch_id)
+
+    def _complete(self, batch):
+        """
+        Passes a done batch on to on_batch_done, outside the lock as saving
+        the images takes a while.
+        """
+        if batch is None:
+            return
+        render_times = []
+        startup_seconds = 0.0
+        errors = []
+        rendered = []
+        for index, image_path in enumerate(batch['image_paths']):
+            _, _, _, seconds, startup, error, encoded = batch['results'][index]
+            startup_seconds += startup
+            if error is None:
+                render_times.append(seconds)
+                rendered.append((image_path, encoded))
+            else:
+                logging.error(f"Failed to render {image_path}: {error}")
+                errors.append(error)
+        stats = {
+            'images': len(rendered),
+            'failed': len(batch['image_paths']) - len(rendered),
+            'render': render_stats(render_times, startup_seconds)
+        }
+        if errors:
+            stats['errors'] = errors[:10]
+        try:
+            self.on_batch_done(batch['spec'], rendered, stats)
+        except Exception as e:
+            logging.error(f"Error saving the images of {batch['spec'].get('filename')}: {str(e)}")
+
+    def _cancel(self, batch_id):
+        batch = self.batches.pop(batch_id, None)
+        if batch is not None:
+            _remove(batch['brep_path'])
+            self.cancelled += 1
+
+    def cancel_slot(self, slot):
+        """
+        Drops the batches of a file worker slot whose worker was killed. Their
+        queued jobs are skipped by the render processes.
+        """
+        with self._lock:
+            for batch_id, batch in list(self.batches.items()):
+                if batch['slot'] == slot:
+                    self._cancel(batch_id)
+
+    def _started(self, job):
+        """
+        Notes when the first job of a batch is taken off the queue, which
+        starts the batch's idle timeout.
+        """
+        with self._lock:
+            batch = self.batches.get(job[0])
+            if batch is None or batch['started']:
+                return
+            batch['started'] = True
+            batch['last_result'] = time.monotonic()
+
+    def _expire_idle(self):
+        """
+        Reports the remaining jobs of batches that had no result for
+        IDLE_TIMEOUT seconds as failed. Removing the parts file makes the
+        render processes skip those still queued.
+        """
+        now = time.monotonic()
+        done = []
+        with self._lock:
+            for batch_id, batch in list(self.batches.items()):
+                if not batch['started'] or not batch['pending'] or now - batch['last_result'] < IDLE_TIMEOUT:
+                    continue
+                logging.error(f"No render result for {IDLE_TIMEOUT}s; giving up {len(batch['pending'])} renders")
+                self.timed_out += 1
+                for index in sorted(batch['pending']):
+                    result = (batch_id, index, batch['image_paths'][index], None, 0.0,
+                              f"no render result for {IDLE_TIMEOUT}s", None)
+                    done.append(self._finish(result))
+        for batch in done:
+            self._complete(batch)
+
+    def _read_status(self, worker):
+        reader = self.status[worker]
+        try:
+            while reader.poll():
+                self.current[worker] = reader.recv()
+                if self.current[worker] is not None:
+                    self._started(self.current[worker])
+        except (EOFError, OSError):
+            pass
+
+    def _watch(self):
+        while not self._closing.is_set():
+            readers = [reader for reader in self.status if reader is not None]
+            if readers:
+                for reader in wait(readers, timeout=0.5):
+                    self._read_status(self.status.index(reader))
+            else:
+                time.sleep(0.5)
+            for worker, process in enumerate(self.workers):
+                if self.status[worker] is None or process.is_alive() or self._closing.is_set():
+                    continue
+                # The process is gone, so everything it sent is in the pipe:
+                # read it all before deciding which job it died on
+                self._read_status(worker)
+                self.status[worker].close()
+                if process.exitcode == 0:
+                    # Left after its stop marker, as close() asked
+                    self.status[worker] = None
+                    continue
+                job = self.current[worker]
+                logging.error(f"Render worker {worker} exited with code {process.exitcode}; restarting it")
+                if job is not None:
+                    batch_id, _, index, image_path = job[:4]
+                    with self._lock:
+                        done = self._finish((batch_id, index, image_path, None, 0.0,
+                                             f"render worker exited with code {process.exitcode}", None))
+                    self._complete(done)
+                self.restarted += 1
+                self._start_worker(worker)
+            self._expire_idle()
+
+    def close(self):
+        """
+        Renders every queued job and saves the images of every handed over
+        batch, then stops the render processes. Call it once the file
+        workers are done.
+        """
+        self.requests.put(None)
+        self._dispatcher.join()
+        for _ in self.workers:
+            self.jobs.put(None)
+        # Render processes leave once the queue is empty; a hung one is
+        # stopped once no batch waits for results any more
+        idle_since = None
+        while not all(process.exitcode == 0 for process in self.workers):
+            with self._lock:
+                busy = any(batch['pending'] for batch in self.batches.values())
+            if busy:
+                idle_since = None
+            elif idle_since is None:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > CLOSE_GRACE:
+                break
+            time.sleep(0.2)
+        self._closing.set()
+        for process in self.workers:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        self.rendered.put(None)
+        for thread in self._threads:
+            thread.join()
+        # Batches whose file worker failed before handing them over
+        self.cancelled += len(self.batches)
+        self.batches.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class RenderClient:
+    """
+    The file worker's side of a RenderService.
+    """
+    def __init__(self, requests, slot, temp_dir):
+        self.requests = requests
+        self.slot = slot
+        self.temp_dir = temp_dir
+
+    def submit(self, jobs, thumbnail=None, keep_images=True):
+        """
+        Takes (shape, image_path) pairs, writes the shapes to a parts file in
+        the service's temporary folder and sends the batch of render jobs to
+        the service. thumbnail and keep_images are passed on to
+        OffscreenRenderer.render_image(). Returns the RenderBatch to finish
+        or cancel later.
+        """
+        fd, brep_path = tempfile.mkstemp(suffix='.brep', dir=self.temp_dir)
+        os.close(fd)
+        ShapeUtils.write_parts([shape for shape, _ in jobs], brep_path)
+        batch = RenderBatch(self.requests, uuid.uuid4().hex)
+        self.requests.put(('batch', self.slot, batch.batch_id, brep_path,
+                           list(enumerate(path for _, path in jobs)), thumbnail, keep_images))
+        return batch
+
+
+class RenderBatch:
+    """
+    The render jobs of one file, queued by RenderClient.submit().
+    """
+    def __init__(self, requests, batch_id):
+        self.requests = requests
+        self.batch_id = batch_id
+
+    def finish(self, spec):
+        """
+        Hands the batch over to the service: once every job has a result,
+        its on_batch_done is called with spec. spec must be picklable.
+        """
+        self.requests.put(('finish', self.batch_id, spec))
+
+    def cancel(self):
+        self.requests.put(('cancel', self.batch_id))
@@ -0,0 +1,265 @@
+import logging
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+from utils.memory_utils import current_rss
+
+# Connection to the supervisor, set in supervised worker processes only
+_worker_conn = None
+# Workers are spawned rather than forked: replacements are started while the
+# run's service threads are running, and a fork would copy their locks in
+# whatever state they are in. Queues handed to the workers must come from
+# the same context.
+_context = multiprocessing.get_context('spawn')
+
+
+def report_stage(stage):
+    """
+    Tells the supervisor which stage the current task has entered, or None
+    when it left it. Does nothing outside a supervised worker.
+    """
+    if _worker_conn is not None:
+        _worker_conn.send(('stage', stage))
+
+
+def _worker_loop(slot, conn, func, initializer, initargs, max_tasks, max_rss):
+    global _worker_conn
+    _worker_conn = conn
+    if initializer is not None:
+        initializer(slot, *initargs)
+    completed = 0
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        try:
+            result = func(task)
+        except Exception as e:
+            result = e
+        completed += 1
+        rss = current_rss()
+        recycle = bool((max_tasks and completed >= max_tasks) or
+                       (max_rss and rss is not None and rss > max_rss))
+        conn.send(('done', (result, recycle, rss)))
+        if recycle:
+            break
+    conn.close()
+
+
+class WorkerSupervisor:
+    """
+    A process pool that knows which task every worker is running.
+
+    Each worker talks to the supervisor over its own pipe and receives one
+    task at a time. Unlike multiprocessing.Pool this makes it possible to
+    retire a single worker, after a number of tasks or when its resident
+    memory crosses a ceiling, and to start a replacement in the same slot.
+    A worker that dies mid-task is replaced and its task reported as failed.
+
+    Tasks can also be given wall-clock budgets, for the whole task and for
+    each stage reported through report_stage(). A worker that overruns one is
+    killed and replaced, so a single pathological file cannot stall the run.
+
+    on_worker_lost(slot) is called whenever a worker is killed or dies in
+    the middle of a task, so work it left elsewhere can be dropped.
+    on_timeout(args, info) is called as soon as a task was killed for
+    overrunning a budget, once its worker is gone.
+    """
+    def __init__(self, num_workers, initializer=None, initargs=(),
+                 max_tasks_per_child=None, max_rss_bytes=None,
+                 task_timeout=None, stage_timeouts=None, on_worker_lost=None,
+                 on_timeout=None):
+        self.num_workers = num_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.max_tasks_per_child = max_tasks_per_child
+        self.max_rss_bytes = max_rss_bytes
+        self.workers = [None] * num_workers
+        self.connections = [None] * num_workers
+        self.running = [None] * num_workers
+        self.task_timeout = task_timeout
+        self.stage_timeouts = stage_timeouts or {}
+        self.on_worker_lost = on_worker_lost
+        self.on_timeout = on_timeout
+        self.started_at = [None] * num_workers
+        self.stages = [None] * num_workers
+        self.recycled = 0
+        self.worker_failures = 0
+        self.timeouts = []
+
+    def _start_worker(self, slot):
+        parent_conn, child_conn = _context.Pipe()
+        # Not daemonic, so a worker may start its own process pool
+        process = _context.Process(
+            target=_worker_loop,
+            args=(slot, child_conn, self.func, self.initializer, self.initargs,
+                  self.max_tasks_per_child, self.max_rss_bytes),
+            daemon=False)
+        process.start()
+        child_conn.close()
+        self.workers[slot] = process
+        self.connections[slot] = parent_conn
+        self.running[slot] = None
+
+    def _stop_worker(self, slot, kill=False):
+        process = self.workers[slot]
+        if kill:
+            process.terminate()
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        self.connections[slot].close()
+        self.workers[slot] = None
+        self.connections[slot] = None
+        self.running[slot] = None
+
+    def _dispatch(self, slot):
+        if not self.pending:
+            return
+        task_id = self.pending.pop()
+        if self.workers[slot] is None:
+            self._start_worker(slot)
+        self.running[slot] = task_id
+        self.started_at[slot] = time.monotonic()
+        self.stages[slot] = None
+        self.connections[slot].send(self.tasks[task_id])
+
+    def imap_unordered(self, func, iterable, on_failure):
+        """
+        Runs func over iterable and yields results in completion order.
+        on_failure(args, reason) builds the result for a task whose worker died.
+        """
+        self.func = func
+        self.on_failure = on_failure
+        self.tasks = list(iterable)
+        self.pending = list(range(len(self.tasks) - 1, -1, -1))
+        remaining = len(self.tasks)
+
+        try:
+            for slot in range(self.num_workers):
+                self._dispatch(slot)
+
+            while remaining:
+                connections = [c for c in self.connections if c is not None]
+                for conn in wait(connections, timeout=0.5):
+                    slot = self.connections.index(conn)
+                    result = self._drain(slot)
+                    if result is None:
+                        continue
+                    remaining -= 1
+                    yield result
+                    self._dispatch(slot)
+
+                for slot in self._overdue_slots():
+                    # A result or stage report sent just before the budget
+                    # ran out still counts
+                    result = self._drain(slot)
+                    if result is None:
+                        if not self._is_overdue(slot, time.monotonic()):
+                            continue
+                        result = self._time_out(slot)
+                    remaining -= 1
+                    yield result
+                    self._dispatch(slot)
+        finally:
+            self.shutdown()
+
+    def _drain(self, slot):
+        """
+        Handles the messages waiting from a worker. Returns the task result
+        if one arrived, or None.
+        """
+        while self.running[slot] is not None and self.connections[slot].poll():
+            result = self._receive(slot)
+            if result is not None:
+                return result
+        return None
+
+    def _receive(self, slot):
+        """
+        Handles one message from a worker. Returns the task result once the
+        task is finished, or None for a progress report.
+        """
+        task_id = self.running[slot]
+        try:
+            kind, payload = self.connections[slot].recv()
+        except (EOFError, OSError):
+            self.workers[slot].join(timeout=5)
+            reason = f"worker exited with code {self.workers[slot].exitcode}"
+            logging.error(f"Worker {slot} died while processing {self.tasks[task_id]}: {reason}")
+            self.worker_failures += 1
+            self._stop_worker(slot, kill=True)
+            self._worker_lost(slot)
+            return self.on_failure(self.tasks[task_id], reason)
+
+        if kind == 'stage':
+            self.stages[slot] = (payload, time.monotonic()) if payload else None
+            return None
+
+        result, recycle, rss = payload
+        self.running[slot] = None
+        if isinstance(result, Exception):
+            result = self.on_failure(self.tasks[task_id], str(result))
+        if recycle:
+            self.recycled += 1
+            logging.info(f"Recycling worker {slot} (rss={rss})")
+            self._stop_worker(slot)
+        return result
+
+    def _overdue_slots(self):
+        now = time.monotonic()
+        return [slot for slot in range(self.num_workers) if self._is_overdue(slot, now)]
+
+    def _is_overdue(self, slot, now):
+        if self.running[slot] is None:
+            return False
+        if self.task_timeout and now - self.started_at[slot] > self.task_timeout:
+            return True
+        if self.stages[slot] is not None:
+            stage, stage_started_at = self.stages[slot]
+            budget = self.stage_timeouts.get(stage)
+            if budget and now - stage_started_at > budget:
+                return True
+        return False
+
+    def _time_out(self, slot):
+        task_id = self.running[slot]
+        now = time.monotonic()
+        stage, stage_started_at = self.stages[slot] or (None, None)
+        if self.task_timeout and now - self.started_at[slot] > self.task_timeout:
+            info = {'scope': 'task', 'stage': stage, 'budget_seconds': self.task_timeout}
+        else:
+            info = {'scope': 'stage', 'stage': stage, 'budget_seconds': self.stage_timeouts[stage]}
+        info['elapsed_seconds'] = round(now - self.started_at[slot], 1)
+
+        reason = f"timed out after {info['elapsed_seconds']}s" + (f" in stage '{stage}'" if stage else "")
+        logging.error(f"Worker {slot} {reason} while processing {self.tasks[task_id]}; killing it")
+        self.timeouts.append((self.tasks[task_id], info))
+        self._stop_worker(slot, kill=True)
+        self._worker_lost(slot)
+        if self.on_timeout is not None:
+            try:
+                self.on_timeout(self.tasks[task_id], info)
+            except Exception as e:
+                logging.error(f"Error recording the timeout of {self.tasks[task_id]}: {str(e)}")
+        return self.on_failure(self.tasks[task_id], reason)
+
+    def _worker_lost(self, slot):
+        if self.on_worker_lost is None:
+            return
+        try:
+            self.on_worker_lost(slot)
+        except Exception as e:
+            logging.error(f"Error cleaning up after worker {slot}: {str(e)}")
+
+    def shutdown(self):
+        for slot, conn in enumerate(self.connections):
+            if conn is None:
+                continue
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            self._stop_worker(slot, kill=self.running[slot] is not None)
@@ -0,0 +1,63 @@
+import os
+import threading
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def current_rss():
+    """
+    Returns the resident set size of the current process in bytes, or None if
+    it cannot be determined on this platform.
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def to_mb(num_bytes):
+    return round(num_bytes / (1024 * 1024), 1) if num_bytes is not None else None
+
+
+class PeakRSSMonitor:
+    """
+    Samples the RSS of the current process in a background thread while the
+    context is active and keeps the highest value seen.
+    """
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start_rss = None
+        self.end_rss = None
+        self.peak_rss = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        rss = current_rss()
+        if rss is not None and (self.peak_rss is None or rss > self.peak_rss):
+            self.peak_rss = rss
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self.start_rss = current_rss()
+        self.peak_rss = self.start_rss
+        if self.start_rss is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        self._sample()
+        self.end_rss = current_rss()
+        return False
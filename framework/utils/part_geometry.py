@@ -0,0 +1,151 @@
+import math
+import time
+import numpy as np
+
+from utils.shape_utils import ShapeUtils
+from utils.proximity import build_tree
+
+_UNSET = object()
+
+
+class GeometryCacheStats:
+    """
+    Counts how often per-part geometry was reused instead of recomputed, and
+    estimates the time saved from what each record cost to build.
+    """
+    def __init__(self):
+        self.records = 0
+        self.hits = 0
+        self.misses = 0
+        self.build_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def miss(self, seconds):
+        self.misses += 1
+        self.build_seconds += seconds
+
+    def hit(self, seconds):
+        self.hits += 1
+        self.saved_seconds += seconds
+
+    def take(self):
+        """
+        Returns the counts gathered so far and starts again from zero, so a
+        worker can report each chunk's counts to be merged.
+        """
+        counts = dict(self.__dict__)
+        self.__init__()
+        return counts
+
+    def merge(self, counts):
+        """
+        Adds counts from take(), e.g. from a worker.
+        """
+        for key, value in counts.items():
+            setattr(self, key, getattr(self, key) + value)
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            'records': self.records,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            'build_seconds': round(self.build_seconds, 3),
+            'estimated_seconds_saved': round(self.saved_seconds, 3)
+        }
+
+
+class PartGeometry:
+    """
+    Geometry of one part, computed once and shared by every contact check the
+    part takes part in: bounding box, diagonal, tolerance and, on first use,
+    its vertex coordinates as an (n, 3) array with a KD-tree over them.
+    """
+    def __init__(self, shape, stats=None):
+        self.shape = shape
+        self.stats = stats if stats is not None else GeometryCacheStats()
+        self.stats.records += 1
+
+        start = time.perf_counter()
+        self._bbox = ShapeUtils.get_bounding_box(shape).Get()
+        xmin, ymin, zmin, xmax, ymax, zmax = self._bbox
+        self._diagonal = math.sqrt((xmax - xmin) ** 2 + (ymax - ymin) ** 2 + (zmax - zmin) ** 2)
+        self._tolerance = min(self._diagonal * 0.0001, 0.1)
+        self._bbox_seconds = time.perf_counter() - start
+        self.stats.miss(self._bbox_seconds)
+
+        self._vertices = None
+        self._vertices_seconds = 0.0
+        self._vertex_tree = None
+        self._tree_seconds = 0.0
+        self._obb = None
+        self._mesh = _UNSET
+
+    def checked(self):
+        """
+        Counts one contact check of the part. Without the cache every check
+        would measure the part's bounding box again, so each counts as a hit.
+        """
+        self.stats.hit(self._bbox_seconds)
+
+    def bounding_box(self):
+        """
+        Returns (xmin, ymin, zmin, xmax, ymax, zmax).
+        """
+        return self._bbox
+
+    def size(self):
+        return self._diagonal
+
+    def tolerance(self):
+        return self._tolerance
+
+    def vertices(self):
+        """
+        Returns the vertex coordinates. Every call after the first counts as
+        a hit, so a contact check should fetch them once.
+        """
+        if self._vertices is None:
+            self._load_vertices()
+        else:
+            self.stats.hit(self._vertices_seconds)
+        return self._vertices
+
+    def _load_vertices(self):
+        start = time.perf_counter()
+        self._vertices = np.asarray(ShapeUtils.get_vertices(self.shape), dtype=np.float64).reshape(-1, 3)
+        self._vertices_seconds = time.perf_counter() - start
+        self.stats.miss(self._vertices_seconds)
+
+    def vertex_tree(self):
+        if self._vertex_tree is None:
+            if self._vertices is None:
+                self._load_vertices()
+            start = time.perf_counter()
+            self._vertex_tree = build_tree(self._vertices)
+            self._tree_seconds = time.perf_counter() - start
+            self.stats.miss(self._tree_seconds)
+        else:
+            self.stats.hit(self._tree_seconds)
+        return self._vertex_tree
+
+    def oriented_bounding_box(self):
+        if self._obb is None:
+            self._obb = ShapeUtils.get_oriented_bounding_box(self.shape)
+        return self._obb
+
+    def mesh(self):
+        """
+        Returns (nodes, tree) for the part's triangulation, or None if it has
+        none. See ShapeUtils.get_mesh_nodes.
+        """
+        if self._mesh is _UNSET:
+            deflection = max(self._diagonal * 0.01, 1e-6)
+            mesh = ShapeUtils.get_mesh_nodes(self.shape, deflection)
+            if mesh is None:
+                self._mesh = None
+            else:
+                nodes = np.asarray(mesh, dtype=np.float64)
+                self._mesh = (nodes, build_tree(nodes))
+        return self._mesh
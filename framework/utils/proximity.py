@@ -0,0 +1,29 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Query points in blocks so a hit early in a large vertex set returns early
+QUERY_CHUNK = 4096
+
+
+def build_tree(points):
+    return cKDTree(points)
+
+
+def any_pair_within(points1, points2, tolerance, tree2=None):
+    """
+    Returns True if any point of points1 lies within tolerance (inclusive) of
+    any point of points2. Both are (n, 3) arrays. tree2 is an optional
+    prebuilt KD-tree over points2.
+    """
+    if len(points1) == 0 or len(points2) == 0:
+        return False
+    if tree2 is None:
+        tree2 = cKDTree(points2)
+    # distance_upper_bound is exclusive; nudge it so that d == tolerance matches
+    bound = np.nextafter(tolerance, np.inf)
+    for start in range(0, len(points1), QUERY_CHUNK):
+        distances, _ = tree2.query(points1[start:start + QUERY_CHUNK], k=1,
+                                   distance_upper_bound=bound)
+        if np.isfinite(distances).any():
+            return True
+    return False
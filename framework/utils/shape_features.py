@@ -0,0 +1,54 @@
+from OCC.Core.TopoDS import topods
+from OCC.Core.BRepAdaptor import BRepAdaptor_Surface
+
+from utils.shape_utils import ShapeUtils
+
+
+class ShapeFeatures:
+    """
+    Face and edge features of one shape, by index in its indexed face and
+    edge maps (1-based). The hierarchical and face adjacency graphs both
+    take their features from here, so the two always agree.
+
+    The surface adaptor of a face is built once and shared by the face's
+    edges, and so is the map of the face's edge orientations.
+    """
+    def __init__(self, face_map, edge_map):
+        self.face_map = face_map
+        self.edge_map = edge_map
+        self._surfaces = {}
+        self._orientations = {}
+
+    def _surface(self, face_index):
+        if face_index not in self._surfaces:
+            face = topods.Face(self.face_map.FindKey(face_index))
+            self._surfaces[face_index] = BRepAdaptor_Surface(face, True)
+        return self._surfaces[face_index]
+
+    def face(self, face_index):
+        """
+        Returns (area, surface type code) of a face.
+        """
+        face = topods.Face(self.face_map.FindKey(face_index))
+        return ShapeUtils.get_face_properties(face, self._surface(face_index))
+
+    def edge(self, edge_index):
+        """
+        Returns (length, curve type code) of an edge.
+        """
+        return ShapeUtils.get_edge_properties(topods.Edge(self.edge_map.FindKey(edge_index)))
+
+    def convexity(self, edge, faces):
+        """
+        Returns the CONVEXITY code of an edge, given {face index: face} of the
+        faces it bounds, as found among its ancestors. Only an edge between
+        exactly two faces has one; any other gets 0.
+        """
+        if len(faces) != 2:
+            return 0
+        (index1, face1), (index2, face2) = faces.items()
+        if index1 not in self._orientations:
+            self._orientations[index1] = ShapeUtils.get_edge_orientations(face1, self.edge_map)
+        orientation = self._orientations[index1].get(self.edge_map.FindIndex(edge))
+        return ShapeUtils.get_edge_convexity(topods.Edge(edge), topods.Face(face1), topods.Face(face2),
+                                             self._surface(index1), self._surface(index2), orientation)
@@ -1,21 +1,101 @@
 import math
 from OCC.Core.BRepBndLib import brepbndlib
-from OCC.Core.Bnd import Bnd_Box
+from OCC.Core.Bnd import Bnd_Box, Bnd_OBB
+from OCC.Core.BRepMesh import BRepMesh_IncrementalMesh
+from OCC.Core.TopoDS import topods, TopoDS_Compound, TopoDS_Iterator, TopoDS_Shape
 from OCC.Core.BRepExtrema import BRepExtrema_DistShapeShape
-from OCC.Core.TopExp import TopExp_Explorer
+from OCC.Core.TopExp import TopExp_Explorer, topexp
+from OCC.Core.TopTools import TopTools_IndexedMapOfShape
 from OCC.Core.TopAbs import TopAbs_SHELL, TopAbs_FACE, TopAbs_EDGE, TopAbs_VERTEX
-from OCC.Core.BRep import BRep_Tool
+from OCC.Core.BRep import BRep_Tool, BRep_Builder
+from OCC.Core.BinTools import bintools
 from OCC.Core.TopLoc import TopLoc_Location
 from OCC.Core.BRepBuilderAPI import BRepBuilderAPI_Transform
+from OCC.Core.TopAbs import TopAbs_REVERSED
+from OCC.Core.GProp import GProp_GProps
+from OCC.Core.BRepGProp import brepgprop
+from OCC.Core.BRepAdaptor import BRepAdaptor_Surface, BRepAdaptor_Curve, BRepAdaptor_Curve2d
+from OCC.Core.BRepLProp import BRepLProp_SLProps
+from OCC.Core.gp import gp_Pnt, gp_Vec
 from OCC.Extend.TopologyUtils import TopologyExplorer
 
+from utils.proximity import any_pair_within
+
+# Category names, indexed by the GeomAbs_SurfaceType / GeomAbs_CurveType values
+SURFACE_TYPES = ['plane', 'cylinder', 'cone', 'sphere', 'torus', 'bezier_surface', 'bspline_surface',
+                 'surface_of_revolution', 'surface_of_extrusion', 'offset_surface', 'other_surface']
+CURVE_TYPES = ['line', 'circle', 'ellipse', 'hyperbola', 'parabola', 'bezier_curve', 'bspline_curve',
+               'offset_curve', 'other_curve']
+CONVEXITY = ['none', 'convex', 'concave', 'smooth']
+# Faces meeting at a smaller angle than this count as a smooth transition
+SMOOTH_ANGLE = math.radians(1.0)
+
 class ShapeUtils:
+    @staticmethod
+    def write_parts(shapes, path):
+        """
+        Writes the shapes as one compound in OCC's binary BRep format. Shared
+        geometry is stored once and every part keeps its location.
+        """
+        builder = BRep_Builder()
+        compound = TopoDS_Compound()
+        builder.MakeCompound(compound)
+        for shape in shapes:
+            builder.Add(compound, shape)
+        if not bintools.Write(compound, path):
+            raise RuntimeError(f"Could not write part geometry to {path}")
+
+    @staticmethod
+    def read_parts(path):
+        """
+        Reads back the list of shapes written by write_parts().
+        """
+        compound = TopoDS_Shape()
+        if not bintools.Read(compound, path):
+            raise RuntimeError(f"Could not read part geometry from {path}")
+        shapes = []
+        iterator = TopoDS_Iterator(compound)
+        while iterator.More():
+            shapes.append(iterator.Value())
+            iterator.Next()
+        return shapes
+
     @staticmethod
     def get_bounding_box(shape):
         bbox = Bnd_Box()
         brepbndlib.Add(shape, bbox)
         return bbox
 
+    @staticmethod
+    def get_oriented_bounding_box(shape):
+        obb = Bnd_OBB()
+        # Built from the exact geometry: a box around a shape's mesh nodes
+        # can miss curved faces that bulge past them, and whether a shared
+        # shape is meshed yet depends on which pair was tested first
+        brepbndlib.AddOBB(shape, obb, False, False, True)
+        return obb
+
+    @staticmethod
+    def get_mesh_nodes(shape, deflection):
+        """
+        Meshes the shape if needed and returns its triangulation nodes, which
+        lie on the shape's faces. Returns None when no face is triangulated.
+        """
+        BRepMesh_IncrementalMesh(shape, deflection, False, 0.5, False)
+
+        nodes = []
+        explorer = TopExp_Explorer(shape, TopAbs_FACE)
+        while explorer.More():
+            loc = TopLoc_Location()
+            triangulation = BRep_Tool.Triangulation(topods.Face(explorer.Current()), loc)
+            if triangulation is not None:
+                trsf = loc.Transformation()
+                nodes.extend(triangulation.Node(i).Transformed(trsf).Coord()
+                             for i in range(1, triangulation.NbNodes() + 1))
+            explorer.Next()
+
+        return nodes or None
+
     @staticmethod
     def get_tolerance(shape):
         # Example: Tolerance based on shape size
@@ -26,32 +106,35 @@ class ShapeUtils:
 
     @staticmethod
     def are_connected(shape1, shape2):
-        size1 = ShapeUtils.get_shape_size(shape1)
-        size2 = ShapeUtils.get_shape_size(shape2)
-        avg_size = (size1 + size2) / 2
+        from utils.part_geometry import PartGeometry
+        return ShapeUtils.are_parts_connected(PartGeometry(shape1), PartGeometry(shape2))
+
+    @staticmethod
+    def get_pair_tolerance(part1, part2):
+        avg_size = (part1.size() + part2.size()) / 2
         multiplier = 0.0001
-        tolerance = min(avg_size * multiplier, 0.1)
+        return min(avg_size * multiplier, 0.1)
+
+    @staticmethod
+    def are_parts_connected(part1, part2):
+        """
+        Contact test on two PartGeometry records, reusing their cached
+        sizes and vertices.
+        """
+        tolerance = ShapeUtils.get_pair_tolerance(part1, part2)
 
         # First attempt using distance tool
-        dist_tool = BRepExtrema_DistShapeShape(shape1, shape2)
+        dist_tool = BRepExtrema_DistShapeShape(part1.shape, part2.shape)
         if dist_tool.IsDone() and dist_tool.Value() <= tolerance:
             return True
 
-        # Fallback to vertex distance
-        vertices1 = ShapeUtils.get_vertices(shape1)
-        vertices2 = ShapeUtils.get_vertices(shape2)
-
-        for v1 in vertices1:
-            for v2 in vertices2:
-                dist = math.sqrt(
-                    (v1[0] - v2[0]) ** 2 +
-                    (v1[1] - v2[1]) ** 2 +
-                    (v1[2] - v2[2]) ** 2
-                )
-                if dist <= tolerance:
-                    return True
-
-        return False
+        # Fallback to vertex distance: query the smaller vertex set against
+        # the KD-tree of the larger one
+        vertices1, vertices2 = part1.vertices(), part2.vertices()
+        if len(vertices1) > len(vertices2):
+            part1, part2 = part2, part1
+            vertices1, vertices2 = vertices2, vertices1
+        return any_pair_within(vertices1, vertices2, tolerance, tree2=part2.vertex_tree())
 
     @staticmethod
     def get_shape_size(shape):
@@ -60,6 +143,24 @@ class ShapeUtils:
         diagonal = math.sqrt((xmax - xmin) ** 2 + (ymax - ymin) ** 2 + (zmax - zmin) ** 2)
         return diagonal
 
+    @staticmethod
+    def get_shape_fingerprint(shape, digits=6):
+        """
+        Placement-independent summary of a shape: its face, edge and vertex
+        counts with its volume and area to digits significant digits. Equal
+        parts share a fingerprint, and so do mirrored ones.
+        """
+        counts = []
+        for shape_type in (TopAbs_FACE, TopAbs_EDGE, TopAbs_VERTEX):
+            shape_map = TopTools_IndexedMapOfShape()
+            topexp.MapShapes(shape, shape_type, shape_map)
+            counts.append(shape_map.Size())
+        volume = GProp_GProps()
+        brepgprop.VolumeProperties(shape, volume)
+        area = GProp_GProps()
+        brepgprop.SurfaceProperties(shape, area)
+        return tuple(counts) + (f"{volume.Mass():.{digits}g}", f"{area.Mass():.{digits}g}")
+
     @staticmethod
     def get_vertices(shape):
         vertices = []
@@ -69,4 +170,93 @@ class ShapeUtils:
             point = BRep_Tool.Pnt(vertex)
             vertices.append((point.X(), point.Y(), point.Z()))
             explorer.Next()
-        return vertices
\ No newline at end of file
+        return vertices
+
+    @staticmethod
+    def get_face_properties(face, surface=None):
+        """
+        Returns (area, surface type code) of a face.
+        """
+        props = GProp_GProps()
+        brepgprop.SurfaceProperties(face, props)
+        if surface is None:
+            surface = BRepAdaptor_Surface(face, True)
+        return props.Mass(), int(surface.GetType())
+
+    @staticmethod
+    def get_edge_properties(edge):
+        """
+        Returns (length, curve type code) of an edge; the code is -1 for a
+        degenerated edge, which has no curve.
+        """
+        props = GProp_GProps()
+        brepgprop.LinearProperties(edge, props)
+        if BRep_Tool.Degenerated(edge):
+            return props.Mass(), -1
+        return props.Mass(), int(BRepAdaptor_Curve(edge).GetType())
+
+    @staticmethod
+    def get_edge_orientations(face, edge_map):
+        """
+        Returns {edge index in edge_map: orientation} for the edges of a face,
+        so the orientation of each edge is looked up instead of searched for.
+        """
+        orientations = {}
+        explorer = TopExp_Explorer(face, TopAbs_EDGE)
+        while explorer.More():
+            edge_index = edge_map.FindIndex(explorer.Current())
+            if edge_index and edge_index not in orientations:
+                orientations[edge_index] = explorer.Current().Orientation()
+            explorer.Next()
+        return orientations
+
+    @staticmethod
+    def get_edge_convexity(edge, face1, face2, surface1=None, surface2=None, orientation=None):
+        """
+        Returns the CONVEXITY code of the edge between two faces, from the
+        face normals at the middle of the edge. The faces are taken with the
+        orientation they have in their shell. orientation is that of the edge
+        in face1; it is searched for in face1 when not given. An edge without
+        a p-curve on one of the faces gets 0 ('none').
+        """
+        if BRep_Tool.Degenerated(edge):
+            return 0
+        curve = BRepAdaptor_Curve(edge)
+        t = (curve.FirstParameter() + curve.LastParameter()) / 2
+        point = gp_Pnt()
+        tangent = gp_Vec()
+        curve.D1(t, point, tangent)
+        if tangent.Magnitude() < 1e-12:
+            return 0
+
+        normals = []
+        for face, surface in ((face1, surface1), (face2, surface2)):
+            if surface is None:
+                surface = BRepAdaptor_Surface(face, True)
+            try:
+                uv = BRepAdaptor_Curve2d(edge, face).Value(t)
+            except Exception:
+                return 0
+            props = BRepLProp_SLProps(surface, uv.X(), uv.Y(), 1, 1e-6)
+            if not props.IsNormalDefined():
+                return 0
+            normal = gp_Vec(props.Normal())
+            if face.Orientation() == TopAbs_REVERSED:
+                normal.Reverse()
+            normals.append(normal)
+
+        # Walk the edge as the first face does, i.e. with that face on the left
+        if orientation is None:
+            explorer = TopExp_Explorer(face1, TopAbs_EDGE)
+            while explorer.More():
+                if explorer.Current().IsSame(edge):
+                    orientation = explorer.Current().Orientation()
+                    break
+                explorer.Next()
+        if orientation == TopAbs_REVERSED:
+            tangent.Reverse()
+
+        cross = normals[0].Crossed(normals[1])
+        if cross.Magnitude() < math.sin(SMOOTH_ANGLE) and normals[0].Dot(normals[1]) > 0:
+            return 3
+        return 1 if cross.Dot(tangent) > 0 else 2
@@ -1,55 +1,183 @@
 import os
+import time
 import logging
 from colorama import init, Fore, Style
 from tqdm import tqdm
 
 from processing.step_file_processor import StepFileProcessor
+from rendering.render_service import RenderService, RenderClient
+from metadata.metadata_service import MetadataService
+from supervisor import WorkerSupervisor
 from utils.logging_utils import setup_logging
+from utils.file_utils import write_json_atomic
+
+
+def worker_init(slot, output_folder, logging_enabled, render_channels=None, metadata_jobs=None):
+    StepFileProcessor.progress_position = slot
+    if render_channels is not None:
+        requests, temp_dir = render_channels
+        StepFileProcessor.render_client = RenderClient(requests, slot, temp_dir)
+    StepFileProcessor.metadata_jobs = metadata_jobs
+    if logging_enabled:
+        setup_logging(output_folder)
+    else:
+        logging.disable(logging.CRITICAL)
+
+
+def process_single_file(args):
+    file_path, processor_kwargs = args
+    try:
+        logging.info(f"Process {os.getpid()} started processing {file_path}")
+        processor = StepFileProcessor(file_path=file_path, **processor_kwargs)
+        result = processor.process()
+        logging.info(f"Processing complete for {file_path}")
+        return result
+    except Exception as e:
+        logging.error(f"Error processing {file_path}: {e}")
+        return failed_result(args, str(e))
+
+
+def failed_result(args, reason):
+    file_path, _ = args
+    return f"{Fore.RED} Error processing {os.path.basename(file_path)}: {reason}{Style.RESET_ALL}"
+
 
 def process_step_files(folder_path, output_folder, skip_existing,
                       generate_metadata_flag, generate_assembly, generate_hierarchical,
                       save_pdf, save_html, no_self_connections, generate_stats,
-                      images, images_metadata, headless):
+                      images, images_metadata, headless, num_workers=1,
+                      max_tasks_per_child=None, parse_cache_dir=None, parse_cache_size=None,
+                      share_geometry=False, low_memory=False, max_worker_memory=None,
+                      file_timeout=None, stage_timeouts=None, contact_workers=1,
+                      broad_phase='sweep', hierarchical_solids=False, hierarchical_vertices=False,
+                      hierarchical_max_depth=None, formats=None,
+                      graphml_gzip=False, hierarchical_features=False, face_adjacency=False,
+                      face_adjacency_features=False, image_size=None, render_workers=0, image_atlas=False,
+                      full_images=False, thumbnail_size=300, thumbnail_format='jpeg',
+                      image_dedupe='prototype', metadata_concurrency=8, metadata_retries=5,
+                      openai_base_url=None, metadata_cache_dir=None, metadata_cache_size=None,
+                      metadata_cache_ttl=None):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
     setup_logging(output_folder)
     logging.info(f"Starting to process files in {folder_path}")
 
-    step_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) 
+    step_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path)
                  if f.lower().endswith(('.step', '.stp'))]
 
-    print(f"{Fore.YELLOW}Processing {Fore.RED}{len(step_files)}{Style.RESET_ALL} files{Style.RESET_ALL}")
-
-    results = []
-    for file_path in tqdm(step_files, desc="Overall Progress"):
-        try:
-            logging.info(f"Started processing {file_path}")
-            
-            processor = StepFileProcessor(
-                file_path=file_path,
-                output_folder=output_folder,
-                skip_existing=skip_existing,
-                generate_metadata_flag=generate_metadata_flag,
-                generate_assembly=generate_assembly,
-                generate_hierarchical=generate_hierarchical,
-                save_pdf=save_pdf,
-                save_html=save_html,
-                no_self_connections=no_self_connections,
-                generate_stats=generate_stats,
-                images=images,
-                images_metadata=images_metadata,
-                headless=headless
-            )
-
-            result = processor.process()
-            results.append(result)
-            logging.info(f"Processing complete for {file_path}")
-            
-        except Exception as e:
-            logging.error(f"Error processing {file_path}: {e}")
+    processor_kwargs = dict(
+        output_folder=output_folder,
+        skip_existing=skip_existing,
+        generate_metadata_flag=generate_metadata_flag,
+        generate_assembly=generate_assembly,
+        generate_hierarchical=generate_hierarchical,
+        save_pdf=save_pdf,
+        save_html=save_html,
+        no_self_connections=no_self_connections,
+        generate_stats=generate_stats,
+        images=images,
+        images_metadata=images_metadata,
+        headless=headless,
+        parse_cache_dir=parse_cache_dir,
+        parse_cache_size=parse_cache_size,
+        share_geometry=share_geometry,
+        low_memory=low_memory,
+        contact_workers=contact_workers,
+        broad_phase=broad_phase,
+        hierarchical_solids=hierarchical_solids,
+        hierarchical_vertices=hierarchical_vertices,
+        hierarchical_max_depth=hierarchical_max_depth,
+        formats=formats,
+        graphml_gzip=graphml_gzip,
+        hierarchical_features=hierarchical_features,
+        face_adjacency=face_adjacency,
+        face_adjacency_features=face_adjacency_features,
+        image_size=image_size,
+        image_atlas=image_atlas,
+        full_images=full_images,
+        thumbnail_size=thumbnail_size,
+        thumbnail_format=thumbnail_format,
+        image_dedupe=image_dedupe
+    )
+    args_list = [(file_path, processor_kwargs) for file_path in step_files]
 
-    logging.info("Finished processing all files")
+    start_time = time.time()
+    summary = {'files': len(step_files), 'timeouts': [], 'worker_failures': 0, 'recycled_workers': 0}
 
-    for res in results:
-        print(res)
+    num_workers = max(1, min(num_workers, len(step_files) or 1))
+    print(f"{Fore.YELLOW}Processing {Fore.RED}{len(step_files)}{Style.RESET_ALL} files using "
+          f"{Fore.RED}{num_workers}{Style.RESET_ALL} processes{Style.RESET_ALL}")
+
+    supervised = (num_workers > 1 or max_worker_memory or max_tasks_per_child
+                  or file_timeout or stage_timeouts)
+    render_service = None
+    if images and render_workers > 0 and step_files:
+        # The file workers get its queues through their initializer. The
+        # images are saved here, once a file's batch is rendered.
+        render_service = RenderService(render_workers, image_size or (800, 600), headless,
+                                       on_batch_done=StepFileProcessor.finish_render).start()
+        print(f"{Fore.YELLOW}Rendering images with {Fore.RED}{render_workers}{Style.RESET_ALL} "
+              f"render processes{Style.RESET_ALL}")
+    metadata_service = None
+    if generate_metadata_flag and step_files:
+        metadata_service = MetadataService(images_metadata=images_metadata, base_url=openai_base_url,
+                                           concurrency=metadata_concurrency, max_retries=metadata_retries,
+                                           cache_dir=metadata_cache_dir, cache_size=metadata_cache_size,
+                                           cache_ttl=metadata_cache_ttl).start()
+
+    try:
+        metadata_jobs = metadata_service.jobs if metadata_service is not None else None
+        # The render service queues the metadata of the files whose images it saves
+        StepFileProcessor.metadata_jobs = metadata_jobs
+        if not supervised:
+            if render_service is not None:
+                StepFileProcessor.render_client = render_service.client(0)
+            for args in tqdm(args_list, desc="Overall Progress"):
+                tqdm.write(process_single_file(args))
+        else:
+            logging_enabled = not logging.root.manager.disable
+
+            def record_timeout(args, info):
+                # Recorded right away, so an interrupted run keeps its timeouts
+                file_path, _ = args
+                StepFileProcessor.record_timeout(file_path, output_folder, info)
+                summary['timeouts'].append(dict(info, file=file_path))
+
+            render_channels = render_service.channels() if render_service is not None else None
+            supervisor = WorkerSupervisor(num_workers, initializer=worker_init,
+                                          initargs=(output_folder, logging_enabled, render_channels,
+                                                    metadata_jobs),
+                                          max_tasks_per_child=max_tasks_per_child,
+                                          max_rss_bytes=max_worker_memory,
+                                          task_timeout=file_timeout,
+                                          stage_timeouts=stage_timeouts,
+                                          on_worker_lost=render_service.cancel_slot if render_service else None,
+                                          on_timeout=record_timeout)
+            # Results are streamed back in completion order, so a slow file
+            # does not hold back the report for the ones queued after it.
+            for result in tqdm(supervisor.imap_unordered(process_single_file, args_list, failed_result),
+                               total=len(args_list), desc="Overall Progress"):
+                tqdm.write(result)
+            if supervisor.recycled:
+                logging.info(f"Recycled {supervisor.recycled} worker processes")
+
+            summary['worker_failures'] = supervisor.worker_failures
+            summary['recycled_workers'] = supervisor.recycled
+    finally:
+        if render_service is not None:
+            render_service.close()
+            summary['render_worker_restarts'] = render_service.restarted
+            summary['render_batches_cancelled'] = render_service.cancelled
+            summary['render_batches_timed_out'] = render_service.timed_out
+        if metadata_service is not None:
+            # Waits for the metadata requests still in flight
+            metadata_service.close()
+            summary['metadata'] = metadata_service.as_dict()
+
+    summary['elapsed_seconds'] = round(time.time() - start_time, 1)
+    write_json_atomic(os.path.join(output_folder, 'run_summary.json'), summary)
+    if summary['timeouts']:
+        print(f"{Fore.YELLOW}{len(summary['timeouts'])} files timed out, see run_summary.json{Style.RESET_ALL}")
+
+    logging.info("Finished processing all files")
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+from graphs import broad_phase
+from graphs.broad_phase import candidate_pairs, pair_tolerances
+
+
+def brute_force_pairs(boxes, diagonals):
+    # Every pair whose boxes are no further apart than the pair tolerance on every axis
+    pairs = []
+    for i in range(len(boxes)):
+        for j in range(i + 1, len(boxes)):
+            tolerance = pair_tolerances(diagonals, i, j)
+            gaps = [max(boxes[i, axis] - boxes[j, axis + 3], boxes[j, axis] - boxes[i, axis + 3])
+                    for axis in range(3)]
+            if max(gaps) <= tolerance:
+                pairs.append((i, j))
+    return pairs
+
+
+def random_boxes(rng, n, extent, size):
+    corners = rng.uniform(0, extent, (n, 3))
+    boxes = np.hstack((corners, corners + rng.uniform(0.01, size, (n, 3))))
+    diagonals = np.linalg.norm(boxes[:, 3:] - boxes[:, :3], axis=1)
+    return boxes, diagonals
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_sweep_matches_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    boxes, diagonals = random_boxes(rng, 200, 100, 15)
+
+    i, j = candidate_pairs(boxes, diagonals, 'sweep')
+    assert list(zip(i.tolist(), j.tolist())) == brute_force_pairs(boxes, diagonals)
+
+
+def test_sweep_matches_brute_force_for_touching_and_nearly_touching_boxes():
+    # A row of unit boxes: touching, within tolerance, and just past it
+    gaps = [0.0, 0.00005, 0.0002, 0.0, 1.0, 0.0]
+    boxes = []
+    xmin = 0.0
+    for gap in gaps + [0.0]:
+        boxes.append((xmin, 0, 0, xmin + 1, 1, 1))
+        xmin += 1 + gap
+    boxes = np.array(boxes)
+    diagonals = np.linalg.norm(boxes[:, 3:] - boxes[:, :3], axis=1)
+
+    i, j = candidate_pairs(boxes, diagonals, 'sweep')
+    pairs = list(zip(i.tolist(), j.tolist()))
+    assert pairs == brute_force_pairs(boxes, diagonals)
+    assert pairs == [(0, 1), (1, 2), (3, 4), (5, 6)]
+
+
+def test_sweep_matches_brute_force_across_blocks(monkeypatch):
+    # Many overlapping boxes, expanded a few pairs at a time
+    monkeypatch.setattr(broad_phase, 'SWEEP_BLOCK', 7)
+    rng = np.random.default_rng(42)
+    boxes, diagonals = random_boxes(rng, 60, 10, 5)
+
+    i, j = candidate_pairs(boxes, diagonals, 'sweep')
+    assert list(zip(i.tolist(), j.tolist())) == brute_force_pairs(boxes, diagonals)
+
+
+def test_sweep_with_fewer_than_two_boxes():
+    boxes = np.array([[0, 0, 0, 1, 1, 1]], dtype=float)
+    i, j = candidate_pairs(boxes, np.array([np.sqrt(3)]), 'sweep')
+    assert len(i) == 0 and len(j) == 0
+
+
+def test_sweep_matches_rtree():
+    pytest.importorskip('rtree')
+    rng = np.random.default_rng(7)
+    boxes, diagonals = random_boxes(rng, 300, 100, 15)
+
+    sweep = candidate_pairs(boxes, diagonals, 'sweep')
+    rtree = candidate_pairs(boxes, diagonals, 'rtree')
+    assert list(zip(*map(np.ndarray.tolist, sweep))) == list(zip(*map(np.ndarray.tolist, rtree)))
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+from processing.build_manifest import BuildManifest
+from utils.file_utils import compute_file_hash
+
+OPTIONS = {'formats': ['graphml'], 'gzip': False}
+
+
+@pytest.fixture
+def built(tmp_path):
+    # A manifest saved after building the assembly graph of model.step
+    step_path = tmp_path / 'model.step'
+    step_path.write_text('ISO-10303-21;')
+    graph_path = tmp_path / 'model_assembly.graphml'
+    graph_path.write_text('<graphml />')
+    input_hash = compute_file_hash(str(step_path))
+    manifest = BuildManifest(str(tmp_path), 'model')
+    manifest.record('assembly', input_hash, OPTIONS, [str(graph_path)], stats={'nodes': 3})
+    manifest.save()
+    return tmp_path, step_path, graph_path, input_hash
+
+
+def test_unchanged_artifact_is_skipped(built):
+    tmp_path, _, _, input_hash = built
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert manifest.is_up_to_date('assembly', input_hash, OPTIONS)
+    assert manifest.get('assembly')['files'] == ['model_assembly.graphml']
+    assert manifest.statistics(['assembly', 'images']) == {'assembly': {'nodes': 3}}
+
+
+def test_changed_step_file_is_rebuilt(built):
+    tmp_path, step_path, _, _ = built
+    step_path.write_text('ISO-10303-21; changed')
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert not manifest.is_up_to_date('assembly', compute_file_hash(str(step_path)), OPTIONS)
+
+
+def test_changed_options_are_rebuilt(built):
+    tmp_path, _, _, input_hash = built
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert not manifest.is_up_to_date('assembly', input_hash, {'formats': ['graphml'], 'gzip': True})
+
+
+def test_missing_output_file_is_rebuilt(built):
+    tmp_path, _, graph_path, input_hash = built
+    graph_path.unlink()
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert not manifest.is_up_to_date('assembly', input_hash, OPTIONS)
+
+
+def test_unrecorded_artifact_is_built(built):
+    tmp_path, _, _, input_hash = built
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert not manifest.is_up_to_date('hierarchical', input_hash, OPTIONS)
+
+
+def test_unsupported_version_is_ignored(built):
+    tmp_path, _, _, input_hash = built
+    path = tmp_path / 'model_manifest.json'
+    data = json.loads(path.read_text())
+    data['version'] = BuildManifest.VERSION + 1
+    path.write_text(json.dumps(data))
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert manifest.get('assembly') is None
+    assert not manifest.is_up_to_date('assembly', input_hash, OPTIONS)
+
+
+def test_unreadable_manifest_is_ignored(built):
+    tmp_path, _, _, input_hash = built
+    (tmp_path / 'model_manifest.json').write_text('{not json')
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert not manifest.is_up_to_date('assembly', input_hash, OPTIONS)
+
+
+def test_failed_metadata_generation_stays_pending(built):
+    tmp_path, _, _, input_hash = built
+    options = {'images_metadata': False}
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+    manifest.record('metadata', input_hash, options, [], stats={'generated': False})
+    manifest.save()
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+
+    assert not manifest.is_up_to_date('metadata', input_hash, options)
+    assert manifest.statistics(['metadata']) == {'metadata': {'generated': False}}
+
+
+def test_skipped_metadata_is_up_to_date(built):
+    tmp_path, _, _, input_hash = built
+    options = {'images_metadata': False}
+    manifest = BuildManifest(str(tmp_path), 'model').load()
+    manifest.record('metadata', input_hash, options, [], stats={'skipped': 'fewer than 4 parts'})
+
+    assert manifest.is_up_to_date('metadata', input_hash, options)
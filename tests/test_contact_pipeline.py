@@ -0,0 +1,59 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+pytest.importorskip('OCC.Core.BRepPrimAPI')
+
+from OCC.Core.BRepPrimAPI import BRepPrimAPI_MakeBox, BRepPrimAPI_MakeCylinder
+from OCC.Core.gp import gp_Ax2, gp_Dir, gp_Pnt
+
+from graphs.contact_pipeline import ContactPipeline
+from utils.part_geometry import PartGeometry
+from utils.shape_utils import ShapeUtils
+
+
+def box(corner, size):
+    return BRepPrimAPI_MakeBox(gp_Pnt(*corner), size, size, size).Shape()
+
+
+def test_nested_solid_is_connected():
+    # The inner box is far from every face of the outer one, but inside it
+    outer = PartGeometry(box((0, 0, 0), 100))
+    inner = PartGeometry(box((40, 40, 40), 20))
+
+    assert ShapeUtils.are_parts_connected(outer, inner)
+    pipeline = ContactPipeline()
+    assert pipeline.are_connected(outer, inner)
+    assert pipeline.counts['mesh']['rejected'] == 0
+
+
+def test_separate_solids_are_not_connected():
+    first = PartGeometry(box((0, 0, 0), 10))
+    second = PartGeometry(box((30, 0, 0), 10))
+
+    assert not ContactPipeline().are_connected(first, second)
+
+
+def test_touching_solids_are_accepted_by_the_mesh():
+    first = PartGeometry(box((0, 0, 0), 10))
+    second = PartGeometry(box((10, 0, 0), 10))
+
+    pipeline = ContactPipeline()
+    assert pipeline.are_connected(first, second)
+    assert pipeline.counts['mesh']['accepted'] == 1
+
+
+def test_touching_cylinders_meshed_first_are_connected():
+    # Tangent along a line; a box around coarse mesh nodes could miss that
+    first = PartGeometry(BRepPrimAPI_MakeCylinder(gp_Ax2(gp_Pnt(0, 0, 0), gp_Dir(0, 0, 1)), 10, 50).Shape())
+    second = PartGeometry(BRepPrimAPI_MakeCylinder(gp_Ax2(gp_Pnt(20, 0, 0), gp_Dir(0, 0, 1)), 10, 50).Shape())
+    first.mesh()
+    second.mesh()
+
+    assert ShapeUtils.are_parts_connected(first, second)
+    pipeline = ContactPipeline()
+    assert pipeline.are_connected(first, second)
+    assert pipeline.counts['obb']['rejected'] == 0
@@ -0,0 +1,94 @@
+import os
+import sys
+
+import networkx as nx
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+from graphs.graphml_stream import StreamingGraphMLWriter
+from graphs.writers import graphml_path, write_graph
+
+
+class ColumnGraph:
+    """
+    A small graph in the column form write_graph takes.
+    """
+    def __init__(self, directed):
+        self.directed = directed
+
+    def columns(self):
+        node_columns = {
+            'id': ['root', 'part <1>', 'part "2" & co', 'bare'],
+            'label': np.array([0, 1, 1, -1]),
+            'volume': np.array([1.0 / 3, 2.5e-17, np.nan, 123456789.123456789]),
+            'name': ['Assembly', 'Bolt M6', 'Nuté', None],
+        }
+        categories = {'label': ['assembly', 'part']}
+        edges = np.array([[0, 1], [0, 2], [1, 2], [2, 3]])
+        return node_columns, categories, edges, self.directed
+
+    def edge_columns(self):
+        return {'kind': np.array([0, 0, 1, -1]), 'distance': np.array([0.1, np.nan, 1e-9, 7.0])}, \
+            {'kind': ['contains', 'contact']}
+
+    def expected(self):
+        graph = nx.DiGraph() if self.directed else nx.Graph()
+        graph.add_node('root', label='assembly', volume=1.0 / 3, name='Assembly')
+        graph.add_node('part <1>', label='part', volume=2.5e-17, name='Bolt M6')
+        graph.add_node('part "2" & co', label='part', name='Nuté')
+        graph.add_node('bare', volume=123456789.123456789)
+        graph.add_edge('root', 'part <1>', kind='contains', distance=0.1)
+        graph.add_edge('root', 'part "2" & co', kind='contains')
+        graph.add_edge('part <1>', 'part "2" & co', kind='contact', distance=1e-9)
+        graph.add_edge('part "2" & co', 'bare', distance=7.0)
+        return graph
+
+
+def assert_same_graph(graph, expected):
+    assert graph.is_directed() == expected.is_directed()
+    assert dict(graph.nodes(data=True)) == dict(expected.nodes(data=True))
+    assert sorted(graph.edges(data=True)) == sorted(expected.edges(data=True))
+
+
+@pytest.mark.parametrize('directed', [False, True])
+@pytest.mark.parametrize('compress', [False, True])
+def test_written_graphml_reads_back(tmp_path, directed, compress):
+    graph = ColumnGraph(directed)
+    base_path = str(tmp_path / 'assembly')
+
+    files, stats = write_graph(graph, base_path, ['graphml'], compress=compress)
+
+    assert files == [graphml_path(base_path, compress)]
+    assert stats['graphml']['bytes'] == os.path.getsize(files[0])
+    assert_same_graph(nx.read_graphml(files[0]), graph.expected())
+
+
+def test_streamed_graphml_matches_networkx(tmp_path):
+    expected = ColumnGraph(True).expected()
+    streamed = str(tmp_path / 'streamed.graphml')
+    written = str(tmp_path / 'written.graphml')
+
+    with StreamingGraphMLWriter(streamed, True, ['label', ('volume', 'double'), 'name'],
+                                edge_attributes=['kind', ('distance', 'double')]) as writer:
+        for node, data in expected.nodes(data=True):
+            writer.add_node(node, [data.get(name) for name in ('label', 'volume', 'name')])
+        for source, target, data in expected.edges(data=True):
+            writer.add_edge(source, target, [data.get(name) for name in ('kind', 'distance')])
+    nx.write_graphml(expected, written)
+
+    assert writer.nodes == expected.number_of_nodes()
+    assert writer.edges == expected.number_of_edges()
+    assert_same_graph(nx.read_graphml(streamed), nx.read_graphml(written))
+    assert_same_graph(nx.read_graphml(streamed), expected)
+
+
+def test_empty_graph_reads_back(tmp_path):
+    path = str(tmp_path / 'empty.graphml')
+    with StreamingGraphMLWriter(path, False, ['name']):
+        pass
+
+    graph = nx.read_graphml(path)
+    assert not graph.is_directed()
+    assert graph.number_of_nodes() == 0
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+from metadata import metadata_cache
+from metadata.metadata_cache import MetadataCache, DEFAULT_TTL
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(metadata_cache.time, 'time', clock)
+    return clock
+
+
+def entry_size(metadata):
+    return len(json.dumps(metadata))
+
+
+def test_key_ignores_name_order_case_and_spacing():
+    key = MetadataCache.key(['Bolt  M6', 'washer', 'bolt m6'], 'v1', 'model')
+
+    assert key == MetadataCache.key(['WASHER', ' Bolt M6 '], 'v1', 'model')
+    assert key != MetadataCache.key(['Bolt M6', 'washer'], 'v2', 'model')
+    assert key != MetadataCache.key(['Bolt M6', 'washer'], 'v1', 'other model')
+
+
+def test_entry_expires_after_ttl(tmp_path, clock):
+    cache = MetadataCache(str(tmp_path), 1 << 20, ttl=60)
+    cache.put('a', {'category': 'valve'})
+
+    clock.now += 60
+    assert cache.get('a') == {'category': 'valve'}
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.as_dict() == {'hits': 1, 'misses': 1, 'expired': 1, 'evicted': 0}
+    cache.close()
+
+
+def test_expired_entries_are_evicted_on_put(tmp_path, clock):
+    cache = MetadataCache(str(tmp_path), 1 << 20, ttl=60)
+    cache.put('old', {'category': 'valve'})
+    clock.now += 61
+    cache.put('new', {'category': 'pump'})
+
+    assert cache.evicted == 1
+    assert cache.get('new') == {'category': 'pump'}
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    metadata = {'category': 'valve'}
+    cache = MetadataCache(str(tmp_path), 3 * entry_size(metadata))
+    for key in ('a', 'b', 'c'):
+        cache.put(key, metadata)
+        clock.now += 1
+    # Reading 'a' makes 'b' the least recently used entry
+    assert cache.get('a') == metadata
+    clock.now += 1
+    cache.put('d', metadata)
+
+    assert cache.evicted == 1
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in ('a', 'c', 'd')] == [metadata] * 3
+    cache.close()
+
+
+def test_entries_persist_across_instances(tmp_path, clock):
+    cache = MetadataCache(str(tmp_path), 1 << 20)
+    cache.put('a', {'category': 'valve'})
+    cache.close()
+
+    cache = MetadataCache(str(tmp_path), 1 << 20)
+    assert cache.get('a') == {'category': 'valve'}
+    cache.close()
+
+
+def test_none_size_and_ttl_use_the_defaults(tmp_path, clock):
+    metadata = {'category': 'valve'}
+    cache = MetadataCache(str(tmp_path), None, None)
+    for k in range(100):
+        cache.put(str(k), metadata)
+
+    assert cache.ttl == DEFAULT_TTL
+    assert cache.evicted == 0
+    assert cache.get('0') == metadata
+    clock.now += DEFAULT_TTL + 1
+    assert cache.get('0') is None
+    cache.close()
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+pytest.importorskip('openai')
+
+from metadata import metadata_generator
+from metadata.metadata_service import MetadataService
+from processing.build_manifest import BuildManifest
+
+METADATA = {'description': 'Bolted bracket', 'categories': ['fixtures'], 'complexity': 'low',
+            'industry': 'machinery', 'components': ['bolt', 'bracket']}
+
+
+class StubServer:
+    """
+    An OpenAI-compatible chat completions endpoint. Answers with the queued
+    status codes first, then with METADATA, after delay seconds each.
+    """
+    def __init__(self, statuses=(), delay=0.0):
+        self.statuses = list(statuses)
+        self.delay = delay
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                with stub.lock:
+                    stub.requests += 1
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                    status = stub.statuses.pop(0) if stub.statuses else 200
+                time.sleep(stub.delay)
+                if status == 200:
+                    body = {'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': 'stub',
+                            'choices': [{'index': 0, 'finish_reason': 'stop',
+                                         'message': {'role': 'assistant', 'content': json.dumps(METADATA)}}]}
+                else:
+                    body = {'error': {'message': f"status {status}", 'type': 'stub'}}
+                data = json.dumps(body).encode('utf-8')
+                with stub.lock:
+                    stub.in_flight -= 1
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.server.shutdown()
+        self.server.server_close()
+        return False
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    monkeypatch.setattr(metadata_generator, 'BACKOFF_BASE', 0.01)
+
+
+def make_job(tmp_path, name, product_names=('Bolt M6', 'Bracket', 'Washer', 'Nut')):
+    subfolder = tmp_path / name
+    subfolder.mkdir()
+    stats_path = subfolder / f"{name}_statistics.json"
+    stats_path.write_text('{}')
+    return {
+        'filename': f"{name}.step",
+        'name': name,
+        'subfolder': str(subfolder),
+        'product_names': list(product_names),
+        'images_folder': None,
+        'metadata_path': str(subfolder / f"{name}_metadata.json"),
+        'input_hash': 'hash',
+        'options': {'images_metadata': False},
+        'stats_path': str(stats_path)
+    }
+
+
+def run_jobs(jobs, **kwargs):
+    with MetadataService(**kwargs) as service:
+        for job in jobs:
+            service.submit(job)
+    return service.as_dict()
+
+
+def test_requests_stay_within_the_concurrency_limit(tmp_path):
+    jobs = [make_job(tmp_path, f"model{k}", [f"part{k}"]) for k in range(6)]
+    with StubServer(delay=0.2) as stub:
+        stats = run_jobs(jobs, base_url=stub.base_url, concurrency=2)
+
+    assert stub.requests == 6
+    assert stub.max_in_flight == 2
+    assert stats['generated'] == 6
+    for job in jobs:
+        with open(job['metadata_path']) as f:
+            assert json.load(f) == METADATA
+        manifest = BuildManifest(job['subfolder'], job['name']).load()
+        assert manifest.is_up_to_date('metadata', 'hash', job['options'])
+
+
+def test_rate_limits_and_server_errors_are_retried(tmp_path):
+    job = make_job(tmp_path, 'model')
+    with StubServer(statuses=[429, 503, 500]) as stub:
+        stats = run_jobs([job], base_url=stub.base_url, max_retries=3)
+
+    assert stub.requests == 4
+    assert stats['retries'] == 3
+    assert stats['failures'] == 0
+    assert stats['status_codes'] == {'429': 1, '503': 1, '500': 1, '200': 1}
+    assert os.path.exists(job['metadata_path'])
+
+
+def test_failed_generation_is_not_recorded(tmp_path):
+    job = make_job(tmp_path, 'model')
+    with StubServer(statuses=[503] * 3) as stub:
+        stats = run_jobs([job], base_url=stub.base_url, max_retries=2)
+
+    assert stub.requests == 3
+    assert stats['failures'] == 1
+    assert not os.path.exists(job['metadata_path'])
+    # The failure is reported, but the next run tries again
+    assert BuildManifest(job['subfolder'], job['name']).load().get('metadata') is None
+    with open(job['stats_path']) as f:
+        assert json.load(f)['metadata']['generated'] is False
+
+
+def test_cached_answer_skips_the_request(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    with StubServer() as stub:
+        run_jobs([make_job(tmp_path, 'first')], base_url=stub.base_url, cache_dir=cache_dir)
+        # The same parts in another order and case
+        job = make_job(tmp_path, 'second', ['nut', 'WASHER', 'Bracket', 'Bolt M6'])
+        stats = run_jobs([job], base_url=stub.base_url, cache_dir=cache_dir)
+
+    assert stub.requests == 1
+    assert stats['requests'] == 0
+    assert stats['cache']['hits'] == 1
+    with open(job['metadata_path']) as f:
+        assert json.load(f) == METADATA
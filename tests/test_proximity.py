@@ -0,0 +1,57 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'framework'))
+
+from utils import proximity
+from utils.proximity import any_pair_within, build_tree
+
+
+def two_clouds(rng, gap):
+    # Two point clouds whose closest pair is the last point of each, gap apart along x
+    points1 = rng.uniform(-10, 0, (500, 3))
+    points2 = rng.uniform(0, 10, (500, 3)) + [1 + gap, 0, 0]
+    points1[-1] = [1, 2, 3]
+    points2[-1] = [1 + gap, 2, 3]
+    return points1, points2
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_pair_within_tolerance(seed):
+    points1, points2 = two_clouds(np.random.default_rng(seed), 0.25)
+
+    assert any_pair_within(points1, points2, 0.5)
+    assert any_pair_within(points2, points1, 0.5)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_pair_just_outside_tolerance(seed):
+    points1, points2 = two_clouds(np.random.default_rng(seed), 0.25)
+    gap = np.linalg.norm(points2[-1] - points1[-1])
+
+    # The tolerance is inclusive
+    assert any_pair_within(points1, points2, gap)
+    assert not any_pair_within(points1, points2, np.nextafter(gap, 0))
+    assert not any_pair_within(points1, points2, 0.2)
+
+
+def test_empty_inputs():
+    points = np.zeros((3, 3))
+    empty = np.empty((0, 3))
+
+    assert not any_pair_within(empty, points, 1.0)
+    assert not any_pair_within(points, empty, 1.0)
+    assert not any_pair_within(empty, empty, 1.0)
+
+
+def test_prebuilt_tree_and_later_chunk(monkeypatch):
+    # The only close pair is in the last query chunk
+    monkeypatch.setattr(proximity, 'QUERY_CHUNK', 64)
+    points1, points2 = two_clouds(np.random.default_rng(0), 0.25)
+    tree2 = build_tree(points2)
+
+    assert any_pair_within(points1, points2, 0.3, tree2=tree2)
+    assert not any_pair_within(points1, points2, 0.2, tree2=tree2)